@@ -0,0 +1,166 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from DownloadResult import DownloadResult
+from Downloader import YTVideoDownloader
+
+
+class AsyncVideoDownloader:
+    """
+    asyncio front end of YTVideoDownloader for embedding it in services. Extraction and the yt_dlp downloads run on
+    a thread pool, ffmpeg runs as asyncio subprocess, so the event loop is never blocked. Results are yielded per
+    entry as they complete, cancelling the consuming task aborts the running downloads and kills ffmpeg.
+    """
+
+    def __init__(self, downloader: YTVideoDownloader = None, threads: int = 4, encode_threads: int = None):
+        """
+        :param downloader the downloader to use, a new one is created if not given \n
+        :param threads number of concurrent downloads \n
+        :param encode_threads number of concurrent ffmpeg processes, defaults to the core count \n
+        """
+        self.downloader = downloader or YTVideoDownloader()
+        self.threads = max(1, threads)
+        self.encode_threads = max(1, encode_threads or os.cpu_count() or 1)
+        # one extra thread iterates the (lazy) playlists, the encode slots finish tagging and archiving
+        self._executor = ThreadPoolExecutor(max_workers=self.threads + self.encode_threads + 1)
+
+    async def download_async(self, url: str, output_dir: str, **options):
+        """
+        Downloads a video or playlist
+        :param url the url of the video / playlist to download \n
+        :param output_dir the path of the output directory \n
+        :param options further download() keyword arguments (file_format, with_meta, still_frame_image, ...) \n
+        :returns async iterator of per entry result dicts (title, output_path, result, stage, error)
+        """
+        async for result in self.download_many_async([dict(options, url=url, output_dir=output_dir)]):
+            yield result
+
+    async def download_many_async(self, jobs: list):
+        """
+        Downloads several urls sharing the same download and encode slots
+        :param jobs list of dicts holding download() keyword arguments, url and output_dir are required, a threads
+        key caps the concurrent downloads of that job within the shared slots \n
+        :returns async iterator of per entry result dicts (url, title, output_path, result, stage, error), result is
+        the DownloadResult of the entry
+        """
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        cancel_event = threading.Event()
+        download_slots = asyncio.Semaphore(self.threads)
+        encode_slots = asyncio.Semaphore(self.encode_threads)
+        in_flight = asyncio.Semaphore(self.threads * 2)
+        pending = set()
+
+        def listener_for(job):
+            def listener(entry, result, error, stage):
+                # skipped entries are reported from the iterating thread, everything else from the loop
+                loop.call_soon_threadsafe(results.put_nowait, self._to_result(job, entry, result, error, stage))
+
+            return listener
+
+        async def run_task(entry, download, on_result, job_slots):
+            scheduler = self.downloader.retry_scheduler
+            host = scheduler.host_of(entry)
+            attempt = 0
+            try:
+                while True:
+                    # waits for a cooldown or retry without holding a download slot
+                    await asyncio.sleep(scheduler.cooldown(host))
+                    async with job_slots, download_slots:
+                        try:
+                            post_process = await loop.run_in_executor(
+                                self._executor,
+                                lambda: self.downloader.run_in_context(download, cancel_event=cancel_event))
+                            break
+                        except Exception as e:
+                            attempt += 1
+                            delay = scheduler.retry_delay(e, attempt, getattr(download, "retry_policy", None), host)
+                            if delay is None:
+                                on_result(entry, None, e, "Download")
+                                return
+                            self.downloader.metrics.inc("retries_total")
+                    await asyncio.sleep(delay)
+                scheduler.succeeded(host)
+                async with encode_slots:
+                    try:
+                        plan = getattr(post_process, "plan", None)
+                        if plan is not None:
+                            with self.downloader.metrics.timer("ffmpeg"):
+                                await plan.run_async()
+                        result = await loop.run_in_executor(self._executor, post_process)
+                    except Exception as e:
+                        on_result(entry, None, e, "Post-processing")
+                        return
+                on_result(entry, result, None, "Post-processing")
+            finally:
+                in_flight.release()
+
+        def with_job_slots(job):
+            job_slots = asyncio.Semaphore(max(1, job.get("threads") or self.threads))
+            for entry, download, on_result in self.downloader._job_tasks(job, self._summary(job), listener_for(job)):
+                yield entry, download, on_result, job_slots
+
+        async def produce():
+            job_tasks = [with_job_slots(job) for job in jobs]
+            tasks = self.downloader._interleave(job_tasks)
+            while True:
+                await in_flight.acquire()
+                task = await loop.run_in_executor(self._executor, next, tasks, None)
+                if task is None:
+                    in_flight.release()
+                    break
+                future = asyncio.ensure_future(run_task(*task))
+                pending.add(future)
+                future.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+
+        with self.downloader._report_stats():
+            producer = asyncio.ensure_future(produce())
+            try:
+                while True:
+                    next_result = asyncio.ensure_future(results.get())
+                    await asyncio.wait({next_result, producer}, return_when=asyncio.FIRST_COMPLETED)
+                    if next_result.done():
+                        yield next_result.result()
+                        continue
+                    next_result.cancel()
+                    # let the results scheduled by the last tasks arrive before draining
+                    await asyncio.sleep(0)
+                    while not results.empty():
+                        yield results.get_nowait()
+                    producer.result()
+                    break
+            finally:
+                if not producer.done():
+                    cancel_event.set()
+                    producer.cancel()
+                    for future in list(pending):
+                        future.cancel()
+                    await asyncio.gather(producer, *pending, return_exceptions=True)
+
+    @staticmethod
+    def _summary(job: dict) -> dict:
+        # the results are streamed to the caller, not collected
+        return {"url": job["url"], "downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+
+    @staticmethod
+    def _to_result(job: dict, entry: dict, result: dict, error: Exception, stage: str) -> dict:
+        if result:
+            output_path, record = next(iter(result.items()))
+        else:
+            output_path = None
+            record = DownloadResult.from_info(entry, status="failed", stage=stage, error=str(error))
+        return {
+            "url": job["url"],
+            "title": record.title,
+            "output_path": output_path,
+            "result": record,
+            "stage": stage,
+            "error": error,
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,82 @@
+import re
+import threading
+import time
+
+_RATE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?(?:/s)?\s*$', re.IGNORECASE)
+
+
+def parse_rate(value):
+    """
+    Parses a rate like 500K, 2.5M or 1G (bytes per second, 1024 based like yt_dlp), empty or 0 means unlimited
+    :returns the rate in bytes per second or None for unlimited
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value or None
+    if not value.strip():
+        return None
+    match = _RATE_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Invalid rate '{value}', expected a number optionally followed by K, M, G or T")
+    number, unit = match.groups()
+    multiplier = 1024 ** ('kmgt'.find(unit.lower()) + 1) if unit else 1
+    return int(float(number) * multiplier) or None
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by every download thread of a downloader, so the total throughput stays at the budget no
+    matter how many threads are running. Downloads draw their received bytes from the bucket through the yt_dlp
+    progress hook and sleep once they are ahead of the budget. Both rates can be changed while downloads are running.
+    """
+
+    def __init__(self, rate: float = None, entry_rate: float = None, burst_seconds: float = 1):
+        """
+        :param rate total bytes per second of all downloads, None for unlimited \n
+        :param entry_rate bytes per second of a single download, enforced by yt_dlp's own rate limit \n
+        :param burst_seconds how many seconds of budget an idle bucket can save up \n
+        """
+        self._lock = threading.Lock()
+        self.burst_seconds = burst_seconds
+        self.rate = None
+        self.entry_rate = None
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, entry_rate)
+
+    def set_rate(self, rate: float = None, entry_rate: float = None) -> None:
+        """
+        Changes the budget, running downloads follow the total rate right away, the entry rate applies to the streams
+        started afterwards
+        """
+        with self._lock:
+            self._refill()
+            self.rate = parse_rate(rate)
+            self.entry_rate = parse_rate(entry_rate)
+            if self.rate:
+                self._tokens = min(self._tokens, self.rate * self.burst_seconds)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * self.burst_seconds)
+        self._updated = now
+
+    def consume(self, byte_count: int, cancel_event: threading.Event = None) -> None:
+        """
+        Takes the bytes out of the bucket, blocking the calling download until the budget allows them. The bucket
+        may go into debt, the debt is then paid off by the waiting of the thread that caused it.
+        :param cancel_event stops waiting early once set
+        """
+        if byte_count <= 0:
+            return
+        with self._lock:
+            if not self.rate:
+                return
+            self._refill()
+            self._tokens -= byte_count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            if cancel_event is not None:
+                cancel_event.wait(wait)
+            else:
+                time.sleep(wait)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CoverCache:
+    """
+    Content addressed cache of cover images. Thumbnails are downloaded once over a pooled http session and user
+    supplied images are keyed by their content, every image is normalized once into a baseline JPEG of bounded size
+    that every container can embed, and is then shared by all entries (embedded covers, native tags, still frames).
+    The least recently used images are evicted once the cache grows past its size limit.
+    """
+
+    max_dimension = 1200
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = 256 * 1024 * 1024, session: requests.Session = None):
+        """
+        :param cache_dir where normalized images are stored, defaults to a directory in the system temp dir
+        :param max_bytes size of the cache after which the least recently used images are evicted
+        :param session the http session images are downloaded with, a pooled session is created if not given
+        """
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "ytvd_covers")
+        self.max_bytes = max_bytes
+        self.session = session or self.pooled_session()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # content keys of local files by (path, size, mtime), so an image is only hashed once per run
+        self._file_keys = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def pooled_session(pool_size: int = 16) -> requests.Session:
+        """
+        :returns a session keeping up to pool_size connections per host open for reuse by all threads
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def is_url(source: str) -> bool:
+        return source.startswith(('http://', 'https://'))
+
+    def key(self, source: str, max_dimension: int) -> str:
+        if self.is_url(source):
+            digest = hashlib.sha256(source.encode())
+        else:
+            stat = os.stat(source)
+            file_key = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+            digest = self._file_keys.get(file_key)
+            if digest is None:
+                digest = hashlib.sha256()
+                with open(source, 'rb') as image:
+                    for chunk in iter(lambda: image.read(1 << 20), b''):
+                        digest.update(chunk)
+                self._file_keys[file_key] = digest
+            digest = digest.copy()
+        digest.update(f"|{max_dimension}".encode())
+        return digest.hexdigest()
+
+    def get(self, source: str, max_dimension: int = None) -> str:
+        """
+        :param source url or path of the image
+        :param max_dimension longest side of the normalized image, defaults to max_dimension of the cache
+        :returns the path of the normalized JPEG, created if it is not cached yet
+        """
+        max_dimension = max_dimension or self.max_dimension
+        key = self.key(source, max_dimension)
+        image_file = os.path.join(self.cache_dir, key + ".jpg")
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.exists(image_file):
+                # the modification time orders the images for eviction
+                os.utime(image_file)
+                return image_file
+            raw_file = self._fetch(source, key) if self.is_url(source) else source
+            temp_image_file = os.path.join(self.cache_dir, f"{key}.{threading.get_ident()}.partial.jpg")
+            try:
+                self._normalize(raw_file, temp_image_file, max_dimension)
+                os.replace(temp_image_file, image_file)
+            finally:
+                for temp_file in (temp_image_file, raw_file if raw_file != source else None):
+                    if temp_file and os.path.exists(temp_file):
+                        os.remove(temp_file)
+        self._evict(keep=image_file)
+        return image_file
+
+    def _fetch(self, url: str, key: str) -> str:
+        raw_file = os.path.join(self.cache_dir, f"{key}.{threading.get_ident()}.download")
+        with self.session.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            with open(raw_file, 'wb') as out_file:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    out_file.write(chunk)
+        return raw_file
+
+    @staticmethod
+    def _normalize(raw_file: str, image_file: str, max_dimension: int) -> None:
+        """
+        Converts the image into a baseline yuvj420p JPEG with even dimensions no larger than max_dimension
+        """
+        scale = (f"scale='min({max_dimension},iw)':'min({max_dimension},ih)':force_original_aspect_ratio=decrease,"
+                 f"scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuvj420p")
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', raw_file, '-frames:v', '1', '-vf', scale,
+               '-q:v', '2', '-f', 'image2', '-c:v', 'mjpeg', image_file]
+        subprocess.run(cmd, check=True)
+
+    def _evict(self, keep: str = None) -> None:
+        """
+        Removes the least recently used images until the cache fits into max_bytes
+        """
+        images = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".jpg") or name.endswith(".partial.jpg"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            images.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in images)
+        for _, size, path in sorted(images):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class DownloadArchive:
+    """
+    Persistent index of finished downloads stored as SQLite database in the output directory, keyed by extractor,
+    video id and output format. Used to skip entries that were already downloaded when a playlist is synced again.
+    Every thread gets its own connection, writes are serialized so the download threads can record concurrently.
+    """
+
+    file_name = ".download_archive.sqlite3"
+
+    def __init__(self, output_dir: str):
+        """
+        :param output_dir the directory the archive (and the downloads it indexes) lives in
+        """
+        self.path = os.path.join(output_dir, self.file_name)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            connection = self._connection()
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    extractor TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    file_format TEXT NOT NULL,
+                    output_path TEXT NOT NULL,
+                    size INTEGER,
+                    postprocess_state TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (extractor, video_id, file_format)
+                )""")
+            connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key_of(info_dict: dict) -> tuple:
+        """
+        :param info_dict a (flat) yt_dlp entry
+        :returns (extractor, video id) of the entry, values are None if unknown
+        """
+        extractor = info_dict.get('extractor_key') or info_dict.get('ie_key') or info_dict.get('extractor')
+        return (extractor.lower() if extractor else None), info_dict.get('id')
+
+    def get(self, extractor: str, video_id: str, file_format: str):
+        """
+        :returns the archive record as dict or None if the video is not archived in that format
+        """
+        row = self._connection().execute(
+            "SELECT * FROM downloads WHERE extractor = ? AND video_id = ? AND file_format = ?",
+            (extractor, video_id, file_format)).fetchone()
+        return dict(row) if row else None
+
+    def contains(self, extractor: str, video_id: str, file_format: str) -> bool:
+        """
+        :returns if the video was downloaded in that format and the output file still exists
+        """
+        record = self.get(extractor, video_id, file_format)
+        return record is not None and os.path.exists(record["output_path"])
+
+    def record(self, extractor: str, video_id: str, file_format: str, output_path: str,
+               postprocess_state: list = None) -> None:
+        """
+        Adds or updates the archive record of a finished download
+        :param postprocess_state the post-processing steps that were applied to the output
+        """
+        size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+        with self._write_lock:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (extractor, video_id, file_format, output_path, size, ",".join(postprocess_state or []),
+                 time.time()))
+            connection.commit()
+
+    def query(self, extractor: str = None, file_format: str = None) -> list:
+        """
+        :returns all records, optionally filtered by extractor and format, oldest first
+        """
+        sql = "SELECT * FROM downloads WHERE (? IS NULL OR extractor = ?) AND (? IS NULL OR file_format = ?)"
+        rows = self._connection().execute(sql + " ORDER BY updated_at",
+                                          (extractor, extractor, file_format, file_format)).fetchall()
+        return [dict(row) for row in rows]
+
+    def prune(self, missing_only: bool = True, older_than: float = None) -> int:
+        """
+        Removes records from the archive, the downloaded files are left untouched
+        :param missing_only only remove records whose output file no longer exists
+        :param older_than only remove records last updated more than this many seconds ago
+        :returns the number of removed records
+        """
+        removed = 0
+        with self._write_lock:
+            connection = self._connection()
+            for record in self.query():
+                if missing_only and os.path.exists(record["output_path"]):
+                    continue
+                if older_than is not None and time.time() - record["updated_at"] < older_than:
+                    continue
+                connection.execute(
+                    "DELETE FROM downloads WHERE extractor = ? AND video_id = ? AND file_format = ?",
+                    (record["extractor"], record["video_id"], record["file_format"]))
+                removed += 1
+            connection.commit()
+        return removed
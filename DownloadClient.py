@@ -0,0 +1,55 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+
+class DownloadClient:
+    """
+    Client of the DownloadServer api, only uses the standard library so it starts as fast as the command line parser
+    """
+
+    def __init__(self, server: str = "http://127.0.0.1:8765", timeout: float = 30):
+        self.server = server.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: dict = None) -> dict:
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.server + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error")
+            except ValueError:
+                message = e.reason
+            raise RuntimeError(f"{method} {path} failed with status {e.code}: {message}") from None
+
+    def submit(self, job: dict) -> int:
+        """
+        :param job download() keyword arguments, url and output_dir are required
+        :returns the id of the queued job
+        """
+        return self._request("POST", "/jobs", job)["id"]
+
+    def status(self, job_id: int) -> dict:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id: int) -> bool:
+        return self._request("POST", f"/jobs/{job_id}/cancel", {})["cancelled"]
+
+    def jobs(self) -> list:
+        return self._request("GET", "/jobs")["jobs"]
+
+    def wait(self, job_id: int, interval: float = 1) -> dict:
+        """
+        Polls the job until it finished
+        :returns the final status of the job
+        """
+        while True:
+            status = self.status(job_id)
+            if status["state"] in ("done", "failed", "cancelled"):
+                return status
+            time.sleep(interval)
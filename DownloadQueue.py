@@ -0,0 +1,281 @@
+import functools
+import queue
+import threading
+from collections import OrderedDict
+
+import yt_dlp
+
+from Downloader import YTVideoDownloader
+
+
+class QueuedJob:
+    """
+    A download job of a DownloadQueue. The worker thread updates it, readers get copies through
+    DownloadQueue.snapshot.
+    """
+
+    def __init__(self, job_id: int, job: dict):
+        self.id = job_id
+        self.job = job
+        # queued, running, done, failed, cancelled
+        self.state = "queued"
+        self.error = None
+        self.summary = None
+        self.cancel_event = threading.Event()
+        # entry key -> {"title", "stage", "error", "streams": {file name: [downloaded, total]}, "version"}
+        self.entries = OrderedDict()
+        self.version = 0
+
+
+class DownloadQueue:
+    """
+    Runs download jobs on background worker threads, the entries of a job on the download and encode pools of the
+    downloader. Jobs can be submitted while others are running and cancelled individually, a cancelled job stops its
+    running downloads and starts no further entries, ffmpeg passes that already started are finished. Readers poll
+    the state with snapshot, which only copies what changed since their last poll.
+    """
+
+    # finished jobs kept for status queries, older ones are forgotten
+    max_finished_jobs = 200
+
+    def __init__(self, downloader: YTVideoDownloader = None, threads: int = 4, encode_threads: int = None,
+                 workers: int = 1, on_state=None):
+        """
+        :param downloader the downloader to use, a new one is created if not given \n
+        :param threads number of concurrent downloads of a job, a job may override it with a threads key \n
+        :param encode_threads number of concurrent ffmpeg processes of a job, defaults to the core count \n
+        :param workers number of jobs running at the same time \n
+        :param on_state optionally called with (job id, state) whenever a job changes its state \n
+        """
+        self.downloader = downloader or YTVideoDownloader()
+        self.threads = threads
+        self.encode_threads = encode_threads
+        self.on_state = on_state
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._version = 0
+        self._pending = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, name=f"download-queue-{index}", daemon=True)
+                         for index in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job: dict, job_id: int = None) -> int:
+        """
+        :param job dict of download() keyword arguments like the jobs of download_many, url and output_dir are
+        required \n
+        :param job_id id of the job, by default the next free one \n
+        :returns the id of the queued job
+        """
+        with self._lock:
+            job_id = job_id or self._next_id
+            if job_id in self._jobs:
+                raise ValueError(f"Job {job_id} already exists")
+            self._next_id = max(self._next_id, job_id + 1)
+            queued = QueuedJob(job_id, job)
+            self._jobs[queued.id] = queued
+            self._touch(queued)
+        self._pending.put(queued)
+        return queued.id
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        :returns False if the job is unknown or already finished
+        """
+        with self._lock:
+            queued = self._jobs.get(job_id)
+            if queued is None or queued.state in ("done", "failed", "cancelled"):
+                return False
+            queued.cancel_event.set()
+            changed = queued.state == "queued"
+            if changed:
+                queued.state = "cancelled"
+            self._touch(queued)
+        if changed:
+            self._state_changed(queued)
+        return True
+
+    def status(self, job_id: int, with_entries: bool = True):
+        """
+        :returns the dict of the job like snapshot, with all of its entries, None if the job is unknown
+        """
+        with self._lock:
+            queued = self._jobs.get(job_id)
+            return self._job_dict(queued, 0 if with_entries else None) if queued else None
+
+    def jobs(self) -> list:
+        """
+        :returns the dicts of all jobs without their entries
+        """
+        with self._lock:
+            return [self._job_dict(queued, None) for queued in self._jobs.values()]
+
+    def snapshot(self, since: int = 0) -> tuple:
+        """
+        :param since the version returned by the previous call, 0 for everything \n
+        :returns (version, jobs) with a dict per job (id, url, state, error, entries) holding only the jobs and
+        entries changed after since, every entry as dict (key, title, stage, error, downloaded, total)
+        """
+        with self._lock:
+            jobs = [self._job_dict(queued, since) for queued in self._jobs.values() if queued.version > since]
+            return self._version, jobs
+
+    @staticmethod
+    def _job_dict(queued: QueuedJob, since) -> dict:
+        # callers hold the lock, since None leaves the entries out
+        job = {"id": queued.id, "url": queued.job["url"], "state": queued.state, "error": queued.error,
+               "summary": queued.summary}
+        if since is None:
+            return job
+        job["entries"] = []
+        for key, entry in queued.entries.items():
+            if entry["version"] <= since:
+                continue
+            streams = entry["streams"].values()
+            job["entries"].append({"key": key, "title": entry["title"], "stage": entry["stage"],
+                                   "error": entry["error"], "downloaded": sum(stream[0] for stream in streams),
+                                   "total": sum(stream[1] for stream in streams)})
+        return job
+
+    def close(self, cancel: bool = True) -> None:
+        """
+        Stops the worker once the running job finished
+        :param cancel if set, the running and all queued jobs are cancelled first
+        """
+        if cancel:
+            for job_id in list(self._jobs):
+                self.cancel(job_id)
+        for _ in self._workers:
+            self._pending.put(None)
+
+    def join(self, timeout: float = None) -> None:
+        """
+        Waits for the workers stopped by close
+        """
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _touch(self, queued: QueuedJob, entry: dict = None) -> None:
+        # callers hold the lock
+        self._version += 1
+        queued.version = self._version
+        if entry is not None:
+            entry["version"] = self._version
+
+    def _work(self) -> None:
+        while True:
+            queued = self._pending.get()
+            if queued is None:
+                return
+            with self._lock:
+                if queued.cancel_event.is_set():
+                    continue
+                queued.state = "running"
+                self._touch(queued)
+            self._state_changed(queued)
+            self._run(queued)
+            self._state_changed(queued)
+            self._forget_finished()
+
+    def _state_changed(self, queued: QueuedJob) -> None:
+        if self.on_state:
+            self.on_state(queued.id, queued.state)
+
+    def _forget_finished(self) -> None:
+        with self._lock:
+            finished = [job_id for job_id, queued in self._jobs.items()
+                        if queued.state in ("done", "failed", "cancelled")]
+            for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+                del self._jobs[job_id]
+
+    def _run(self, queued: QueuedJob) -> None:
+        job = queued.job
+        summary = {"url": job["url"], "downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+        tasks = self.downloader._job_tasks(job, summary, functools.partial(self._on_result, queued))
+        error = None
+        try:
+            with self.downloader._report_stats():
+                # entries waiting for a retry are dropped once the job is cancelled
+                self.downloader.run_in_context(self.downloader._run_pipeline, self._queued_tasks(queued, tasks),
+                                               job.get("threads", self.threads), self.encode_threads,
+                                               cancel_event=queued.cancel_event)
+        except Exception as e:
+            error = e
+        with self._lock:
+            queued.summary = summary
+            if queued.cancel_event.is_set():
+                queued.state = "cancelled"
+            elif error is not None or summary["failed"]:
+                queued.state = "failed"
+                queued.error = str(error) if error is not None else f"{summary['failed']} entries failed"
+            else:
+                queued.state = "done"
+            self._touch(queued)
+
+    def _queued_tasks(self, queued: QueuedJob, tasks):
+        """
+        Wraps the download tasks of a job so they run in its context, stops pulling entries once it is cancelled
+        """
+        try:
+            for entry, download, on_result in tasks:
+                if queued.cancel_event.is_set():
+                    return
+                key = self._entry_key(entry)
+                self._update_entry(queued, key, entry, stage="Queued")
+                queued_download = functools.partial(self._download, queued, key, entry, download)
+                queued_download.retry_policy = getattr(download, "retry_policy", None)
+                yield entry, queued_download, on_result
+        finally:
+            tasks.close()
+
+    def _download(self, queued: QueuedJob, key: str, entry: dict, download):
+        # retries may start after the job was cancelled
+        if queued.cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+        self._update_entry(queued, key, entry, stage="Downloading")
+        post_process = self.downloader.run_in_context(
+            download, cancel_event=queued.cancel_event,
+            progress_listener=functools.partial(self._on_progress, queued, key))
+        self._update_entry(queued, key, entry, stage="Waiting for ffmpeg")
+
+        def run_post_process():
+            if queued.cancel_event.is_set():
+                raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+            self._update_entry(queued, key, entry, stage="Post-processing")
+            return post_process()
+
+        return run_post_process
+
+    @staticmethod
+    def _entry_key(entry: dict) -> str:
+        return str(entry.get('id') or entry.get('url') or entry.get('title'))
+
+    def _update_entry(self, queued: QueuedJob, key: str, entry: dict, stage: str, error: str = None) -> None:
+        with self._lock:
+            state = queued.entries.get(key)
+            if state is None:
+                state = queued.entries[key] = {"title": entry.get('title') or entry.get('url') or key,
+                                               "streams": {}, "version": 0}
+            state["stage"] = stage
+            state["error"] = error
+            self._touch(queued, state)
+
+    def _on_progress(self, queued: QueuedJob, key: str, progress: dict) -> None:
+        with self._lock:
+            state = queued.entries.get(key)
+            if state is None:
+                return
+            stream = state["streams"].setdefault(progress.get('filename'), [0, 0])
+            stream[0] = progress.get('downloaded_bytes') or stream[0]
+            stream[1] = progress.get('total_bytes') or progress.get('total_bytes_estimate') or stream[1]
+            self._touch(queued, state)
+
+    def _on_result(self, queued: QueuedJob, entry: dict, result: dict, error: Exception, stage: str) -> None:
+        if error is None:
+            self._update_entry(queued, self._entry_key(entry), entry, "Skipped" if stage == "Skipped" else "Done")
+        elif isinstance(error, yt_dlp.utils.DownloadCancelled):
+            self._update_entry(queued, self._entry_key(entry), entry, "Cancelled")
+        else:
+            self._update_entry(queued, self._entry_key(entry), entry, f"{stage} failed", str(error))
+
@@ -0,0 +1,50 @@
+import os
+
+
+class DownloadResult:
+    """
+    Compact record of a finished entry, reported instead of the yt_dlp info dict (all formats, thumbnails, subtitles,
+    http headers), which is dropped as soon as the entry is done. get() reads the fields like a dict for callers
+    written against the info dicts.
+    """
+
+    __slots__ = ("id", "url", "title", "path", "duration", "size", "status", "stage", "error", "timings")
+
+    def __init__(self, id: str = None, url: str = None, title: str = None, path: str = None, duration: float = None,
+                 size: int = None, status: str = "downloaded", stage: str = None, error: str = None,
+                 timings: dict = None):
+        """
+        :param status downloaded, linked (from the media store), skipped or failed \n
+        :param stage the stage a failed entry failed in \n
+        :param timings seconds spent per stage (download, post_process) \n
+        """
+        self.id = id
+        self.url = url
+        self.title = title
+        self.path = path
+        self.duration = duration
+        self.size = size
+        self.status = status
+        self.stage = stage
+        self.error = error
+        self.timings = timings or {}
+
+    @classmethod
+    def from_info(cls, info_dict: dict, path: str = None, status: str = "downloaded", **fields):
+        """
+        :returns the record of the entry, only the fields of the record are taken from the info dict
+        """
+        if path and "size" not in fields:
+            fields["size"] = os.path.getsize(path) if os.path.exists(path) else None
+        return cls(id=info_dict.get('id'), url=info_dict.get('webpage_url') or info_dict.get('url'),
+                   title=info_dict.get('title'), path=path, duration=info_dict.get('duration'), status=status,
+                   **fields)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return f"DownloadResult({self.status}, {self.title!r}, {self.path!r})"
@@ -0,0 +1,275 @@
+import json
+import os
+import re
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from DownloadQueue import DownloadQueue
+from Downloader import YTVideoDownloader
+from QualityPolicy import QualityPolicy
+
+
+class JobStore:
+    """
+    Persistent job queue of the server, json lines of the submitted jobs and their state changes in the state
+    directory. Jobs that were queued or running when the server stopped are submitted again on the next start.
+    """
+
+    file_name = "jobs.jsonl"
+    # appended records after which the store is rewritten, a long running server would otherwise grow it forever
+    compact_after = 1000
+
+    def __init__(self, state_dir: str):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, self.file_name)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        # ids are not reused across restarts, clients may still ask for the status of old jobs
+        self._next_id = 1
+        self._appended = 0
+        self._load()
+        self._compact()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as store:
+                for line in store:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line may be torn if the server died while writing it
+                        continue
+                    if "next_id" in record:
+                        self._next_id = max(self._next_id, record["next_id"])
+                        continue
+                    self._next_id = max(self._next_id, record["id"] + 1)
+                    job = self._jobs.setdefault(record["id"], {"job": None, "state": "queued"})
+                    job["job"] = record.get("job") or job["job"]
+                    job["state"] = record.get("state") or job["state"]
+        except FileNotFoundError:
+            pass
+
+    def _compact(self) -> None:
+        """
+        Rewrites the store with the unfinished jobs only, callers hold the lock
+        """
+        self._jobs = {job_id: job for job_id, job in self._jobs.items()
+                      if job["job"] and job["state"] in ("queued", "running")}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as store:
+            store.write(json.dumps({"next_id": self._next_id}) + "\n")
+            for job_id, job in self._jobs.items():
+                store.write(json.dumps({"id": job_id, "job": job["job"], "state": job["state"]}) + "\n")
+            store.flush()
+            os.fsync(store.fileno())
+        os.replace(temp_path, self.path)
+        self._appended = 0
+
+    def unfinished(self) -> dict:
+        """
+        :returns {job id: job} of the jobs to submit again
+        """
+        return {job_id: job["job"] for job_id, job in self._jobs.items()}
+
+    def add(self, job: dict) -> int:
+        """
+        Durably records a new job as queued
+        :returns the id of the job
+        """
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+        self.record(job_id, "queued", job)
+        return job_id
+
+    def record(self, job_id: int, state: str, job: dict = None) -> None:
+        """
+        Durably records the state change of a job, a job reaching a final state is dropped by rewriting the store
+        """
+        record = {"id": job_id, "state": state, "time": time.time()}
+        if job is not None:
+            record["job"] = job
+        with self._lock:
+            stored = self._jobs.setdefault(job_id, {"job": None, "state": state})
+            stored["job"] = job if job is not None else stored["job"]
+            stored["state"] = state
+            if state not in ("queued", "running") or self._appended >= self.compact_after:
+                self._compact()
+                return
+            self._appended += 1
+            with open(self.path, 'a', encoding='utf-8') as store:
+                store.write(json.dumps(record) + "\n")
+                store.flush()
+                os.fsync(store.fileno())
+
+
+class DownloadServer:
+    """
+    Keeps one downloader resident and accepts jobs over a local http json api, so frequent small downloads do not
+    pay the start up (imports, extractors, connections) every time.
+
+    POST /jobs                submit a job, the body holds download() keyword arguments (url and output_dir are
+                              required, quality is a preset like "720p" or a dict of QualityPolicy arguments)
+    GET /jobs                 list the jobs
+    GET /jobs/<id>            status of a job with its entries
+    POST /jobs/<id>/cancel    cancel a job (DELETE /jobs/<id> does the same)
+    GET /metrics              metrics in the prometheus text format
+    """
+
+    # job keys accepted over the api, everything else is rejected
+    job_keys = {"url", "output_dir", "file_format", "with_meta", "download_meta_seperate", "show_album_cover_on_mp3",
+                "album_cover_image", "retries", "backoff_factor", "file_name_template", "still_frame_image",
+                "subfolder_playlists", "use_archive", "lazy_playlist", "resume", "quality", "threads"}
+
+    def __init__(self, state_dir: str, host: str = "127.0.0.1", port: int = 8765, workers: int = 1,
+                 threads: int = 4, encode_threads: int = None, downloader: YTVideoDownloader = None):
+        """
+        :param state_dir directory of the persistent job queue \n
+        :param host the address to listen on, keep it local, the api has no authentication \n
+        :param port the port to listen on, 0 picks a free one \n
+        :param workers number of jobs running at the same time \n
+        :param threads default number of concurrent downloads of a job \n
+        :param encode_threads number of concurrent ffmpeg processes of a job, defaults to the core count \n
+        :param downloader the resident downloader, a new one is created if not given \n
+        """
+        self.host = host
+        self.port = port
+        self.store = JobStore(state_dir)
+        self.queue = DownloadQueue(downloader, threads, encode_threads, workers, on_state=self.store.record)
+        self._server = None
+
+    @staticmethod
+    def to_job(job: dict) -> dict:
+        """
+        Validates a job of the api and converts it into a download job
+        :raises ValueError if the job is invalid
+        """
+        if not isinstance(job, dict) or not job.get("url") or not job.get("output_dir"):
+            raise ValueError("A job needs a url and an output_dir")
+        unknown = set(job) - DownloadServer.job_keys
+        if unknown:
+            raise ValueError(f"Unknown job keys: {', '.join(sorted(unknown))}")
+        job = dict(job)
+        quality = job.get("quality")
+        if isinstance(quality, dict):
+            try:
+                job["quality"] = QualityPolicy(**quality)
+            except TypeError as e:
+                raise ValueError(f"Invalid quality: {e}")
+        elif quality is not None:
+            job["quality"] = QualityPolicy.from_preset(str(quality))
+        return job
+
+    def submit(self, job: dict) -> int:
+        download_job = self.to_job(job)
+        # recorded before the queue sees it, so the store never holds a state change of an unknown job
+        job_id = self.store.add(job)
+        self.queue.submit(download_job, job_id)
+        return job_id
+
+    def start(self) -> None:
+        """
+        Submits the jobs left over from the last run and starts serving the api on a background thread
+        """
+        for job_id, job in sorted(self.store.unfinished().items()):
+            # finished entries of an interrupted job are skipped, partial ones continue
+            self.queue.submit(self.to_job(dict(job, resume=True)), job_id)
+            print(f"Resuming job {job_id}: {job['url']}")
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="download-server", daemon=True).start()
+        print(f"Serving the download api on http://{self.host}:{self.port}/jobs")
+
+    def serve_forever(self) -> None:
+        """
+        Runs the server until interrupted or terminated, running jobs are resumed on the next start
+        """
+        stopped = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+        self.start()
+        try:
+            # waits in steps, so ctrl+c is handled right away
+            while not stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        # the jobs stay queued or running in the store, so they are resumed on the next start
+        self.queue.on_state = None
+        self.queue.close(cancel=True)
+        self.queue.join(timeout=30)
+        self.queue.downloader.close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0].rstrip("/")
+                if path == "/metrics":
+                    self._send(200, server.queue.downloader.metrics.to_prometheus(),
+                               "text/plain; version=0.0.4; charset=utf-8")
+                elif path == "/jobs":
+                    self._send_json(200, {"jobs": server.queue.jobs()})
+                else:
+                    job_id = self._job_id(path)
+                    status = server.queue.status(job_id) if job_id else None
+                    if status is None:
+                        self._send_json(404, {"error": "Unknown job"})
+                    else:
+                        self._send_json(200, status)
+
+            def do_POST(self):
+                path = self.path.split("?")[0].rstrip("/")
+                if path == "/jobs":
+                    try:
+                        length = int(self.headers.get("Content-Length") or 0)
+                        job_id = server.submit(json.loads(self.rfile.read(length) or b"null"))
+                    except ValueError as e:
+                        self._send_json(400, {"error": str(e)})
+                        return
+                    self._send_json(201, {"id": job_id})
+                elif path.endswith("/cancel"):
+                    self._cancel(path[:-len("/cancel")])
+                else:
+                    self._send_json(404, {"error": "Not found"})
+
+            def do_DELETE(self):
+                self._cancel(self.path.split("?")[0].rstrip("/"))
+
+            def _cancel(self, path):
+                job_id = self._job_id(path)
+                if not job_id or server.queue.status(job_id, with_entries=False) is None:
+                    self._send_json(404, {"error": "Unknown job"})
+                    return
+                self._send_json(200, {"cancelled": server.queue.cancel(job_id)})
+
+            @staticmethod
+            def _job_id(path):
+                match = re.fullmatch(r"/jobs/(\d+)", path)
+                return int(match.group(1)) if match else None
+
+            def _send_json(self, status, body):
+                self._send(status, json.dumps(body, default=str), "application/json")
+
+            def _send(self, status, body, content_type):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,23 +1,59 @@
+import collections
+import contextlib
+import functools
+import heapq
+import itertools
 import json
 import os
+import queue
 import re
-import shutil
-import subprocess
-import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import requests
 import yt_dlp
-from urllib3.connection import HTTPSConnection
-from urllib3.exceptions import ReadTimeoutError
 
+from BandwidthLimiter import BandwidthLimiter
+from CoverCache import CoverCache
+from DownloadArchive import DownloadArchive
+from DownloadResult import DownloadResult
+from ExtractionCache import ExtractionCache
+from JobJournal import JobJournal
+from MediaStore import MediaStore
+from Metrics import Metrics
+from PostProcessor import COPY_AUDIO_CODECS, COVER_CONTAINERS, PostProcessPlan, StillFrameCache
+from QualityPolicy import QualityPolicy
+from RangeDownloader import RangeDownloader
+from RetryScheduler import RetryPolicy, RetryScheduler
+from Staging import Staging
+from Tagger import AudioTagger
+from YoutubeDLPool import YoutubeDLPool
 
-# todo:jmd file_name_template is not working atm and just uses default values.
 
 class YTVideoDownloader:
+    # longest side still frame images are normalized to, covers use the smaller default of the cover cache
+    still_frame_dimension = 1920
 
-    def __init__(self):
+    def __init__(self, extraction_cache_dir: str = None, extraction_cache_ttl: float = 3600,
+                 still_frame_cache_dir: str = None, metrics: Metrics = None,
+                 bandwidth_limiter: BandwidthLimiter = None, cover_cache_dir: str = None, connections: int = 1,
+                 media_store_dir: str = None, scratch_dir: str = None):
+        """
+        :param extraction_cache_dir if set, extraction results are cached in this directory and reused across runs \n
+        :param extraction_cache_ttl seconds a cached extraction stays valid \n
+        :param still_frame_cache_dir where encoded still frame segments are kept, defaults to the system temp dir \n
+        :param metrics where throughput, stage timings, retries and failures are collected, a new one if not given \n
+        :param bandwidth_limiter the total and per entry rate budget, pass the same limiter to several downloaders to
+        share it between them, unlimited if not given \n
+        :param cover_cache_dir where normalized cover images are kept, defaults to the system temp dir \n
+        :param connections number of parallel connections per file, fragments of DASH / HLS streams and byte ranges of
+        progressive files are downloaded concurrently, independent of the number of entry threads \n
+        :param media_store_dir if set, finished outputs are kept in this media store and linked into every other
+        folder asking for the same video with the same settings instead of downloading it again \n
+        :param scratch_dir where streams and unfinished outputs are written (a tmpfs or fast local drive), by default
+        a hidden staging directory inside every output directory \n
+        """
         video_formats = [
             'mp4', 'webm', 'avi', 'mkv', 'mov', 'flv', 'wmv', 'mpeg', 'mpg', '3gp', 'm4v',
             'ogv', 'rm', 'rmvb', 'vob', 'mts', 'ts', 'm2ts', 'divx', 'f4v'
@@ -29,6 +65,25 @@ class YTVideoDownloader:
         ]
         self.video_formats = video_formats
         self.audio_formats = audio_formats
+        self.tagger = AudioTagger()
+        self.extraction_cache = ExtractionCache(extraction_cache_dir,
+                                                extraction_cache_ttl) if extraction_cache_dir else None
+        self.still_frame_cache = StillFrameCache(still_frame_cache_dir)
+        self.connections = max(1, connections)
+        self.http_session = CoverCache.pooled_session(max(16, self.connections * 8))
+        self.cover_cache = CoverCache(cover_cache_dir, session=self.http_session)
+        self.metrics = metrics or Metrics()
+        self.ydl_pool = YoutubeDLPool()
+        self.retry_scheduler = RetryScheduler()
+        self.media_store = MediaStore(media_store_dir) if media_store_dir else None
+        self.staging = Staging(scratch_dir)
+        self.bandwidth = bandwidth_limiter or BandwidthLimiter()
+        self.stats = {"extractor_calls": 0, "extraction_cache_hits": 0}
+        self._stats_lock = threading.Lock()
+        self._journals = {}
+        # runs inside _report_stats right now
+        self._running = 0
+        self._context = threading.local()
 
     def download_single_frame_video(self, url: str, output_dir: str, album_image: str, low_hardware_mode=False,
                                     with_metadata: bool = True,
@@ -36,7 +91,13 @@ class YTVideoDownloader:
                                     subfolder_playlists: bool = True,
                                     retries: int = 5,
                                     backoff_factor: float = 1,
-                                    file_name_template: str = "{title}") -> dict:
+                                    file_name_template: str = "{title}",
+                                    threads: int = 4,
+                                    encode_threads: int = None,
+                                    resume: bool = False,
+                                    quality: QualityPolicy = None,
+                                    dry_run: bool = False,
+                                    on_result=None) -> dict:
         """
 
         :param the url of the video / playlist to download
@@ -45,37 +106,35 @@ class YTVideoDownloader:
         :param low_hardware_mode if set to true downbloads the mp4 and converts it using a still frame(Takes less CPU but more time to donwload) else downloads the mp3 and converts it to a video (takes more cpu for the encoder but less time to download)
         :param subfolder_playlists if playlists should be sub foldered based on their playlist name
         :param threads number of download threads
+        :param encode_threads number of concurrent still frame encodes, defaults to the core count
+        :param resume if the job journal of an interrupted run is used to skip the stages that already finished
+        :param quality limits on the downloaded streams (resolution, fps, size, codecs)
+        :param dry_run if set nothing is downloaded, the chosen formats and estimated sizes are reported instead
+        :param on_result if set, called with the DownloadResult of every entry as soon as it finished instead of
+        collecting the results
         :param retries number of download retries before quitting
         :param backoff_factor the exponential time offset in seconds to wait before retrying
         :param file_name_template the name format of the video file to be downloaded
-        :returns a dict key = file name, value = dict of video data
+        :returns a dict key = file name, value = DownloadResult of the entry, empty if on_result is set
         """
 
-        filet_type = "mp3"
+        file_type = "mp3"
         if low_hardware_mode:
-            filet_type = "mp4"
-
-        results = self.download(url, output_dir, filet_type, with_metadata, file_name_template=file_name_template,
-                                download_meta_seperate=download_meta_seperate,
-                                subfolder_playlists=subfolder_playlists, retries=retries, backoff_factor=backoff_factor)
-
-        if subfolder_playlists:
-            if len(results) > 1:
-                playlist_name = results.get(list(results)[0]).get('playlist', '')
-                if playlist_name != '':
-                    sanitized_playlist_name = self._sanitize_for_windows(playlist_name)
-                    playlist_dir = os.path.join(output_dir, sanitized_playlist_name)
-                    os.makedirs(playlist_dir, exist_ok=True)
-                    output_dir = playlist_dir
-
-        for entry in results:
-            file_name = os.path.basename(entry)
-            if low_hardware_mode:
-                self._replace_video_with_static_image(entry, os.path.join(output_dir, file_name), album_image)
-                continue
-            self._create_video_from_audio_with_static_image(entry, os.path.join(output_dir, file_name), album_image)
+            file_type = "mp4"
 
-        return results
+        # the still frame is rendered in the same ffmpeg pass that tags the file, so no extra pass is needed here
+        return self.download(url, output_dir, file_type, with_metadata, file_name_template=file_name_template,
+                             download_meta_seperate=download_meta_seperate,
+                             subfolder_playlists=subfolder_playlists, retries=retries, backoff_factor=backoff_factor,
+                             threads=threads, still_frame_image=album_image, encode_threads=encode_threads,
+                             resume=resume, quality=quality, dry_run=dry_run, on_result=on_result)
+
+    def close(self) -> None:
+        """
+        Closes the pooled YoutubeDL instances and http connections
+        """
+        self.ydl_pool.close()
+        self.http_session.close()
 
     def getPreviews(self):
         """
@@ -88,7 +147,15 @@ class YTVideoDownloader:
                  download_meta_seperate: bool = False,
                  album_cover_image: str = None,
                  threads: int = 4,
-                 file_name_template: str = "{title}") -> dict:
+                 file_name_template: str = "{title}",
+                 still_frame_image: str = None,
+                 use_archive: bool = True,
+                 lazy_playlist: bool = False,
+                 encode_threads: int = None,
+                 resume: bool = False,
+                 quality: QualityPolicy = None,
+                 dry_run: bool = False,
+                 on_result=None) -> dict:
         """
 
         :param url the url of the video / playlist to download \n
@@ -102,178 +169,1104 @@ class YTVideoDownloader:
         :param subfolder_playlists if playlists should be sub foldered based on their playlist name \n
         :param threads number of download threads \n
         :param file_name_template the file name template to use for the file output \n
-        :returns a dict key = file name, value = dict of video data
+        :param still_frame_image if set the output is an mp4 showing only this image over the audio \n
+        :param use_archive if entries already recorded in the download archive of the output directory are skipped \n
+        :param lazy_playlist if playlists are flat extracted and streamed, each entry is only resolved once a download
+        thread picks it up, so downloading starts before the whole playlist is known \n
+        :param encode_threads number of concurrent ffmpeg post-processing jobs for playlists, defaults to the core
+        count \n
+        :param resume if the job journal of an interrupted run is used to skip the stages that already finished \n
+        :param quality limits on the downloaded streams (resolution, fps, size, codecs), the best streams if not set \n
+        :param dry_run if set nothing is downloaded, the format chosen per entry and its estimated size are reported
+        instead and returned keyed by the file the download would write \n
+        :param on_result if set, called with the DownloadResult of every entry (downloaded, skipped or failed) as soon
+        as it finished instead of collecting the results, so a large playlist holds no results while it runs, a
+        failed single video is reported there as well instead of raising \n
+        :returns a dict key = file name, value = DownloadResult of the entry, empty if on_result is set
         """
-        os.makedirs(output_dir, exist_ok=True)
+        if not dry_run:
+            os.makedirs(output_dir, exist_ok=True)
         file_format = file_format.lower()
         for attempt in range(retries):
             if url is None or output_dir is None:
                 print("URL or Output directory cannot be None")
                 return {}
 
+            # the single video once it is resolved, its failure is reported to on_result like a failed entry
+            video_info = None
             try:
-                with yt_dlp.YoutubeDL() as ydl:
-                    info_dict = ydl.extract_info(url, download=False)
+                with self._report_stats(), self._playlist_extractor(lazy_playlist) as ydl:
+                    info_dict = self._resolve_url(url, ydl)
                     is_playlist = info_dict.get('_type') == 'playlist'
 
+                    if dry_run:
+                        return self._dry_run(info_dict, output_dir, file_format, subfolder_playlists,
+                                             file_name_template, still_frame_image, quality, threads)
                     if is_playlist:
                         return self._download_playlist(output_dir, info_dict, file_format, threads, subfolder_playlists,
                                                        with_meta, download_meta_seperate,
                                                        show_album_cover_on_mp3, album_cover_image,
-                                                       retries, backoff_factor, file_name_template)
+                                                       retries, backoff_factor, file_name_template,
+                                                       still_frame_image, use_archive, encode_threads, resume,
+                                                       quality, on_result)
                     else:
-                        if file_format in self.audio_formats:
-                            return self._download_audio(url, output_dir, info_dict, file_format, with_meta,
+                        video_info = info_dict
+                        archive = DownloadArchive(output_dir) if use_archive else None
+                        journal = self._journal_for(output_dir, resume)
+                        archived = self._archived_output(archive, info_dict, file_format, still_frame_image)
+                        if archived:
+                            print(f"Skipping {info_dict.get('title')}, already downloaded to {archived}")
+                            result = {archived: DownloadResult.from_info(info_dict, archived, status="skipped")}
+                        elif file_format in self.audio_formats:
+                            result = self._download_audio(url, output_dir, info_dict, file_format, with_meta,
                                                         download_meta_seperate, show_album_cover_on_mp3,
                                                         album_cover_image,
-                                                        file_name_template)
+                                                        file_name_template, still_frame_image, archive,
+                                                        journal=journal, quality=quality)
                         else:
-                            return self._download_video(url, output_dir, info_dict, file_format, with_meta,
-                                                        download_meta_seperate, album_cover_image, file_name_template)
-
-            except (yt_dlp.utils.DownloadError, HTTPSConnection, ReadTimeoutError) as e:
-                print(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < retries - 1:
-                    sleep_time = backoff_factor * (2 ** attempt)
-                    print(f"Retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
+                            result = self._download_video(url, output_dir, info_dict, file_format, with_meta,
+                                                          download_meta_seperate, album_cover_image,
+                                                          file_name_template, still_frame_image, archive,
+                                                          journal=journal, quality=quality)
+                        if on_result is None:
+                            return result
+                        for record in result.values():
+                            on_result(record)
+                        return {}
+
+            except Exception as e:
+                # entries of a playlist are retried by the pipeline, this only retries the extraction and single
+                # videos, which run on the calling thread
+                delay = self.retry_scheduler.retry_delay(e, attempt + 1, RetryPolicy(retries, backoff_factor),
+                                                         self.retry_scheduler.host_of({"url": url}))
+                if delay is None:
+                    if on_result is None or video_info is None:
+                        raise
+                    print(f"Download failed for {video_info.get('title')}: {e}")
+                    on_result(DownloadResult.from_info(video_info, status="failed", stage="Download", error=str(e)))
+                    return {}
+                print(f"Attempt {attempt + 1} failed ({self.retry_scheduler.classify(e)}): {e}")
+                self.metrics.inc("retries_total")
+                print(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+
+    def iter_download(self, url: str, output_dir: str, **options):
+        """
+        Downloads like download() on a background thread and yields the DownloadResult of every entry as soon as it
+        finished, nothing is collected, so memory stays flat on playlists of any size. Closing the generator early
+        cancels the remaining downloads.
+        :param options further download() keyword arguments
+        """
+        results = queue.Queue()
+        cancel_event = threading.Event()
+        done = object()
+
+        def run():
+            try:
+                self.run_in_context(functools.partial(self.download, url, output_dir, on_result=results.put,
+                                                      **options), cancel_event=cancel_event)
+            except BaseException as e:
+                results.put(e)
+            finally:
+                results.put(done)
+
+        thread = threading.Thread(target=run, name="iter-download", daemon=True)
+        thread.start()
+        try:
+            while True:
+                result = results.get()
+                if result is done:
+                    return
+                if isinstance(result, BaseException):
+                    if not cancel_event.is_set():
+                        raise result
+                    continue
+                yield result
+        finally:
+            cancel_event.set()
+            thread.join()
+
+    def download_many(self, jobs: list, threads: int = 4, encode_threads: int = None) -> list:
+        """
+        Downloads several urls with all of their entries scheduled on one shared download pool, so small playlists
+        do not leave threads idle while a big one is still running. Entries of the jobs are interleaved.
+        :param jobs list of dicts holding download() keyword arguments, url and output_dir are required \n
+        :param threads number of download threads shared by all jobs \n
+        :param encode_threads number of concurrent ffmpeg post-processing jobs, defaults to the core count \n
+        :returns one summary dict per job (url, downloaded, skipped, failed, bytes, seconds, results)
+        """
+        summaries = []
+        job_tasks = []
+        for job in jobs:
+            summary = {"url": job["url"], "downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0,
+                       "seconds": 0.0, "results": {}}
+            summaries.append(summary)
+            job_tasks.append(self._job_tasks(job, summary))
+
+        with self._report_stats():
+            self._run_pipeline(self._interleave(job_tasks), threads, encode_threads)
+        return summaries
+
+    def _job_tasks(self, job: dict, summary: dict, listener=None):
+        """
+        Yields the download tasks of a download_many job, the url is only extracted once the first task is pulled
+        :param listener optionally called with every result after the summary was updated
+        :param summary counters of the job, the results are only collected if it holds a results dict
+        """
+        url = job["url"]
+        output_dir = job["output_dir"]
+        file_format = job.get("file_format", "mp4").lower()
+        with_meta = job.get("with_meta", True)
+        download_meta_separate = job.get("download_meta_seperate", False)
+        show_album_cover = job.get("show_album_cover_on_mp3", True)
+        album_cover_image = job.get("album_cover_image")
+        retries = job.get("retries", 5)
+        backoff_factor = job.get("backoff_factor", 1)
+        file_name_template = job.get("file_name_template", "{title}")
+        still_frame_image = job.get("still_frame_image")
+        started = time.time()
+
+        def on_result(entry, result, error, stage):
+            self._record_result(error, stage)
+            summary["seconds"] = time.time() - started
+            if error is not None:
+                print(f"{stage} failed for entry {entry.get('title')} of {url}: {error}")
+                summary["failed"] += 1
+            else:
+                if "results" in summary:
+                    summary["results"].update(result)
+                if stage == "Skipped":
+                    summary["skipped"] += 1
                 else:
-                    print("All retries failed.")
-                    raise
+                    summary["downloaded"] += 1
+                    summary["bytes"] += sum(record.size or 0 for record in result.values())
+            if listener:
+                listener(entry, result, error, stage)
+
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            with self._playlist_extractor(job.get("lazy_playlist", False)) as ydl:
+                info_dict = self._resolve_url(url, ydl)
+                if info_dict.get('_type') == 'playlist':
+                    yield from self._playlist_tasks(output_dir, info_dict, file_format,
+                                                    job.get("subfolder_playlists", True), on_result, with_meta,
+                                                    download_meta_separate, show_album_cover, album_cover_image,
+                                                    retries, backoff_factor, file_name_template, still_frame_image,
+                                                    job.get("use_archive", True), job.get("resume", False),
+                                                    job.get("quality"))
+                    return
+        except Exception as e:
+            on_result({"title": url}, None, e, "Extraction")
+            return
+
+        archive = DownloadArchive(output_dir) if job.get("use_archive", True) else None
+        journal = self._journal_for(output_dir, job.get("resume", False))
+        archived = self._archived_output(archive, info_dict, file_format, still_frame_image)
+        if archived:
+            on_result(info_dict, {archived: DownloadResult.from_info(info_dict, archived, status="skipped")}, None,
+                      "Skipped")
+            return
+        download = self._entry_download(info_dict, output_dir, file_format, with_meta, download_meta_separate,
+                                        show_album_cover, album_cover_image, file_name_template, retries,
+                                        backoff_factor, still_frame_image, archive, journal, job.get("quality"))
+        yield info_dict, download, on_result
+
+    def _preflight_playlist(self, output_dir: str, entries: list, archive: DownloadArchive, file_format: str,
+                            still_frame_image: str = None, quality: QualityPolicy = None) -> None:
+        """
+        Checks the free space for the entries still to download before the first one starts, sized by the streams
+        the format selector of the job picks. Entries whose formats are not known yet (flat entries) are checked once
+        their download starts
+        :raises OSError (ENOSPC) if a drive is too full
+        """
+        sizes = []
+        selector = self._format_selector(file_format, still_frame_image, quality)
+        with self.ydl_pool.acquire({'format': selector, 'quiet': True, 'no_warnings': True}) as ydl:
+            for entry in entries:
+                if entry is None or entry.get('_type', 'video') != 'video' or self._archived_output(
+                        archive, entry, file_format, still_frame_image):
+                    continue
+                try:
+                    info = self._select_formats(ydl, entry)
+                except yt_dlp.utils.DownloadError:
+                    # no format matches, the download reports it
+                    continue
+                streams = info.get('requested_formats') or [info]
+                sizes.append(sum(self._estimate_bytes(stream, info.get('duration')) for stream in streams))
+        if sizes:
+            self.staging.preflight(self.staging.dir_for(output_dir), output_dir, sum(sizes), 2 * max(sizes))
+
+    @staticmethod
+    def _drain(items: collections.deque):
+        """
+        Yields and removes the items from the front of the deque
+        """
+        while items:
+            yield items.popleft()
+
+    @staticmethod
+    def _interleave(iterables):
+        """
+        Round robin over the iterables until all of them are exhausted
+        """
+        iterators = collections.deque(iter(iterable) for iterable in iterables)
+        while iterators:
+            iterator = iterators.popleft()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                continue
+            iterators.append(iterator)
+            yield item
 
     def _download_playlist(self, output_dir: str, info_dict: dict, file_format: str, threads, subfolder_playlists,
                            with_meta: bool = True, download_meta_separate: bool = False,
                            show_album_cover: bool = True, album_cover_image: str = None,
                            retries: int = 5, backoff_factor: float = 1,
-                           file_name_template: str = "{title}") -> dict:
+                           file_name_template: str = "{title}", still_frame_image: str = None,
+                           use_archive: bool = True, encode_threads: int = None, resume: bool = False,
+                           quality: QualityPolicy = None, on_result=None) -> dict:
+        results = {}
+
+        def collect(entry, result, error, stage):
+            self._record_result(error, stage)
+            if error is not None:
+                print(f"{stage} failed for entry {entry.get('title')}: {error}")
+                if on_result:
+                    on_result(DownloadResult.from_info(entry, status="failed", stage=stage, error=str(error)))
+            elif on_result:
+                for record in result.values():
+                    on_result(record)
+            else:
+                results.update(result)
+
+        tasks = self._playlist_tasks(output_dir, info_dict, file_format, subfolder_playlists, collect, with_meta,
+                                     download_meta_separate, show_album_cover, album_cover_image, retries,
+                                     backoff_factor, file_name_template, still_frame_image, use_archive, resume,
+                                     quality)
+        self._run_pipeline(tasks, threads, encode_threads)
+        return results
+
+    def _playlist_tasks(self, output_dir: str, info_dict: dict, file_format: str, subfolder_playlists, on_result,
+                        with_meta: bool = True, download_meta_separate: bool = False,
+                        show_album_cover: bool = True, album_cover_image: str = None,
+                        retries: int = 5, backoff_factor: float = 1,
+                        file_name_template: str = "{title}", still_frame_image: str = None,
+                        use_archive: bool = True, resume: bool = False, quality: QualityPolicy = None):
+        """
+        Yields the download tasks of a playlist for _run_pipeline, entries already in the archive are reported to
+        on_result right away instead
+        """
         playlist_name = info_dict.get('title', 'playlist')
-        if subfolder_playlists:
-            sanitized_playlist_name = self._sanitize_for_windows(playlist_name)
-            playlist_dir = os.path.join(output_dir, sanitized_playlist_name)
-            os.makedirs(playlist_dir, exist_ok=True)
-            output_dir = playlist_dir
+        output_dir = self._playlist_dir(output_dir, info_dict, subfolder_playlists)
+        os.makedirs(output_dir, exist_ok=True)
         print(f"Downloading playlist: {playlist_name}")
 
-        results = {}
-        with ThreadPoolExecutor(max_workers=threads) as executor:
-            future_to_entry = {
-                executor.submit(self._download_entry, entry, output_dir, file_format, with_meta, download_meta_separate,
-                                show_album_cover, album_cover_image, file_name_template, retries, backoff_factor): entry
-                for entry in info_dict.get('entries', [])
-            }
-
-            for future in as_completed(future_to_entry):
-                entry = future_to_entry[future]
-                try:
-                    results.update(future.result())
-                except Exception as e:
-                    print(f"Download failed for entry {entry['title']}: {e}")
-        return results
+        archive = DownloadArchive(output_dir) if use_archive else None
+        journal = self._journal_for(output_dir, resume)
 
-    def _download_entry(self, entry, output_dir, file_format, with_meta, download_meta_separate,
-                        show_album_cover, album_cover_image, file_name_template, retries, backoff_factor) -> dict:
-        for attempt in range(retries):
-            try:
-                if file_format in self.audio_formats:
-                    return self._download_audio(entry.get("webpage_url"), output_dir, entry,
-                                                file_format, with_meta, download_meta_separate,
-                                                show_album_cover, album_cover_image, file_name_template)
-                else:
-                    return self._download_video(entry.get("webpage_url"), output_dir, entry,
-                                                file_format, with_meta, download_meta_separate,
-                                                album_cover_image, file_name_template)
-            except (yt_dlp.utils.DownloadError, HTTPSConnection, ReadTimeoutError) as e:
-                print(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < retries - 1:
-                    sleep_time = backoff_factor * (2 ** attempt)
-                    print(f"Retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
+        entries = info_dict.get('entries') or []
+        if isinstance(entries, list):
+            self._preflight_playlist(output_dir, entries, archive, file_format, still_frame_image, quality)
+            # entries are handed out one by one and dropped from the playlist, so the info dicts of finished entries
+            # are freed while the rest of a large playlist is still running
+            entries = self._drain(collections.deque(info_dict.pop('entries')))
+        for entry in entries:
+            if entry is None:
+                continue
+            archived = self._archived_output(archive, entry, file_format, still_frame_image)
+            if archived:
+                print(f"Skipping {entry.get('title')}, already downloaded")
+                on_result(entry, {archived: DownloadResult.from_info(entry, archived, status="skipped")}, None,
+                          "Skipped")
+                continue
+            download = self._entry_download(entry, output_dir, file_format, with_meta, download_meta_separate,
+                                            show_album_cover, album_cover_image, file_name_template, retries,
+                                            backoff_factor, still_frame_image, archive, journal, quality)
+            yield entry, download, on_result
+
+    def _playlist_dir(self, output_dir: str, info_dict: dict, subfolder_playlists: bool) -> str:
+        if not subfolder_playlists:
+            return output_dir
+        return os.path.join(output_dir, self._sanitize_for_windows(info_dict.get('title', 'playlist')))
+
+    def _dry_run(self, info_dict: dict, output_dir: str, file_format: str, subfolder_playlists: bool,
+                 file_name_template: str, still_frame_image: str, quality: QualityPolicy, threads: int) -> dict:
+        """
+        Runs the format selection of every entry without downloading and prints the chosen formats
+        :returns dict key = file the download would write, value = dict of the chosen formats and estimated bytes
+        """
+        if info_dict.get('_type') == 'playlist':
+            output_dir = self._playlist_dir(output_dir, info_dict, subfolder_playlists)
+            entries = [entry for entry in info_dict.get('entries') or [] if entry is not None]
+        else:
+            entries = [info_dict]
+
+        plan_entry = functools.partial(self._plan_entry, output_dir=output_dir, file_format=file_format,
+                                       file_name_template=file_name_template, still_frame_image=still_frame_image,
+                                       quality=quality)
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            plans = dict(executor.map(plan_entry, entries))
+
+        total = 0
+        for output_file_path, plan in plans.items():
+            total += plan["estimated_bytes"]
+            print(f"{plan['format_id']:<24} {plan['resolution']:>10} {plan['vcodec']:>12} {plan['acodec']:>12} "
+                  f"{plan['estimated_bytes'] / 1e6:>9.1f} MB  {output_file_path}")
+        print(f"Estimated download size of {len(plans)} entries: {total / 1e6:.1f} MB")
+        return plans
+
+    def _plan_entry(self, entry: dict, output_dir: str, file_format: str, file_name_template: str,
+                    still_frame_image: str, quality: QualityPolicy) -> tuple:
+        if entry.get('_type') in ('url', 'url_transparent'):
+            entry = self._extract_info(entry.get('url'))
+        meta_data = self._extract_meta_from_info_dict(entry)
+        file_name = self._resolve_file_name_template(file_name_template, meta_data)
+        output_format = "mp4" if still_frame_image else file_format
+        selector = self._format_selector(file_format, still_frame_image, quality)
+
+        with self.ydl_pool.acquire({'format': selector, 'quiet': True, 'no_warnings': True}) as ydl:
+            info = self._select_formats(ydl, entry)
+        streams = info.get('requested_formats') or [info]
+        return os.path.join(output_dir, file_name + "." + output_format), {
+            "title": entry.get('title'),
+            "format_id": info.get('format_id'),
+            "resolution": self._resolution_label(streams),
+            "vcodec": info.get('vcodec') or "unknown",
+            "acodec": info.get('acodec') or "unknown",
+            "estimated_bytes": sum(self._estimate_bytes(stream, info.get('duration')) for stream in streams),
+        }
+
+    @staticmethod
+    def _resolution_label(streams: list) -> str:
+        """
+        :returns the resolution of the video stream among the selected streams, "audio only" if all of them have no
+        video, "unknown" for a video the site reports no dimensions of
+        """
+        video_streams = [stream for stream in streams if stream.get('vcodec') != 'none']
+        if not video_streams:
+            return "audio only"
+        stream = video_streams[0]
+        if stream.get('width') and stream.get('height'):
+            return f"{stream['width']}x{stream['height']}"
+        resolution = stream.get('resolution')
+        return resolution if resolution and resolution != "audio only" else "unknown"
+
+    def _format_selector(self, file_format: str, still_frame_image: str = None, quality: QualityPolicy = None) -> str:
+        """
+        :returns the yt_dlp format selector entries of the format are downloaded with
+        """
+        quality = quality or QualityPolicy()
+        if file_format not in self.audio_formats:
+            return quality.video_selector()
+        # prefer a source stream that can be copied into the output, so most downloads skip the transcode
+        copy_codec = 'mp4a' if still_frame_image else COPY_AUDIO_CODECS.get(file_format, (None,))[0]
+        return quality.preferring_audio_codec(copy_codec).audio_selector()
+
+    @staticmethod
+    def _estimate_bytes(stream: dict, duration: float = None) -> int:
+        """
+        :returns the size of the stream as reported by the site, or estimated from its bitrate, 0 if unknown
+        """
+        size = stream.get('filesize') or stream.get('filesize_approx')
+        if size:
+            return int(size)
+        if stream.get('tbr') and duration:
+            return int(stream['tbr'] * 1000 / 8 * duration)
+        return 0
+
+    def _run_pipeline(self, tasks, threads: int, encode_threads: int = None) -> None:
+        """
+        Runs download tasks on a bounded download pool and hands their post-processing to a separate encode pool, so
+        the network threads never wait for ffmpeg and ffmpeg never waits for the network. Tasks are only pulled while
+        there is room, so neither a (lazy) playlist nor the pending futures have to be held in memory as a whole.
+        Failed downloads are handed to the retry scheduler and wait aside until their ready time, entries of a host
+        that is cooling down after throttling wait the same way, the pool threads keep downloading meanwhile.
+        :param tasks iterable of (entry, download, on_result) tuples, download returns the post-processing callable
+        and may carry a retry_policy attribute, on_result is called with (entry, {file name: DownloadResult} or None,
+        exception or None, stage name)
+        :param threads number of concurrent downloads
+        :param encode_threads number of concurrent post-processing jobs, defaults to the core count
+        """
+        if encode_threads is None:
+            encode_threads = os.cpu_count() or 1
+        max_in_flight = max(1, threads) * 2
+        max_encode_queue = max(1, encode_threads) * 2
+        # downloads on the pool threads run in the context of the caller, see run_in_context
+        cancel_event = getattr(self._context, "cancel_event", None)
+        progress_listener = getattr(self._context, "progress_listener", None)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor, \
+                ThreadPoolExecutor(max_workers=encode_threads) as encode_executor:
+            downloads = {}
+            encodes = {}
+            # heap of (ready time, sequence, entry, download, on_result, failed attempts)
+            waiting = []
+            sequence = itertools.count()
+
+            def cancelled():
+                return cancel_event is not None and cancel_event.is_set()
+
+            def submit(entry, download, on_result, attempt):
+                cooldown = self.retry_scheduler.cooldown(self.retry_scheduler.host_of(entry))
+                if cooldown:
+                    heapq.heappush(waiting, (time.monotonic() + cooldown, next(sequence), entry, download, on_result,
+                                             attempt))
+                    return
+                run = download
+                if cancel_event is not None or progress_listener is not None:
+                    run = functools.partial(self.run_in_context, download, cancel_event=cancel_event,
+                                            progress_listener=progress_listener)
+                downloads[executor.submit(run)] = (entry, download, on_result, attempt)
+                self.metrics.set("downloads_in_flight", len(downloads))
+
+            def submit_ready():
+                while waiting and waiting[0][0] <= time.monotonic() and len(downloads) < max_in_flight:
+                    _, _, entry, download, on_result, attempt = heapq.heappop(waiting)
+                    submit(entry, download, on_result, attempt)
+
+            def next_ready():
+                return max(0.0, waiting[0][0] - time.monotonic()) if waiting else None
+
+            def collect_encodes(return_when, timeout=None):
+                done, _ = wait(encodes, timeout=timeout, return_when=return_when)
+                for future in done:
+                    entry, on_result = encodes.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        on_result(entry, None, e, "Post-processing")
+                        continue
+                    on_result(entry, result, None, "Post-processing")
+
+            def collect_downloads(return_when, timeout=None):
+                done, _ = wait(downloads, timeout=timeout, return_when=return_when)
+                for future in done:
+                    entry, download, on_result, attempt = downloads.pop(future)
+                    host = self.retry_scheduler.host_of(entry)
+                    try:
+                        post_process = future.result()
+                    except Exception as e:
+                        delay = None if cancelled() else self.retry_scheduler.retry_delay(
+                            e, attempt + 1, getattr(download, "retry_policy", None), host)
+                        if delay is None:
+                            on_result(entry, None, e, "Download")
+                            continue
+                        self.metrics.inc("retries_total")
+                        print(f"Attempt {attempt + 1} of {entry.get('title')} failed "
+                              f"({self.retry_scheduler.classify(e)}): {e}, retrying in {delay:.1f} seconds")
+                        heapq.heappush(waiting, (time.monotonic() + delay, next(sequence), entry, download,
+                                                 on_result, attempt + 1))
+                        continue
+                    self.retry_scheduler.succeeded(host)
+                    if cancelled():
+                        on_result(entry, None, yt_dlp.utils.DownloadCancelled("Download cancelled"), "Download")
+                        continue
+                    while len(encodes) >= max_encode_queue:
+                        collect_encodes(FIRST_COMPLETED)
+                    encodes[encode_executor.submit(post_process)] = (entry, on_result)
+                    self.metrics.set("downloads_in_flight", len(downloads))
+                    self.metrics.set("encode_queue", len(encodes))
+                    print(f"Queued post-processing for {entry.get('title')} "
+                          f"(downloads in flight: {len(downloads)}/{max_in_flight}, "
+                          f"encode queue: {len(encodes)}/{max_encode_queue})")
+
+            def wait_for_room():
+                # waits for a download or post-processing to finish or the next waiting entry to get ready, in steps
+                # so a cancel is noticed while entries are waiting
+                timeout = min(1.0, next_ready() if waiting else 1.0)
+                running = set(downloads) | set(encodes)
+                if running:
+                    wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                elif cancel_event is not None:
+                    cancel_event.wait(timeout)
                 else:
-                    print("All retries failed.")
-                    raise
+                    time.sleep(timeout)
+                if encodes:
+                    collect_encodes(FIRST_COMPLETED, timeout=0)
+                if downloads:
+                    collect_downloads(FIRST_COMPLETED, timeout=0)
+                submit_ready()
+
+            for entry, download, on_result in tasks:
+                submit_ready()
+                # entries waiting for a retry or a cooldown count against the limit, so a throttled host does not
+                # drain the whole playlist into memory
+                while not cancelled() and (len(downloads) >= max_in_flight or len(waiting) >= max_in_flight):
+                    wait_for_room()
+                if cancelled():
+                    break
+                submit(entry, download, on_result, 0)
+
+            while downloads or waiting:
+                if cancelled():
+                    while waiting:
+                        _, _, entry, _, on_result, _ = heapq.heappop(waiting)
+                        on_result(entry, None, yt_dlp.utils.DownloadCancelled("Download cancelled"), "Download")
+                    collect_downloads(ALL_COMPLETED)
+                    break
+                wait_for_room()
+            if encodes:
+                collect_encodes(ALL_COMPLETED)
+            self.metrics.set("downloads_in_flight", 0)
+            self.metrics.set("encode_queue", 0)
+
+    def _download_entry(self, entry, output_dir, file_format, with_meta, download_meta_separate,
+                        show_album_cover, album_cover_image, file_name_template, still_frame_image=None, archive=None,
+                        defer_post_processing=False, journal=None, quality=None):
+        """
+        Downloads a playlist entry once, failed attempts are retried by the pipeline, see _entry_download
+        :returns the result dict, or if defer_post_processing is set a callable running the post-processing and
+        returning the result dict
+        """
+        if entry.get('_type') in ('url', 'url_transparent'):
+            # flat playlist entry, resolved only now that a worker picked it up
+            entry = self._extract_info(entry.get('url'))
+        if file_format in self.audio_formats:
+            return self._download_audio(entry.get("webpage_url"), output_dir, entry,
+                                        file_format, with_meta, download_meta_separate,
+                                        show_album_cover, album_cover_image, file_name_template,
+                                        still_frame_image, archive, defer_post_processing, journal,
+                                        quality)
+        else:
+            return self._download_video(entry.get("webpage_url"), output_dir, entry,
+                                        file_format, with_meta, download_meta_separate,
+                                        album_cover_image, file_name_template, still_frame_image,
+                                        archive, defer_post_processing, journal, quality)
+
+    def _entry_download(self, entry, output_dir, file_format, with_meta, download_meta_separate, show_album_cover,
+                        album_cover_image, file_name_template, retries, backoff_factor, still_frame_image, archive,
+                        journal, quality):
+        """
+        :returns the download callable of a pipeline task, carrying the retry policy of its job
+        """
+        download = functools.partial(self._download_entry, entry, output_dir, file_format, with_meta,
+                                     download_meta_separate, show_album_cover, album_cover_image, file_name_template,
+                                     still_frame_image, archive, True, journal, quality)
+        download.retry_policy = RetryPolicy(retries, backoff_factor)
+        return download
 
     def _download_audio(self, url: str, output_dir: str, info_dict: dict, file_format: str, with_meta: bool = True,
                         download_meta_separate: bool = False, show_album_cover: bool = True,
-                        album_cover_image: str = None, file_name_template: str = "{title}") -> dict:
+                        album_cover_image: str = None, file_name_template: str = "{title}",
+                        still_frame_image: str = None, archive: DownloadArchive = None,
+                        defer_post_processing: bool = False, journal: JobJournal = None,
+                        quality: QualityPolicy = None):
         meta_data = self._extract_meta_from_info_dict(info_dict)
         file_name = self._resolve_file_name_template(file_name_template, meta_data)
-        output_file_path = os.path.join(output_dir, file_name + "." + file_format)
+        output_format = "mp4" if still_frame_image else file_format
+        output_file_path = os.path.join(output_dir, file_name + "." + output_format)
+        journal_key = self._journal_key(info_dict, file_format, still_frame_image)
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': file_format,
-                'preferredquality': '192',
-            }],
-            'postprocessor_args': ['-ar', '44100'],
-            'noplaylist': True,
-            'no_warnings': True,
-            'extract_flat': True,
-        }
+        meta_file_path = os.path.join(output_dir, file_name + ".meta.json") if download_meta_separate else None
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        selector = self._format_selector(file_format, still_frame_image, quality)
+        store_key = self._store_key(info_dict, {
+            "kind": "audio", "file_format": file_format, "quality": selector,
+            "meta": meta_data if with_meta else None, "show_album_cover": show_album_cover,
+            "album_cover_image": self._file_identity(album_cover_image),
+            "still_frame_image": self._file_identity(still_frame_image)})
+        if self._link_stored(store_key, output_format, output_file_path):
+            post_process = functools.partial(self._finish_output, info_dict, output_file_path, meta_file_path,
+                                             archive, file_format, still_frame_image, ["media_store"], journal,
+                                             journal_key, None, {}, "linked")
+            return post_process if defer_post_processing else post_process()
 
-        if with_meta:
-            temp_output_file = tempfile.mktemp(suffix=f".{file_format}")
-            self._add_metadata_to_file(output_file_path, temp_output_file, meta_data)
-            shutil.copy(temp_output_file, output_file_path)
-            os.remove(temp_output_file)
-
-        if download_meta_separate:
-            meta_file_path = os.path.join(output_dir, file_name + ".meta.json")
-            with open(meta_file_path, 'w') as meta_file:
-                json.dump(info_dict, meta_file, indent=4)
+        started = time.monotonic()
+        source_files = self._journaled_download(journal, journal_key, url, info_dict, output_dir, file_name,
+                                                selector)
+        timings = {"download": time.monotonic() - started}
+
+        # tags of the common audio formats are written in place afterwards, so ffmpeg only has to convert
+        native_tags = not still_frame_image and self.tagger.supports(file_format)
+        # without a selected cover the thumbnail of the video is used, formats that can not embed one skip it
+        embeds_cover = native_tags or file_format in COVER_CONTAINERS
+        album_cover_image = self._cover_image(
+            embeds_cover and (album_cover_image or show_album_cover and not still_frame_image
+                              and meta_data.get('thumbnail_url')))
+
+        plan = PostProcessPlan(source_files, output_file_path, self.staging.dir_for(output_dir))
+        if still_frame_image:
+            plan.add_still_frame(self._cover_image(still_frame_image, self.still_frame_dimension),
+                                 self.still_frame_cache, info_dict.get('duration'))
+        else:
+            plan.extract_audio(file_format, source_codec=self._source_codec(info_dict, next(iter(source_files), None),
+                                                                          file_name))
+            print(f"{'Remuxing' if plan.audio_copied else 'Transcoding'} {info_dict.get('title')} "
+                  f"({plan.source_codec or 'unknown codec'} to {file_format})")
+            self.metrics.inc("audio_copied_total" if plan.audio_copied else "audio_transcoded_total")
+            if album_cover_image and not native_tags:
+                plan.add_cover_image(album_cover_image)
+        if with_meta and not native_tags:
+            plan.add_metadata(meta_data)
+        native_tagging = native_tags and (with_meta or album_cover_image)
+        if native_tagging:
+            # tagged while staged, the output only appears once it is complete
+            tags = meta_data if with_meta else None
+            plan.add_staged_step(lambda staged_file: self._tag_audio(staged_file, tags, album_cover_image))
+
+        def post_process() -> dict:
+            post_process_started = time.monotonic()
+            self._journaled_post_process(journal, journal_key, plan)
+
+            postprocess_state = plan.steps
+            if native_tagging:
+                postprocess_state.append("native_tags")
+
+            timings["post_process"] = time.monotonic() - post_process_started
+            return self._finish_output(info_dict, output_file_path, meta_file_path, archive, file_format,
+                                       still_frame_image, postprocess_state, journal, journal_key, store_key, timings)
 
-        if album_cover_image:
-            temp_output_file = tempfile.mktemp(suffix=f".{file_format}")
-            self._add_cover_image_to_audio(output_file_path, temp_output_file, album_cover_image)
-            shutil.copy(temp_output_file, output_file_path)
-            os.remove(temp_output_file)
-        return {output_file_path: info_dict}
+        post_process.plan = plan
+        return post_process if defer_post_processing else post_process()
 
     def _download_video(self, url: str, output_dir: str, info_dict: dict, file_format: str, with_meta: bool = True,
                         download_meta_separate: bool = False, album_cover_image: str = None,
-                        file_name_template: str = "{title}") -> dict:
+                        file_name_template: str = "{title}", still_frame_image: str = None,
+                        archive: DownloadArchive = None, defer_post_processing: bool = False,
+                        journal: JobJournal = None, quality: QualityPolicy = None):
         meta_data = self._extract_meta_from_info_dict(info_dict)
         file_name = self._resolve_file_name_template(file_name_template, meta_data)
-        output_file_path = os.path.join(output_dir, file_name + "." + file_format)
+        output_format = "mp4" if still_frame_image else file_format
+        output_file_path = os.path.join(output_dir, file_name + "." + output_format)
+        journal_key = self._journal_key(info_dict, file_format, still_frame_image)
+        meta_file_path = os.path.join(output_dir, file_name + ".meta.json") if download_meta_separate else None
+
+        selector = self._format_selector(file_format, still_frame_image, quality)
+        store_key = self._store_key(info_dict, {
+            "kind": "video", "file_format": file_format, "quality": selector,
+            "meta": meta_data if with_meta else None,
+            "album_cover_image": self._file_identity(album_cover_image),
+            "still_frame_image": self._file_identity(still_frame_image)})
+        if self._link_stored(store_key, output_format, output_file_path):
+            post_process = functools.partial(self._finish_output, info_dict, output_file_path, meta_file_path,
+                                             archive, file_format, still_frame_image, ["media_store"], journal,
+                                             journal_key, None, {}, "linked")
+            return post_process if defer_post_processing else post_process()
+
+        started = time.monotonic()
+        source_files = self._journaled_download(journal, journal_key, url, info_dict, output_dir, file_name,
+                                                selector)
+        timings = {"download": time.monotonic() - started}
+
+        plan = PostProcessPlan(source_files, output_file_path, self.staging.dir_for(output_dir))
+        if still_frame_image:
+            plan.add_still_frame(self._cover_image(still_frame_image, self.still_frame_dimension),
+                                 self.still_frame_cache, info_dict.get('duration'))
+        elif album_cover_image and file_format in COVER_CONTAINERS:
+            plan.add_cover_image(self._cover_image(album_cover_image))
+        if with_meta:
+            plan.add_metadata(meta_data)
+
+        def post_process() -> dict:
+            post_process_started = time.monotonic()
+            self._journaled_post_process(journal, journal_key, plan)
+            timings["post_process"] = time.monotonic() - post_process_started
+            return self._finish_output(info_dict, output_file_path, meta_file_path, archive, file_format,
+                                       still_frame_image, plan.steps, journal, journal_key, store_key, timings)
+
+        post_process.plan = plan
+        return post_process if defer_post_processing else post_process()
+
+    def _finish_output(self, info_dict: dict, output_file_path: str, meta_file_path: str, archive: DownloadArchive,
+                       file_format: str, still_frame_image: str, postprocess_state: list, journal: JobJournal,
+                       journal_key: str, store_key: str, timings: dict, status: str = "downloaded") -> dict:
+        """
+        Writes the separate meta file, adds the output to the media store and records it in the archive and journal
+        :returns the result dict of the entry
+        """
+        if meta_file_path:
+            with self.metrics.timer("meta_json"), open(meta_file_path, 'w') as meta_file:
+                json.dump(info_dict, meta_file, indent=4)
+        if store_key:
+            with self.metrics.timer("media_store"):
+                self.media_store.add(store_key, output_file_path)
+        with self.metrics.timer("archive"):
+            self._archive_output(archive, info_dict, file_format, still_frame_image, output_file_path,
+                                 postprocess_state)
+        if journal:
+            journal.record(journal_key, "done")
+        return {output_file_path: DownloadResult.from_info(info_dict, output_file_path, status=status,
+                                                           timings=timings)}
+
+    def _store_key(self, info_dict: dict, settings: dict):
+        """
+        :returns the media store key of the output, None without a media store or for videos without an id
+        """
+        if self.media_store is None:
+            return None
+        if settings.get("meta"):
+            # the thumbnail url is signed and changes between extractions, the thumbnail itself does not
+            settings["meta"] = {key: value for key, value in settings["meta"].items() if key != "thumbnail_url"}
+        extractor, video_id = DownloadArchive.key_of(info_dict)
+        return self.media_store.key(extractor, video_id, settings)
+
+    def _link_stored(self, store_key: str, output_format: str, output_file_path: str) -> bool:
+        """
+        Links the output from the media store if another folder already downloaded it
+        """
+        if store_key is None:
+            return False
+        try:
+            method = self.media_store.link(store_key, output_format, output_file_path)
+        except OSError as e:
+            print(f"Could not link {output_file_path} from the media store, downloading it: {e}")
+            return False
+        if method is None:
+            return False
+        print(f"Linked {output_file_path} from the media store ({method})")
+        self.metrics.inc("media_store_links_total")
+        return True
+
+    @staticmethod
+    def _file_identity(path: str):
+        """
+        :returns path, size and modification time of a local file, so a changed image changes the media store key,
+        the value itself for urls
+        """
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+        return path
+
+    def _cover_image(self, source: str, max_dimension: int = None):
+        """
+        :param source url or path of the image
+        :returns the normalized copy of the image from the cover cache, a local image that can not be normalized is
+        used as is, None if there is no image or it could not be fetched
+        """
+        if not source:
+            return None
+        try:
+            with self.metrics.timer("cover"):
+                return self.cover_cache.get(source, max_dimension)
+        except Exception as e:
+            print(f"Could not prepare the cover image {source}: {e}")
+            return None if CoverCache.is_url(source) else source
+
+    @staticmethod
+    def _source_codec(info_dict: dict, source_file: str, file_name: str):
+        """
+        :returns the audio codec of a stream downloaded by _download_selected_streams, None if it is not known
+        """
+        stream_name = os.path.basename(source_file or "")
+        format_id = stream_name[len(file_name) + 2:].rsplit('.', 1)[0] if stream_name.startswith(
+            file_name + ".f") else None
+        stream = next((stream for stream in info_dict.get('formats') or [] if stream.get('format_id') == format_id),
+                      info_dict)
+        acodec = stream.get('acodec')
+        return acodec if acodec != 'none' else None
+
+    def _tag_audio(self, output_file_path: str, meta_data: dict = None, cover_image: str = None) -> None:
+        """
+        Tags the audio file in place, falling back to an ffmpeg remux if the native tagger fails
+        """
+        try:
+            self.tagger.tag(output_file_path, meta_data, cover_image)
+        except Exception as e:
+            print(f"Native tagging failed for {output_file_path}, falling back to ffmpeg: {e}")
+            plan = PostProcessPlan(output_file_path, output_file_path)
+            if meta_data:
+                plan.add_metadata(meta_data)
+            if cover_image:
+                plan.add_cover_image(cover_image)
+            plan.run()
+
+    def _journal_key(self, info_dict: dict, file_format: str, still_frame_image: str = None) -> str:
+        extractor, video_id = DownloadArchive.key_of(info_dict)
+        if video_id is None:
+            return f"{info_dict.get('webpage_url')}:{self._archive_format(file_format, still_frame_image)}"
+        return f"{extractor}:{video_id}:{self._archive_format(file_format, still_frame_image)}"
+
+    def _journal_for(self, output_dir: str, resume: bool = False) -> JobJournal:
+        """
+        :returns the job journal of the output directory, shared by all jobs of the running runs writing there
+        """
+        with self._stats_lock:
+            path = os.path.abspath(output_dir)
+            if path not in self._journals:
+                self._journals[path] = JobJournal(output_dir, resume)
+            return self._journals[path]
+
+    @staticmethod
+    def _journal_reached(journal: JobJournal, journal_key: str, stage: str, output_file_path: str) -> bool:
+        return journal is not None and journal.reached(journal_key, stage) and os.path.exists(output_file_path)
+
+    def _journaled_download(self, journal: JobJournal, journal_key: str, url: str, info_dict: dict, output_dir: str,
+                            file_name: str, format_selector: str) -> list:
+        """
+        Downloads the streams unless a previous run already downloaded them, interrupted downloads continue from
+        their .part files since the stream file names are stable across runs
+        :returns the paths of the downloaded streams
+        """
+        state = journal.state(journal_key) if journal else None
+        if state and "downloaded" in state["stages"]:
+            source_files = state["data"].get("source_files") or []
+            post_processed = "post_processed" in state["stages"] and os.path.exists(state["data"]["output_file"])
+            if post_processed or source_files and all(map(os.path.exists, source_files)):
+                print(f"Resuming {info_dict.get('title')} after the download stage")
+                return source_files
+
+        if journal:
+            journal.record(journal_key, "downloading", url=url)
+        with self.metrics.timer("download"):
+            source_files = self._download_streams(url, info_dict, output_dir, file_name, format_selector)
+        if journal:
+            journal.record(journal_key, "downloaded", source_files=source_files)
+        return source_files
+
+    def _journaled_post_process(self, journal: JobJournal, journal_key: str, plan: PostProcessPlan) -> None:
+        if self._journal_reached(journal, journal_key, "post_processed", plan.output_file):
+            return
+        if not plan.completed:
+            with self.metrics.timer("ffmpeg"):
+                plan.run()
+        self.metrics.inc("written_bytes_total", plan.bytes_written)
+        if journal:
+            journal.record(journal_key, "post_processed", output_file=plan.output_file, steps=plan.steps)
+
+    @staticmethod
+    def _archive_format(file_format: str, still_frame_image: str = None) -> str:
+        # still frame videos are archived separately from regular downloads of the same format
+        return "mp4:still_frame" if still_frame_image else file_format
+
+    def _archived_output(self, archive: DownloadArchive, info_dict: dict, file_format: str,
+                         still_frame_image: str = None):
+        """
+        :returns the output path of the entry if it is already in the archive and still exists, otherwise None
+        """
+        if archive is None:
+            return None
+        extractor, video_id = archive.key_of(info_dict)
+        if extractor is None or video_id is None:
+            return None
+        archive_format = self._archive_format(file_format, still_frame_image)
+        if not archive.contains(extractor, video_id, archive_format):
+            return None
+        return archive.get(extractor, video_id, archive_format)["output_path"]
+
+    def _archive_output(self, archive: DownloadArchive, info_dict: dict, file_format: str, still_frame_image: str,
+                        output_file_path: str, postprocess_state: list) -> None:
+        if archive is None:
+            return
+        extractor, video_id = archive.key_of(info_dict)
+        if extractor is None or video_id is None:
+            return
+        archive.record(extractor, video_id, self._archive_format(file_format, still_frame_image), output_file_path,
+                       postprocess_state)
+
+    def run_in_context(self, function, *args, cancel_event: threading.Event = None, progress_listener=None):
+        """
+        Runs the function on the calling thread, downloads it starts there abort once the cancel event is set
+        :param progress_listener optionally called with the yt_dlp progress dicts of the downloads started there
+        """
+        self._context.cancel_event = cancel_event
+        self._context.progress_listener = progress_listener
+        try:
+            return function(*args)
+        finally:
+            self._context.cancel_event = None
+            self._context.progress_listener = None
 
+    def _on_progress(self, progress: dict) -> None:
+        """
+        yt_dlp progress hook, called on the thread running the download
+        """
+        self._report_progress(progress, getattr(self._context, "cancel_event", None),
+                              getattr(self._context, "progress_listener", None))
+
+    def _report_progress(self, progress: dict, cancel_event: threading.Event = None, progress_listener=None) -> None:
+        received = self.metrics.on_progress(progress)
+        if progress_listener is not None:
+            progress_listener(progress)
+        self.bandwidth.consume(received, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            self.stats[stat] += 1
+        self.metrics.inc(stat + "_total")
+
+    def _record_result(self, error: Exception, stage: str) -> None:
+        if error is not None:
+            self.metrics.inc("entries_failed_total", stage=stage.lower())
+        elif stage == "Skipped":
+            self.metrics.inc("entries_skipped_total")
+        else:
+            self.metrics.inc("entries_downloaded_total")
+
+    @contextlib.contextmanager
+    def _report_stats(self):
+        """
+        Resets the run counters and prints them once the run finished, the next run opens its job journals again.
+        Runs overlapping each other (jobs of a queue or server) share the counters and the open job journals, they
+        are only reset once no run is left, a journal is never reopened (and truncated) under a running job.
+        """
+        with self._stats_lock:
+            if not self._running:
+                for stat in self.stats:
+                    self.stats[stat] = 0
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._running -= 1
+                if not self._running:
+                    self._journals.clear()
+            print(f"Extractor calls: {self.stats['extractor_calls']}, "
+                  f"extraction cache hits: {self.stats['extraction_cache_hits']}, "
+                  f"YoutubeDL instances: {self.ydl_pool.created}")
+
+    @contextlib.contextmanager
+    def _playlist_extractor(self, lazy_playlist: bool):
+        """
+        Yields a YoutubeDL instance for flat, unprocessed extraction if lazy_playlist is set, otherwise None. The
+        instance stays open while the playlist entries are iterated, since lazy entries are fetched page by page.
+        """
+        if not lazy_playlist:
+            yield None
+            return
+        with self.ydl_pool.acquire({'extract_flat': 'in_playlist', 'lazy_playlist': True, 'no_warnings': True}) as ydl:
+            yield ydl
+
+    def _resolve_url(self, url: str, ydl=None) -> dict:
+        """
+        Extracts the url, playlists are left unprocessed (their entries lazy and flat) if a flat extractor from
+        _playlist_extractor is given
+        :returns the info dict of the video or playlist
+        """
+        if ydl is None:
+            return self._extract_info(url)
+        self._count("extractor_calls")
+        with self.metrics.timer("extraction"):
+            info_dict = ydl.extract_info(url, download=False, process=False)
+        if info_dict.get('_type') in ('url', 'url_transparent'):
+            return self._extract_info(info_dict.get('url'))
+        if info_dict.get('_type') != 'playlist':
+            return ydl.sanitize_info(info_dict)
+        return info_dict
+
+    def _extract_info(self, url: str, use_cache: bool = True) -> dict:
+        """
+        Extracts the info dict of the url, served from the extraction cache if enabled
+        :returns the json serializable info dict
+        """
+        if self.extraction_cache and use_cache:
+            info_dict = self.extraction_cache.get(url)
+            if info_dict is not None:
+                self._count("extraction_cache_hits")
+                return info_dict
+
+        with self.ydl_pool.acquire({'no_warnings': True}) as ydl, self.metrics.timer("extraction"):
+            self._count("extractor_calls")
+            info_dict = ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+        if self.extraction_cache:
+            self.extraction_cache.put(url, info_dict)
+        return info_dict
+
+    def _download_streams(self, url: str, info_dict: dict, output_dir: str, file_name: str,
+                          format_selector: str) -> list:
+        """
+        Downloads the raw streams picked by the format selector without letting yt_dlp merge or convert them,
+        merging and converting is left to a single PostProcessPlan pass. The already extracted info dict is handed to
+        yt_dlp so the extractor does not run again, unless the entry is still unresolved (flat) or its cached media
+        urls expired.
+        :param url the url of the video \n
+        :param info_dict the extracted info dict of the video \n
+        :param output_dir the output directory, the streams are written to its staging directory \n
+        :param file_name the resolved output file name (without extension) \n
+        :param format_selector the yt_dlp format selector \n
+        :returns the paths of the downloaded streams
+        """
+        if info_dict.get('_type', 'video') != 'video' or not info_dict.get('formats') and not info_dict.get('url'):
+            info_dict = self._extract_info(url)
+
+        try:
+            return self._download_selected_streams(info_dict, output_dir, file_name, format_selector)
+        except yt_dlp.utils.DownloadError:
+            if not self.extraction_cache or self.extraction_cache.get(url) is None:
+                raise
+            print(f"Download from cached extraction failed, extracting {url} again")
+            self.extraction_cache.invalidate(url)
+            return self._download_selected_streams(self._extract_info(url, use_cache=False), output_dir, file_name,
+                                                   format_selector)
+
+    def _download_selected_streams(self, info_dict: dict, output_dir: str, file_name: str,
+                                   format_selector: str) -> list:
         ydl_opts = {
-            'format': 'bestvideo+bestaudio/best',
-            'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
+            'format': format_selector,
             'noplaylist': True,
             'no_warnings': True,
-            'extract_flat': True,
+            'progress_hooks': [self._on_progress],
+            'concurrent_fragment_downloads': self.connections,
         }
+        if self.bandwidth.entry_rate:
+            ydl_opts['ratelimit'] = self.bandwidth.entry_rate
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        staging_dir = self.staging.dir_for(output_dir)
+        source_files = []
+        with self.ydl_pool.acquire(ydl_opts) as ydl:
+            info = self._select_formats(ydl, info_dict)
+            streams = info.get('requested_formats') or [info]
+            # the streams and the unfinished output are staged at the same time
+            estimated_bytes = sum(self._estimate_bytes(stream, info.get('duration')) for stream in streams)
+            # held while the streams download, concurrent entries see each other's share of the free space
+            with self.staging.reserve(staging_dir, output_dir, estimated_bytes, 2 * estimated_bytes):
+                for stream in streams:
+                    stream_info = dict(info)
+                    stream_info.update(stream)
+                    stream_info.pop('requested_formats', None)
+                    stream_file = os.path.join(staging_dir, f"{file_name}.f{stream['format_id']}.{stream['ext']}")
+                    if not self._download_in_ranges(stream_info, stream_file):
+                        # dl returns (success, real_download), the tuple itself is always true
+                        success, _ = ydl.dl(stream_file, stream_info)
+                        if not success:
+                            raise yt_dlp.utils.DownloadError(f"Could not download stream {stream['format_id']} of "
+                                                             f"{info.get('webpage_url')}")
+                    source_files.append(stream_file)
+        return source_files
 
-        if with_meta:
-            temp_output_file = tempfile.mktemp(suffix=f".{file_format}")
-            self._add_metadata_to_file(output_file_path, temp_output_file, meta_data)
-            shutil.copy(temp_output_file, output_file_path)
-            os.remove(temp_output_file)
-
-        if download_meta_separate:
-            meta_file_path = os.path.join(output_dir, file_name + ".meta.json")
-            with open(meta_file_path, 'w') as meta_file:
-                json.dump(info_dict, meta_file, indent=4)
+    @staticmethod
+    def _select_formats(ydl, info_dict: dict) -> dict:
+        """
+        Runs the format selection of the ydl on an already extracted info dict
+        :returns the info dict of the selected format, holding requested_formats if it merges several streams
+        """
+        info_dict = dict(info_dict)
+        # streams selected by an earlier processing (the extraction of a playlist), yt_dlp keeps them on the result
+        # if the new selection is a single format
+        info_dict.pop('requested_formats', None)
+        return ydl.process_ie_result(info_dict, download=False)
 
-        if album_cover_image:
-            temp_output_file = tempfile.mktemp(suffix=f".{file_format}")
-            self._add_cover_image_to_video(output_file_path, temp_output_file, album_cover_image)
-            shutil.copy(temp_output_file, output_file_path)
-            os.remove(temp_output_file)
-        return {output_file_path: info_dict}
+    def _download_in_ranges(self, stream: dict, stream_file: str) -> bool:
+        """
+        Downloads a progressive http stream over several connections
+        :returns False if the stream is left to yt_dlp (single connection, fragmented stream, per entry rate limit,
+        server without range support)
+        """
+        if (self.connections < 2 or self.bandwidth.entry_rate or stream.get('fragments')
+                or stream.get('protocol') not in ('http', 'https')):
+            return False
+        if os.path.exists(stream_file):
+            return True
+        # the range connections report from their own threads, the context belongs to the calling one
+        cancel_event = getattr(self._context, "cancel_event", None)
+        progress_listener = getattr(self._context, "progress_listener", None)
+        range_downloader = RangeDownloader(
+            self.connections, self.http_session,
+            lambda progress: self._report_progress(progress, cancel_event, progress_listener))
+        try:
+            return range_downloader.download(stream['url'], stream_file, stream.get('http_headers'))
+        except (requests.RequestException, IOError) as e:
+            raise yt_dlp.utils.DownloadError(f"Parallel download of stream {stream.get('format_id')} failed: {e}")
 
     def _resolve_file_name_template(self, file_name_template, meta_data):
         resolved_file_name = file_name_template
         for key, value in meta_data.items():
-            resolved_file_name = resolved_file_name.replace(f"{{{key}}}", value)
+            resolved_file_name = resolved_file_name.replace(f"{{{key}}}", str(value or ""))
         return self._sanitize_for_windows(resolved_file_name)
 
     @staticmethod
@@ -299,130 +1292,3 @@ class YTVideoDownloader:
     @staticmethod
     def _sanitize_for_windows(s):
         return re.sub(r'[<>:"/\\|?*]', '_', s)
-
-    @staticmethod
-    def _download_image_to_temp(url):
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        temp_file = tempfile.mktemp(suffix='.jpg')
-        with open(temp_file, 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-        return temp_file
-
-    @staticmethod
-    def _add_metadata_to_file(input_file, output_file, meta_data):
-        cmd = [
-            'ffmpeg', '-i', input_file,
-            '-metadata', f'title={meta_data["title"]}',
-            '-metadata', f'artist={meta_data["artist"]}',
-            '-metadata', f'album={meta_data["album"]}',
-            '-metadata', f'genre={meta_data["genre"]}',
-            '-metadata', f'date={meta_data["release_date"]}',
-            '-metadata', f'track={meta_data["track_number"]}',
-            '-c', 'copy', output_file
-        ]
-        subprocess.run(cmd, check=True)
-
-    @staticmethod
-    def _add_cover_image_to_audio(input_file, output_file, cover_image_file):
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,
-            '-i', cover_image_file,
-            '-map', '0',
-            '-map', '1',
-            '-c', 'copy',
-            '-id3v2_version', '3',
-            '-metadata:s:v', 'title="Album cover"',
-            '-metadata:s:v', 'comment="Cover (front)"',
-            output_file
-        ]
-        subprocess.run(cmd, check=True)
-
-    @staticmethod
-    def _add_cover_image_to_video(input_file, output_file, cover_image_file):
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,
-            '-i', cover_image_file,
-            '-map', '0',
-            '-map', '1',
-            '-c', 'copy',
-            '-metadata:s:v',
-            'title="Album cover"',
-            '-metadata:s:v',
-            'comment="Cover (front)"', output_file
-        ]
-        subprocess.run(cmd, check=True)
-
-    @staticmethod
-    def _create_video_from_audio_with_static_image(input_file: str, output_file: str, image_file: str) -> None:
-        """
-        Creates a video format out of audio and a static image, mimicking mp3's with album covers
-        :param input_file: the audio file to convert
-        :param output_file: the final output
-        :param image_file: the static image file
-        """
-        video_codec = "libx264"
-        audio_codec = "copy"
-        image_format = "yuv420p"
-        frame_rate = "1"
-
-        output_file_mp4 = os.path.splitext(output_file)[0] + '.mp4'
-
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,  # Input audio
-            '-i', image_file,  # Input image
-            '-c:v', video_codec,  # Video codec to use
-            '-r', frame_rate,  # Frame rate
-            '-pix_fmt', image_format,  # Pixel format
-            '-loop', '1',  # Loop the image
-            '-c:a', audio_codec,  # Audio codec
-            '-strict', 'experimental',
-            '-b:a', '192k',  # Audio bitrate
-            '-shortest',  # Stop when the shortest input ends
-            '-y',  # Overwrite output files without asking
-            output_file_mp4
-        ]
-
-        subprocess.run(cmd, check=True)
-
-        if os.path.exists(input_file):
-            os.remove(input_file)
-
-    @staticmethod
-    def _replace_video_with_static_image(input_file, output_file, image_file):
-        """
-        Replaces a video with a static image mimicking an mp3 with an album cover
-        :param input_file: the video file to convert
-        :param output_file: the final output
-        :param image_file: the static image file
-        """
-        video_codec = "libx264"
-        audio_codec = "copy"
-        image_format = "yuv420p"
-        frame_rate = "1"
-
-        temp_output_file = os.path.splitext(output_file)[0] + '_temp.mp4'
-
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,  # Input video
-            '-i', image_file,  # Input image
-            '-c:v', video_codec,  # Video codec to use
-            '-r', frame_rate,  # Frame rate
-            '-pix_fmt', image_format,  # Pixel format
-            '-map', '0:a?',  # Map audio if it exists
-            '-map', '1:0',  # Map image from the second file
-            '-c:a', audio_codec,  # Copy audio without re-encoding
-            '-y',  # Overwrite output files without asking
-            temp_output_file
-        ]
-
-        subprocess.run(cmd, check=True)
-
-        if os.path.abspath(input_file) == os.path.abspath(output_file):
-            os.replace(temp_output_file, output_file)
-        else:
-            os.rename(temp_output_file, output_file)
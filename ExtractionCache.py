@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+import time
+
+
+class ExtractionCache:
+    """
+    On disk cache of yt_dlp extraction results keyed by url, so repeated runs and retries skip the extractor round
+    trips. Entries expire after the ttl, keep it below the lifetime of the media urls (a few hours on YouTube).
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = 3600):
+        """
+        :param cache_dir the directory the cached info dicts are stored in
+        :param ttl seconds a cached extraction stays valid
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + ".json")
+
+    def get(self, url: str):
+        """
+        :returns the cached info dict or None if there is none or it expired
+        """
+        path = self._path(url)
+        try:
+            with open(path, 'r') as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get('created', 0) > self.ttl:
+            self.invalidate(url)
+            return None
+        return cached.get('info')
+
+    def put(self, url: str, info_dict: dict) -> None:
+        """
+        Stores the info dict, it has to be json serializable (see YoutubeDL.sanitize_info)
+        """
+        path = self._path(url)
+        temp_path = f"{path}.{os.getpid()}.{id(info_dict)}.tmp"
+        with open(temp_path, 'w') as cache_file:
+            json.dump({'url': url, 'created': time.time(), 'info': info_dict}, cache_file)
+        os.replace(temp_path, path)
+
+    def invalidate(self, url: str) -> None:
+        try:
+            os.remove(self._path(url))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+
+class JobJournal:
+    """
+    Write-ahead journal of the per entry stages (downloading, downloaded, post_processed, done) stored as json lines
+    in the output directory. Every record is flushed and fsynced before the stage continues, so after a crash a
+    resumed run knows which entries still need downloading and which only miss post-processing steps.
+    """
+
+    file_name = ".download_journal.jsonl"
+
+    def __init__(self, output_dir: str, resume: bool = False):
+        """
+        :param output_dir the directory the journal is kept in
+        :param resume if the state of the previous run is loaded, otherwise the journal starts empty
+        """
+        self.path = os.path.join(output_dir, self.file_name)
+        self._lock = threading.Lock()
+        self._states = {}
+        if resume:
+            self._load()
+            self._compact()
+        else:
+            open(self.path, 'w', encoding='utf-8').close()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line may be torn if the process died while writing it
+                        continue
+                    self._apply(record)
+        except FileNotFoundError:
+            pass
+
+    def _compact(self) -> None:
+        """
+        Rewrites the journal with one record per unfinished entry, finished entries are dropped
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as journal:
+            for key, state in list(self._states.items()):
+                if "done" in state["stages"]:
+                    del self._states[key]
+                    continue
+                journal.write(json.dumps({"key": key, "stages": state["stages"], "data": state["data"],
+                                          "time": time.time()}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_path, self.path)
+
+    def _apply(self, record: dict) -> None:
+        state = self._states.setdefault(record["key"], {"stages": [], "data": {}})
+        for stage in record.get("stages") or [record.get("stage")]:
+            if stage and stage not in state["stages"]:
+                state["stages"].append(stage)
+        state["data"].update(record.get("data") or {})
+
+    def record(self, key: str, stage: str, **data) -> None:
+        """
+        Durably records that the entry reached the stage
+        :param key the entry key, see YTVideoDownloader._journal_key
+        :param data json serializable values needed to resume from this stage
+        """
+        record = {"key": key, "stage": stage, "data": data, "time": time.time()}
+        with self._lock:
+            self._apply(record)
+            with open(self.path, 'a', encoding='utf-8') as journal:
+                journal.write(json.dumps(record) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def state(self, key: str):
+        """
+        :returns dict with the reached stages and recorded data of the entry, None if the entry is unknown
+        """
+        with self._lock:
+            state = self._states.get(key)
+            return {"stages": list(state["stages"]), "data": dict(state["data"])} if state else None
+
+    def reached(self, key: str, stage: str) -> bool:
+        state = self.state(key)
+        return state is not None and stage in state["stages"]
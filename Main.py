@@ -1,8 +1,13 @@
 import argparse
+import json
+import os
 import sys
 
-from VideoDownloaderCLI import VideoDownloaderCLI
-from VideoDownloaderUI import VideoDownloaderUI
+from BandwidthLimiter import parse_rate
+from QualityPolicy import QualityPolicy
+
+# the ui (tkinter) and the downloader (yt_dlp, requests) are only imported once they are used, so --help and invalid
+# arguments return without loading them
 
 
 # todo:jmd add documentation
@@ -12,12 +17,23 @@ from VideoDownloaderUI import VideoDownloaderUI
 def main():
     if len(sys.argv) == 1:
         # No arguments provided, default to UI mode
+        from VideoDownloaderUI import VideoDownloaderUI
         VideoDownloaderUI()
         return 0
+    if sys.argv[1] == "serve":
+        return serve(sys.argv[2:])
+    if sys.argv[1] == "client":
+        return client(sys.argv[2:])
 
     parser = argparse.ArgumentParser(description="YouTube Video Downloader with optional UI")
     parser.add_argument('--ui', action='store_true', help="Launch the downloader with a graphical user interface")
-    parser.add_argument('-url', type=str, required=True, help="The URL of the video or playlist to download")
+    # a batch file brings its own urls, a -url next to it would be silently ignored
+    sources = parser.add_mutually_exclusive_group()
+    sources.add_argument('-url', type=str, help="The URL of the video or playlist to download")
+    sources.add_argument('-batch', type=str,
+                         help="File with one URL per line to download on one shared thread pool ('-' reads stdin), "
+                              "a line can override options: URL directory=... file_format=... image=... "
+                              "file_name_template=... single_frame_video=true low_hardware_mode=true")
     parser.add_argument('-directory', type=str, required=True, help="The directory where the video will be saved")
     parser.add_argument('-image', type=str, help="The path to the album image")
     parser.add_argument('-file_format', type=str, default="mp4", help="The format of the output file (default: mp4)")
@@ -36,10 +52,52 @@ def main():
                         help="If the Video should be rendered as a single frame (requires an -image to be present")
     parser.add_argument("--download-meta-seperate", action='store_true', default=False,
                         help="if meta file should be downloaded seperatly")
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help="Continue an interrupted run, partial downloads continue from their byte offset and only "
+                             "the missing post-processing steps are redone")
+    parser.add_argument('-quality', type=str,
+                        help="Highest resolution to download, e.g. 720p (default: best available)")
+    parser.add_argument('-max_fps', type=int, help="Highest frame rate to download (default: best available)")
+    parser.add_argument('-max_filesize', type=str,
+                        help="Largest size of a single stream, e.g. 200M (default: no limit)")
+    parser.add_argument('-video_codec', type=str,
+                        help="Preferred video codec (avc1, vp9, av01), others are used if it is not available")
+    parser.add_argument('-audio_codec', type=str,
+                        help="Preferred audio codec (opus, mp4a), others are used if it is not available")
+    parser.add_argument('--dry_run', action='store_true', default=False,
+                        help="Only print the format that would be downloaded per entry and its estimated size")
+    parser.add_argument('-limit_rate', type=str,
+                        help="Total download rate of all threads together in bytes per second, e.g. 500K or 4M "
+                             "(default: unlimited)")
+    parser.add_argument('-entry_limit_rate', type=str,
+                        help="Download rate of a single video in bytes per second, e.g. 500K (default: unlimited)")
+    parser.add_argument('-connections', type=int, default=1,
+                        help="Parallel connections per file, speeds up single large videos on hosts throttling each "
+                             "connection (default: 1)")
+    parser.add_argument('-media_store', type=str,
+                        help="Directory of a media store shared by all playlist folders, a video downloaded once is "
+                             "linked into every other folder instead of downloaded again, keep it on the same drive")
+    parser.add_argument('-scratch_dir', type=str,
+                        help="Directory for streams and unfinished files (e.g. a tmpfs or fast local SSD), finished "
+                             "files are moved into the output directory (default: a hidden folder in the output "
+                             "directory)")
+    parser.add_argument('-stats_file', type=str,
+                        help="Json file the download metrics (throughput, stage timings, retries, failures) are "
+                             "written to every few seconds during the run")
+    parser.add_argument('-metrics_port', type=int,
+                        help="Serve the download metrics in the prometheus text format on "
+                             "http://127.0.0.1:PORT/metrics during the run")
     parser.add_argument('--low_hardware_mode', action='store_true', default=False,
                         help="(Only functional when --single_frame_video is present), if true downloads the mp4 and converts it to a still image (requires an less cpu power to convert but longer download times) if false downloads an mp3 version and converts it to an mp4 (requires more cpu power to convert but less download times)")
 
     args = parser.parse_args()
+    if not args.url and not args.batch:
+        parser.error("one of -url or -batch is required")
+    for rate in (args.limit_rate, args.entry_limit_rate):
+        try:
+            parse_rate(rate)
+        except ValueError as e:
+            parser.error(str(e))
 
     url = args.url
     directory = args.directory
@@ -54,18 +112,153 @@ def main():
     file_name_template = args.file_name_template
     single_frame_video = args.single_frame_video
     low_hardware_mode = args.low_hardware_mode
+    try:
+        quality = QualityPolicy.from_preset(args.quality, max_fps=args.max_fps, max_filesize=args.max_filesize,
+                                            video_codec=args.video_codec, audio_codec=args.audio_codec)
+    except ValueError as e:
+        parser.error(str(e))
 
     if args.ui:
+        from VideoDownloaderUI import VideoDownloaderUI
         VideoDownloaderUI(url, directory, image_path, file_format, show_album_cover_on_mp3, low_hardware_mode,
                           with_meta,
                           subfolder_playlists, single_frame_video, retries, backoff_factor, threads,
-                          file_name_template)
+                          file_name_template, rate_limit=args.limit_rate, quality_preset=args.quality)
     else:
-        VideoDownloaderCLI(url, directory, image_path, file_format, show_album_cover_on_mp3, low_hardware_mode,
-                           with_meta,
-                           subfolder_playlists, single_frame_video, retries, backoff_factor, threads,
-                           file_name_template)
+        from VideoDownloaderCLI import VideoDownloaderCLI
+        VideoDownloaderCLI(url=url,
+                           output_dir=directory,
+                           album_image=image_path,
+                           file_format=file_format,
+                           show_album_cover_on_mp3=show_album_cover_on_mp3,
+                           low_hardware_mode=low_hardware_mode,
+                           with_metadata=with_meta,
+                           subfolder_playlists=subfolder_playlists,
+                           single_frame_video=single_frame_video,
+                           retries=retries,
+                           backoff_factor=backoff_factor,
+                           threads=threads,
+                           file_name_template=file_name_template,
+                           batch_file=args.batch,
+                           resume=args.resume,
+                           stats_file=args.stats_file,
+                           metrics_port=args.metrics_port,
+                           rate_limit=args.limit_rate,
+                           entry_rate_limit=args.entry_limit_rate,
+                           quality=quality,
+                           dry_run=args.dry_run,
+                           connections=args.connections,
+                           media_store_dir=args.media_store,
+                           scratch_dir=args.scratch_dir)
+
+
+def serve(argv):
+    parser = argparse.ArgumentParser(prog="Main.py serve",
+                                     description="Keep the downloader running and accept jobs over a local http api")
+    parser.add_argument('-host', type=str, default="127.0.0.1",
+                        help="Address to listen on, the api has no authentication (default: 127.0.0.1)")
+    parser.add_argument('-port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('-state_dir', type=str, default=os.path.join(os.path.expanduser("~"), ".ytvd_server"),
+                        help="Directory of the persistent job queue (default: ~/.ytvd_server)")
+    parser.add_argument('-workers', type=int, default=1, help="Number of jobs running at the same time (default: 1)")
+    parser.add_argument('-threads', type=int, default=4,
+                        help="Number of download threads of a job unless the job sets its own (default: 4)")
+    parser.add_argument('-encode_threads', type=int,
+                        help="Number of concurrent ffmpeg processes of a job (default: core count)")
+    parser.add_argument('-limit_rate', type=str,
+                        help="Total download rate of all jobs together in bytes per second, e.g. 4M "
+                             "(default: unlimited)")
+    parser.add_argument('-entry_limit_rate', type=str,
+                        help="Download rate of a single video in bytes per second (default: unlimited)")
+    parser.add_argument('-connections', type=int, default=1, help="Parallel connections per file (default: 1)")
+    parser.add_argument('-media_store', type=str,
+                        help="Directory of a media store shared by all jobs, videos are linked instead of downloaded "
+                             "again")
+    parser.add_argument('-scratch_dir', type=str,
+                        help="Directory for streams and unfinished files (default: a hidden folder in the output "
+                             "directory)")
+    parser.add_argument('-stats_file', type=str,
+                        help="Json file the download metrics are written to every few seconds")
+    args = parser.parse_args(argv)
+    for rate in (args.limit_rate, args.entry_limit_rate):
+        try:
+            parse_rate(rate)
+        except ValueError as e:
+            parser.error(str(e))
+
+    from BandwidthLimiter import BandwidthLimiter
+    from DownloadServer import DownloadServer
+    from Downloader import YTVideoDownloader
+    from Metrics import JsonStatsFile
+
+    downloader = YTVideoDownloader(bandwidth_limiter=BandwidthLimiter(args.limit_rate, args.entry_limit_rate),
+                                   connections=args.connections, media_store_dir=args.media_store,
+                                   scratch_dir=args.scratch_dir)
+    if args.stats_file:
+        downloader.metrics.add_sink(JsonStatsFile(args.stats_file))
+    try:
+        DownloadServer(args.state_dir, args.host, args.port, args.workers, args.threads, args.encode_threads,
+                       downloader).serve_forever()
+    finally:
+        downloader.metrics.close()
+    return 0
+
+
+def client(argv):
+    parser = argparse.ArgumentParser(prog="Main.py client", description="Talk to a server started with serve")
+    parser.add_argument('-server', type=str, default="http://127.0.0.1:8765",
+                        help="Url of the server (default: http://127.0.0.1:8765)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="Queue a download, prints the job id")
+    submit.add_argument('-url', type=str, required=True, help="The URL of the video or playlist to download")
+    submit.add_argument('-directory', type=str, required=True,
+                        help="The directory where the video will be saved, as seen by the server")
+    submit.add_argument('-file_format', type=str, default="mp4", help="The format of the output file (default: mp4)")
+    submit.add_argument('-image', type=str, help="The path to the album image")
+    submit.add_argument('-quality', type=str, help="Highest resolution to download, e.g. 720p")
+    submit.add_argument('-threads', type=int, help="Number of download threads (default: the server's)")
+    submit.add_argument('--single_frame_video', action='store_true', default=False,
+                        help="Render the audio onto the -image as single frame video")
+    submit.add_argument('--low_hardware_mode', action='store_true', default=False,
+                        help="With --single_frame_video, download the mp4 instead of the audio")
+    submit.add_argument('--wait', action='store_true', default=False,
+                        help="Wait for the job to finish and print its status, exits with 1 if it failed")
+    for command in ("status", "cancel"):
+        commands.add_parser(command, help=f"{command.capitalize()} a job").add_argument('id', type=int)
+    commands.add_parser("list", help="List the jobs")
+    args = parser.parse_args(argv)
+
+    from DownloadClient import DownloadClient
+
+    download_client = DownloadClient(args.server)
+    try:
+        if args.command == "submit":
+            job = {"url": args.url, "output_dir": args.directory, "file_format": args.file_format,
+                   "album_cover_image": args.image, "quality": args.quality}
+            if args.threads:
+                job["threads"] = args.threads
+            if args.single_frame_video:
+                job.update(file_format="mp4" if args.low_hardware_mode else "mp3", still_frame_image=args.image,
+                           album_cover_image=None)
+            job_id = download_client.submit(job)
+            if not args.wait:
+                print(job_id)
+                return 0
+            status = download_client.wait(job_id)
+            print(json.dumps(status, indent=2))
+            return 0 if status["state"] == "done" else 1
+        if args.command == "status":
+            print(json.dumps(download_client.status(args.id), indent=2))
+        elif args.command == "cancel":
+            print(json.dumps({"cancelled": download_client.cancel(args.id)}))
+        else:
+            for job in download_client.jobs():
+                print(f"{job['id']:>6} {job['state']:<10} {job['url']}")
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux ioctl sharing the extents of one file with another (btrfs, xfs, bcachefs)
+FICLONE = 0x40049409
+
+
+class MediaStore:
+    """
+    Content addressed store of finished outputs shared by all output directories, keyed by video, output format and
+    post-processing settings. The first download of a video is added to the store, every further playlist folder
+    asking for the same output gets a link to it instead of downloading and encoding it again. Outputs are linked
+    with a hardlink, falling back to a reflink (copy on write clone), a symlink and a plain copy, whatever the file
+    systems support.
+    """
+
+    def __init__(self, store_dir: str):
+        """
+        :param store_dir the directory of the store, hardlinks need it on the same file system as the downloads
+        """
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    @staticmethod
+    def key(extractor: str, video_id: str, settings: dict) -> str:
+        """
+        :param settings everything the output depends on besides the video (format, quality, tags, images)
+        :returns the key of the output, None if the video is unknown
+        """
+        if not extractor or not video_id:
+            return None
+        payload = json.dumps([extractor, video_id, settings], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.store_dir, key[:2], f"{key}.{extension}")
+
+    def get(self, key: str, extension: str):
+        """
+        :returns the path of the stored output, None if it is not in the store
+        """
+        path = self._path(key, extension)
+        return path if os.path.exists(path) else None
+
+    def add(self, key: str, output_path: str) -> None:
+        """
+        Adds a finished output to the store, as hardlink or reflink of the output if possible, as copy otherwise
+        """
+        path = self._path(key, os.path.splitext(output_path)[1][1:])
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a symlink would break once the output is deleted, the store has to own its data
+        self._link(output_path, path, ("hardlink", "reflink", "copy"))
+
+    def link(self, key: str, extension: str, output_path: str):
+        """
+        Links the stored output to the output path, replacing a file that may be there
+        :returns how it was linked (hardlink, reflink, symlink or copy), None if the output is not in the store
+        """
+        path = self.get(key, extension)
+        if path is None:
+            return None
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        return self._link(path, output_path, ("hardlink", "reflink", "symlink", "copy"))
+
+    def _link(self, source: str, target: str, methods: tuple) -> str:
+        # every method writes a temporary file that replaces the target, so the target is never half written
+        temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.link.tmp"
+        for method in methods:
+            try:
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                getattr(self, f"_{method}")(source, temp_path)
+                os.replace(temp_path, target)
+                return method
+            except OSError:
+                continue
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise OSError(f"Could not link {source} to {target}")
+
+    @staticmethod
+    def _hardlink(source: str, target: str) -> None:
+        os.link(source, target)
+
+    @staticmethod
+    def _reflink(source: str, target: str) -> None:
+        if fcntl is None:
+            raise OSError("Reflinks are not supported on this platform")
+        try:
+            with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+                fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+
+    @staticmethod
+    def _symlink(source: str, target: str) -> None:
+        os.symlink(os.path.abspath(source), target)
+
+    @staticmethod
+    def _copy(source: str, target: str) -> None:
+        shutil.copyfile(source, target)
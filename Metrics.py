@@ -0,0 +1,259 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics:
+    """
+    Thread safe counters, gauges and latency histograms of a downloader. Fed by the yt_dlp progress hook and by timers
+    around the extraction, download and post-processing stages, read by the sinks (json stats file, prometheus text
+    endpoint) while the run is going.
+    """
+
+    prefix = "ytvd_"
+    # upper bounds in seconds of the stage latency histogram buckets
+    latency_buckets = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        # bytes and speed last reported per file by the progress hook
+        self._downloaded = {}
+        self._speeds = {}
+        self._sinks = []
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.latency_buckets), "sum": 0.0,
+                                                     "count": 0}
+            index = bisect.bisect_left(self.latency_buckets, value)
+            if index < len(self.latency_buckets):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        """
+        Observes the time spent in the block as stage latency, failed blocks are counted as stage failures
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("stage_failures_total", stage=stage)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def on_progress(self, progress: dict) -> int:
+        """
+        yt_dlp progress hook, accumulates the downloaded bytes and the current speed of every running download
+        :returns the bytes received since the last progress report of the same file
+        """
+        # tmpfilename is only reported while downloading, filename in every status
+        file_name = progress.get("filename")
+        downloaded = progress.get("downloaded_bytes") or 0
+        with self._lock:
+            previous = self._downloaded.get(file_name)
+            if previous is None:
+                # the first report is the baseline, bytes resumed from a .part file or an existing file were not
+                # received now, downloaders knowing them exactly report them as resumed_bytes
+                previous = progress.get("resumed_bytes", downloaded)
+            delta = downloaded - previous
+            if delta > 0:
+                key = self._key("downloaded_bytes_total", {})
+                self._counters[key] = self._counters.get(key, 0) + delta
+            if progress.get("status") == "downloading":
+                # connections of a range download report from their own threads, possibly out of order
+                self._downloaded[file_name] = max(downloaded, previous)
+                self._speeds[file_name] = progress.get("speed") or 0
+            else:
+                self._downloaded.pop(file_name, None)
+                self._speeds.pop(file_name, None)
+        return max(delta, 0)
+
+    def snapshot(self) -> dict:
+        """
+        :returns json serializable copy of all metrics, labels are flattened into the metric name
+        """
+        with self._lock:
+            counters = {self._flat_name(key): value for key, value in self._counters.items()}
+            gauges = {self._flat_name(key): value for key, value in self._gauges.items()}
+            gauges["download_speed_bytes"] = sum(self._speeds.values())
+            gauges["active_downloads"] = len(self._speeds)
+            histograms = {}
+            for key, histogram in self._histograms.items():
+                histograms[self._flat_name(key)] = {
+                    "buckets": dict(zip(map(str, self.latency_buckets), histogram["buckets"])),
+                    "sum": histogram["sum"],
+                    "count": histogram["count"],
+                }
+        elapsed = time.time() - self.started
+        gauges["uptime_seconds"] = elapsed
+        gauges["average_throughput_bytes"] = counters.get("downloaded_bytes_total", 0) / elapsed if elapsed else 0
+        return {"time": time.time(), "counters": counters, "gauges": gauges, "histograms": histograms}
+
+    @staticmethod
+    def _flat_name(key: tuple) -> str:
+        name, labels = key
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+    def to_prometheus(self) -> str:
+        """
+        :returns all metrics in the prometheus text exposition format
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            gauges[self._key("download_speed_bytes", {})] = sum(self._speeds.values())
+            gauges[self._key("active_downloads", {})] = len(self._speeds)
+            histograms = {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                          for key, value in self._histograms.items()}
+        gauges[self._key("uptime_seconds", {})] = time.time() - self.started
+
+        lines = []
+        for metric_type, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {self.prefix}{name} {metric_type}")
+                for (key_name, labels), value in sorted(values.items()):
+                    if key_name == name:
+                        lines.append(f"{self.prefix}{name}{self._prometheus_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {self.prefix}{name} histogram")
+            for (key_name, labels), histogram in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.latency_buckets, histogram["buckets"]):
+                    cumulative += count
+                    bucket_labels = self._prometheus_labels(labels + (("le", bound),))
+                    lines.append(f"{self.prefix}{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.prefix}{name}_bucket{self._prometheus_labels(labels + (('le', '+Inf'),))} "
+                             f"{histogram['count']}")
+                lines.append(f"{self.prefix}{name}_sum{self._prometheus_labels(labels)} {histogram['sum']}")
+                lines.append(f"{self.prefix}{name}_count{self._prometheus_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _prometheus_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                   for _, value in labels)
+        return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+    def add_sink(self, sink) -> None:
+        """
+        Starts the sink, it is stopped again by close
+        """
+        sink.start(self)
+        self._sinks.append(sink)
+
+    def close(self) -> None:
+        for sink in self._sinks:
+            sink.stop()
+        self._sinks.clear()
+
+
+class JsonStatsFile:
+    """
+    Sink periodically replacing a json file with the current metrics snapshot
+    """
+
+    def __init__(self, path: str, interval: float = 5):
+        """
+        :param path the stats file, written atomically so readers never see a partial file
+        :param interval seconds between two writes
+        """
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = None
+
+    def start(self, metrics: Metrics) -> None:
+        self._metrics = metrics
+        self._thread = threading.Thread(target=self._run, name="metrics-json", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self) -> None:
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as stats_file:
+            json.dump(self._metrics.snapshot(), stats_file, indent=4)
+        os.replace(temp_path, self.path)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        # the final state of the run
+        self.write()
+
+
+class PrometheusEndpoint:
+    """
+    Sink serving the metrics in the prometheus text format on http://host:port/metrics
+    """
+
+    def __init__(self, port: int = 9464, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self, metrics: Metrics) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
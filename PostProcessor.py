@@ -0,0 +1,384 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+
+from Staging import move_into_place
+
+# ffmpeg encoders used when the audio stream has to be converted into the requested format, formats not listed
+# here are left to ffmpeg's default encoder for the output container
+AUDIO_ENCODERS = {
+    'mp3': 'libmp3lame', 'aac': 'aac', 'm4a': 'aac', 'opus': 'libopus', 'ogg': 'libvorbis', 'flac': 'flac',
+    'wav': 'pcm_s16le', 'aiff': 'pcm_s16be', 'alac': 'alac', 'ac3': 'ac3', 'eac3': 'eac3', 'wma': 'wmav2',
+    'mp2': 'mp2', 'mka': 'libopus',
+}
+
+# sample rates the encoders accept, others are resampled to the first one
+ENCODER_SAMPLE_RATES = {
+    'libopus': ('48000', '24000', '16000', '12000', '8000'),
+}
+
+# extensions ffmpeg can not guess the muxer from
+OUTPUT_MUXERS = {
+    'alac': 'ipod',
+}
+
+# containers that can carry an embedded cover image next to the audio
+COVER_CONTAINERS = {'mp3', 'm4a', 'flac', 'mp4', 'm4v', 'mov', 'mkv', 'mka'}
+
+# source audio codecs (yt_dlp acodec prefixes) that can be copied into the output format without re-encoding, the
+# first one is the codec downloads of the format prefer
+COPY_AUDIO_CODECS = {
+    'mp3': ('mp3',), 'm4a': ('mp4a', 'aac'), 'aac': ('mp4a', 'aac'), 'opus': ('opus',), 'ogg': ('vorbis', 'opus'),
+    'flac': ('flac',), 'alac': ('alac',), 'mka': ('opus', 'vorbis', 'mp4a', 'aac', 'mp3', 'flac'),
+}
+
+# source audio that can be copied into an mp4 container as is
+MP4_AUDIO_SOURCES = {'m4a', 'mp4', 'aac', 'mp3'}
+
+
+class PostProcessPlan:
+    """
+    Collects every post-processing step requested for a single output file (audio extraction, tags, cover art,
+    still frame conversion) and runs them as one ffmpeg invocation, so the file is only written once.
+    """
+
+    def __init__(self, source_files, output_file: str, temp_dir: str = None):
+        """
+        :param source_files the downloaded stream(s), a video and an audio stream are merged in the same pass \n
+        :param output_file the final output path, its extension decides the container \n
+        :param temp_dir where ffmpeg writes before the output is moved in place, next to the output if not set
+        """
+        if isinstance(source_files, str):
+            source_files = [source_files]
+        self.source_files = list(source_files)
+        self.output_file = output_file
+        self.temp_dir = temp_dir
+        self.output_format = os.path.splitext(output_file)[1][1:].lower()
+        self.meta_data = None
+        self.cover_image = None
+        self.still_image = None
+        self.still_frame_cache = None
+        self.still_segment = None
+        self.duration = None
+        self.audio_codec = None
+        self.source_codec = None
+        self.audio_quality = '192k'
+        self.sample_rate = None
+        self.staged_steps = []
+        self.bytes_written = 0
+        self.completed = False
+
+    @property
+    def steps(self) -> list:
+        """
+        :returns the names of the steps this plan applies, in the order they were requested
+        """
+        steps = []
+        if self.audio_codec == 'copy':
+            steps.append("copy_audio")
+        elif self.audio_codec:
+            steps.append("extract_audio")
+        if self.still_image:
+            steps.append("still_frame")
+        if self.meta_data:
+            steps.append("metadata")
+        if self.cover_image:
+            steps.append("cover")
+        return steps
+
+    def extract_audio(self, file_format: str, quality: str = '192k', sample_rate: str = '44100',
+                      source_codec: str = None):
+        """
+        Keeps only the audio, converted into the format
+        :param source_codec the codec of the downloaded audio, if the format can hold it the audio is copied as is
+        (no re-encode, no resampling) instead of transcoded
+        """
+        self.source_codec = source_codec
+        if source_codec and source_codec.lower().startswith(COPY_AUDIO_CODECS.get(file_format, ())):
+            self.audio_codec = 'copy'
+            self.sample_rate = None
+            return self
+        self.audio_codec = AUDIO_ENCODERS.get(file_format, 'default')
+        self.audio_quality = quality
+        supported_rates = ENCODER_SAMPLE_RATES.get(self.audio_codec)
+        if sample_rate and supported_rates and str(sample_rate) not in supported_rates:
+            sample_rate = supported_rates[0]
+        self.sample_rate = sample_rate
+        return self
+
+    @property
+    def audio_copied(self) -> bool:
+        return self.audio_codec == 'copy'
+
+    def add_metadata(self, meta_data: dict):
+        self.meta_data = meta_data
+        return self
+
+    def add_cover_image(self, image_file: str):
+        if self.output_format not in COVER_CONTAINERS:
+            print(f"Skipping cover image, {self.output_format} can not embed one")
+            return self
+        self.cover_image = image_file
+        return self
+
+    def add_still_frame(self, image_file: str, still_frame_cache=None, duration: float = None):
+        """
+        Replaces any video of the sources with the image, mimicking an mp3 with an album cover
+        :param still_frame_cache if set the image is encoded once by the cache and the segment is looped by stream
+        copy, instead of encoding the image for the full length of every file
+        :param duration the length of the audio in seconds if known, bounds the looped segment exactly
+        """
+        self.still_image = image_file
+        self.still_frame_cache = still_frame_cache
+        self.duration = duration
+        return self
+
+    def add_staged_step(self, step):
+        """
+        Adds a step editing the written file in place (native tagging), it runs on the staged file before the file
+        is moved to the output path, so the output is never seen or left half edited
+        :param step called with the path of the staged file
+        """
+        self.staged_steps.append(step)
+        return self
+
+    def build_command(self, output_file: str) -> list:
+        """
+        Builds the single ffmpeg command graph for all collected steps
+        :param output_file the file ffmpeg should write to
+        :returns the command as argument list
+        """
+        cmd = ['ffmpeg', '-hide_banner', '-y']
+        for source_file in self.source_files:
+            cmd += ['-i', source_file]
+        image_input = len(self.source_files)
+        if self.still_segment:
+            cmd += ['-stream_loop', '-1', '-i', self.still_segment]
+        elif self.still_image:
+            cmd += ['-loop', '1', '-framerate', '1', '-i', self.still_image]
+        elif self.cover_image:
+            cmd += ['-i', self.cover_image]
+
+        audio_only = self.audio_codec is not None or self.still_image is not None
+        for index in range(len(self.source_files)):
+            cmd += ['-map', f'{index}:a?' if audio_only else str(index)]
+        if self.still_image or self.cover_image:
+            cmd += ['-map', f'{image_input}:v']
+
+        if self.still_image:
+            if self.still_segment:
+                cmd += ['-c:v', 'copy', '-shortest']
+                if self.duration:
+                    cmd += ['-t', str(self.duration)]
+            else:
+                cmd += ['-c:v', 'libx264', '-shortest'] + StillFrameCache.encoder_args()
+            if all(os.path.splitext(f)[1][1:].lower() in MP4_AUDIO_SOURCES for f in self.source_files):
+                cmd += ['-c:a', 'copy']
+            else:
+                cmd += ['-c:a', 'aac', '-b:a', self.audio_quality]
+        elif self.audio_copied:
+            cmd += ['-c:v', 'copy', '-c:a', 'copy']
+        elif self.audio_codec:
+            cmd += ['-c:v', 'copy']
+            if self.audio_codec != 'default':
+                cmd += ['-c:a', self.audio_codec]
+            if self.audio_codec not in ('flac', 'alac', 'pcm_s16le', 'pcm_s16be'):
+                cmd += ['-b:a', self.audio_quality]
+            if self.sample_rate:
+                cmd += ['-ar', self.sample_rate]
+        else:
+            cmd += ['-c', 'copy']
+
+        if self.cover_image and (audio_only or self.output_format in AUDIO_ENCODERS):
+            # only audio is mapped from the sources, the cover is the one video stream of the output
+            cmd += [
+                '-disposition:v:0', 'attached_pic',
+                '-metadata:s:v', 'title=Album cover',
+                '-metadata:s:v', 'comment=Cover (front)',
+            ]
+        if self.cover_image:
+            if self.output_format == 'mp3':
+                cmd += ['-id3v2_version', '3']
+
+        if self.meta_data:
+            for tag, key in (('title', 'title'), ('artist', 'artist'), ('album', 'album'), ('genre', 'genre'),
+                             ('date', 'release_date'), ('track', 'track_number')):
+                value = self.meta_data.get(key)
+                if value:
+                    cmd += ['-metadata', f'{tag}={value}']
+
+        if self.output_format in OUTPUT_MUXERS:
+            cmd += ['-f', OUTPUT_MUXERS[self.output_format]]
+        cmd.append(output_file)
+        return cmd
+
+    def run(self) -> str:
+        """
+        Runs the plan, writing to the temp dir (or next to the output file) and moving it in place once ffmpeg
+        succeeded
+        :returns the output file path
+        """
+        if self.completed:
+            return self.output_file
+        if self.still_image and self.still_frame_cache:
+            self.still_segment = self.still_frame_cache.segment(self.still_image)
+        temp_output_file = self._temp_output_file()
+        try:
+            subprocess.run(self.build_command(temp_output_file), check=True)
+            for step in self.staged_steps:
+                step(temp_output_file)
+            move_into_place(temp_output_file, self.output_file)
+        finally:
+            if os.path.exists(temp_output_file):
+                os.remove(temp_output_file)
+        return self._finish()
+
+    async def run_async(self) -> str:
+        """
+        Same as run but as asyncio subprocess, cancelling the awaiting task kills ffmpeg
+        :returns the output file path
+        """
+        if self.completed:
+            return self.output_file
+        if self.still_image and self.still_frame_cache:
+            self.still_segment = await asyncio.get_running_loop().run_in_executor(
+                None, self.still_frame_cache.segment, self.still_image)
+        temp_output_file = self._temp_output_file()
+        cmd = self.build_command(temp_output_file)
+        try:
+            process = await asyncio.create_subprocess_exec(*cmd)
+            try:
+                return_code = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+            if return_code != 0:
+                raise subprocess.CalledProcessError(return_code, cmd)
+            for step in self.staged_steps:
+                await asyncio.get_running_loop().run_in_executor(None, step, temp_output_file)
+            move_into_place(temp_output_file, self.output_file)
+        finally:
+            if os.path.exists(temp_output_file):
+                os.remove(temp_output_file)
+        return self._finish()
+
+    def _temp_output_file(self) -> str:
+        base, ext = os.path.splitext(self.output_file)
+        if self.temp_dir:
+            base = os.path.join(self.temp_dir, os.path.basename(base))
+        return base + '.partial' + ext
+
+    def _finish(self) -> str:
+        self.bytes_written = os.path.getsize(self.output_file)
+        for source_file in self.source_files:
+            if os.path.abspath(source_file) != os.path.abspath(self.output_file) and os.path.exists(source_file):
+                os.remove(source_file)
+        self.completed = True
+        return self.output_file
+
+
+class StillFrameCache:
+    """
+    Encodes a still image once into a short H.264 segment that is then looped by stream copy for every file using
+    the same image, turning the per file still frame encode into a remux. Segments are keyed by the image content,
+    resolution and pixel format. The least recently used segments are evicted once the cache grows past its size
+    limit.
+    """
+
+    segment_seconds = 60
+    pixel_format = 'yuv420p'
+
+    def __init__(self, cache_dir: str = None, resolution: str = None, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param cache_dir where segments are stored, defaults to a directory in the system temp dir
+        :param resolution WIDTHxHEIGHT to scale (and pad) the image to, None keeps the image size
+        :param max_bytes size of the cache after which the least recently used segments are evicted
+        """
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "ytvd_still_frames")
+        self.resolution = resolution
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def encoder_args(resolution: str = None) -> list:
+        """
+        :returns the ffmpeg output arguments encoding a still image stream
+        """
+        if resolution:
+            width, height = resolution.lower().split('x')
+            scale = (f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+                     f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2')
+        else:
+            scale = 'scale=trunc(iw/2)*2:trunc(ih/2)*2'
+        return ['-tune', 'stillimage', '-pix_fmt', StillFrameCache.pixel_format, '-vf', scale, '-r', '1']
+
+    def key(self, image_file: str) -> str:
+        digest = hashlib.sha256()
+        with open(image_file, 'rb') as image:
+            for chunk in iter(lambda: image.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(f"|{self.resolution}|{self.pixel_format}|{self.segment_seconds}".encode())
+        return digest.hexdigest()
+
+    def segment(self, image_file: str) -> str:
+        """
+        :returns the path of the encoded segment for the image, encoding it if it is not cached yet
+        """
+        key = self.key(image_file)
+        segment_file = os.path.join(self.cache_dir, key + ".mp4")
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.exists(segment_file):
+                # the modification time orders the segments for eviction
+                os.utime(segment_file)
+                return segment_file
+            temp_segment_file = os.path.join(self.cache_dir, f"{key}.{threading.get_ident()}.partial.mp4")
+            cmd = [
+                'ffmpeg', '-hide_banner', '-y',
+                '-loop', '1', '-framerate', '1', '-i', image_file,
+                '-t', str(self.segment_seconds),
+                '-c:v', 'libx264',
+                # a single GOP, every loop iteration starts on a keyframe
+                '-g', str(self.segment_seconds),
+            ] + self.encoder_args(self.resolution) + [temp_segment_file]
+            try:
+                subprocess.run(cmd, check=True)
+                os.replace(temp_segment_file, segment_file)
+            finally:
+                if os.path.exists(temp_segment_file):
+                    os.remove(temp_segment_file)
+        self._evict(keep=segment_file)
+        return segment_file
+
+    def _evict(self, keep: str = None) -> None:
+        """
+        Removes the least recently used segments until the cache fits into max_bytes
+        """
+        segments = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp4") or name.endswith(".partial.mp4"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            segments.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in segments)
+        for _, size, path in sorted(segments):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
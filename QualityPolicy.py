@@ -0,0 +1,91 @@
+class QualityPolicy:
+    """
+    Limits on the streams that are downloaded (height, fps, file size) and the preferred codecs, turned into a
+    yt_dlp format selector. Every limit is soft on unknown values, a format missing its height or size is still
+    eligible, and if nothing matches the limits the best format is used instead of failing the download.
+    """
+
+    def __init__(self, max_height: int = None, max_fps: int = None, max_filesize=None, video_codec: str = None,
+                 audio_codec: str = None):
+        """
+        :param max_height highest vertical resolution, e.g. 720 \n
+        :param max_fps highest frame rate \n
+        :param max_filesize largest size of a single stream in bytes or as yt_dlp size string (e.g. 200M) \n
+        :param video_codec preferred video codec prefix (avc1, vp9, av01), other codecs are used if it is missing \n
+        :param audio_codec preferred audio codec prefix (opus, mp4a) \n
+        """
+        self.max_height = max_height
+        self.max_fps = max_fps
+        self.max_filesize = max_filesize
+        self.video_codec = video_codec
+        self.audio_codec = audio_codec
+
+    @classmethod
+    def from_preset(cls, preset: str, **limits):
+        """
+        :param preset a quality preset like 720p, empty or None for no height limit
+        :returns the policy capping the height at the preset
+        :raises ValueError if the preset is not a height
+        """
+        if preset:
+            height = preset.strip().lower().rstrip("p")
+            if not height.isdigit():
+                raise ValueError(f"Invalid quality '{preset}', expected a height like 720p")
+            limits.setdefault("max_height", int(height))
+        return cls(**limits)
+
+    def preferring_audio_codec(self, audio_codec: str):
+        """
+        :returns a copy of the policy preferring the audio codec, unless the policy already prefers one
+        """
+        policy = QualityPolicy(**vars(self))
+        policy.audio_codec = self.audio_codec or audio_codec
+        return policy
+
+    def _video_filters(self) -> str:
+        filters = ""
+        if self.max_height:
+            filters += f"[height<=?{self.max_height}]"
+        if self.max_fps:
+            filters += f"[fps<=?{self.max_fps}]"
+        return filters + self._size_filter()
+
+    def _size_filter(self) -> str:
+        return f"[filesize<?{self.max_filesize}]" if self.max_filesize else ""
+
+    def _codec_filter(self, codec: str, field: str) -> str:
+        return f"[{field}^={codec}]" if codec else ""
+
+    def audio_selector(self) -> str:
+        """
+        :returns the yt_dlp format selector for audio downloads
+        """
+        size = self._size_filter()
+        selectors = []
+        if self.audio_codec:
+            selectors.append(f"bestaudio{self._codec_filter(self.audio_codec, 'acodec')}{size}")
+        if size:
+            selectors.append(f"bestaudio{size}")
+        selectors += ["bestaudio", "best"]
+        return "/".join(selectors)
+
+    def video_selector(self) -> str:
+        """
+        :returns the yt_dlp format selector for video downloads
+        """
+        video = self._video_filters()
+        audio_filters = self._codec_filter(self.audio_codec, 'acodec') + self._size_filter()
+        audio = f"(bestaudio{audio_filters}/bestaudio)" if audio_filters else "bestaudio"
+        selectors = []
+        if self.video_codec:
+            selectors.append(f"bestvideo{video}{self._codec_filter(self.video_codec, 'vcodec')}+{audio}")
+        if not video:
+            return "/".join(selectors + [f"bestvideo+{audio}", "best"])
+        selectors += [f"bestvideo{video}+{audio}", f"best{video}",
+                      # nothing is within the limits, the smallest stream is the closest to them
+                      f"worstvideo+{audio}", "worst"]
+        return "/".join(selectors)
+
+    def __repr__(self):
+        limits = ", ".join(f"{key}={value}" for key, value in vars(self).items() if value)
+        return f"QualityPolicy({limits})"
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class RangeDownloader:
+    """
+    Downloads a progressive http file over several connections, every connection fetching its own byte range into
+    the same preallocated .ranges.part file, so hosts throttling each connection deliver the file several times
+    faster. The offsets reached by the connections are saved next to it, an interrupted download continues from
+    them.
+    """
+
+    # files smaller than two parts of this size are left to a single connection
+    min_part_size = 4 * 1024 * 1024
+    chunk_size = 256 * 1024
+    # bytes between two saves of the reached offsets
+    checkpoint_bytes = 8 * 1024 * 1024
+    part_retries = 3
+
+    def __init__(self, connections: int = 4, session: requests.Session = None, progress_hook=None,
+                 timeout: float = 30):
+        """
+        :param connections number of parallel range requests \n
+        :param session the (pooled) http session to use \n
+        :param progress_hook called with yt_dlp style progress dicts (status, filename, downloaded_bytes,
+        total_bytes, speed) plus the resumed_bytes of an earlier run, may raise to abort the download \n
+        """
+        self.connections = max(1, connections)
+        self.session = session or requests.Session()
+        self.progress_hook = progress_hook
+        self.timeout = timeout
+
+    def probe(self, url: str, headers: dict = None):
+        """
+        :returns the size of the file if the server answers range requests, otherwise None
+        """
+        with self.session.get(url, headers=dict(headers or {}, Range="bytes=0-0"), stream=True,
+                              timeout=self.timeout) as response:
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code != 206 or "/" not in content_range:
+                return None
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+
+    def download(self, url: str, file_path: str, headers: dict = None) -> bool:
+        """
+        :returns True once the file is downloaded, False if the server does not support range requests or the file
+        is too small to be worth splitting, the caller then downloads it itself
+        """
+        total = self.probe(url, headers)
+        if not total or total < 2 * self.min_part_size:
+            return False
+
+        # not yt_dlp's .part name, yt_dlp would resume the preallocated zeros if the stream ever falls back to it
+        part_file = file_path + ".ranges.part"
+        ranges_file = file_path + ".ranges.json"
+        parts = self._load_parts(ranges_file, part_file, total)
+        if parts is None:
+            parts = self._split(total)
+            with open(part_file, 'wb') as out_file:
+                out_file.truncate(total)
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        state = {"downloaded": sum(offset - start for start, _, offset in parts), "checkpoint": 0,
+                 "started": time.monotonic(), "resumed": sum(offset - start for start, _, offset in parts)}
+
+        def report(byte_count):
+            with lock:
+                state["downloaded"] += byte_count
+                state["checkpoint"] += byte_count
+                if state["checkpoint"] >= self.checkpoint_bytes:
+                    state["checkpoint"] = 0
+                    self._save_parts(ranges_file, total, parts)
+                downloaded = state["downloaded"]
+            # the hook may sleep for the bandwidth budget, the other connections must not wait behind it
+            elapsed = time.monotonic() - state["started"]
+            self._hook({"status": "downloading", "filename": file_path, "tmpfilename": part_file,
+                        "downloaded_bytes": downloaded, "total_bytes": total, "resumed_bytes": state["resumed"],
+                        "speed": (downloaded - state["resumed"]) / elapsed if elapsed else None})
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                futures = [executor.submit(self._fetch_part, url, headers, part_file, part, report, stop)
+                           for part in parts]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    stop.set()
+                    raise
+        finally:
+            self._save_parts(ranges_file, total, parts)
+
+        if any(offset <= end for _, end, offset in parts):
+            raise IOError(f"Incomplete download of {url}")
+        os.replace(part_file, file_path)
+        os.remove(ranges_file)
+        self._hook({"status": "finished", "filename": file_path, "downloaded_bytes": total, "total_bytes": total})
+        return True
+
+    def _hook(self, progress: dict) -> None:
+        if self.progress_hook:
+            self.progress_hook(progress)
+
+    def _split(self, total: int) -> list:
+        """
+        :returns [start, end, offset] per connection, end inclusive, offset the next byte to fetch
+        """
+        connections = min(self.connections, total // self.min_part_size)
+        part_size = -(-total // connections)
+        return [[start, min(start + part_size, total) - 1, start] for start in range(0, total, part_size)]
+
+    @staticmethod
+    def _load_parts(ranges_file: str, part_file: str, total: int):
+        try:
+            with open(ranges_file, 'r') as ranges:
+                saved = json.load(ranges)
+        except (OSError, ValueError):
+            return None
+        if saved.get("total") != total or not os.path.exists(part_file) or os.path.getsize(part_file) != total:
+            return None
+        return [list(part) for part in saved["parts"]]
+
+    @staticmethod
+    def _save_parts(ranges_file: str, total: int, parts: list) -> None:
+        temp_file = ranges_file + ".tmp"
+        with open(temp_file, 'w') as ranges:
+            json.dump({"total": total, "parts": parts}, ranges)
+        os.replace(temp_file, ranges_file)
+
+    def _fetch_part(self, url: str, headers: dict, part_file: str, part: list, report, stop: threading.Event):
+        for attempt in range(self.part_retries):
+            start, end, offset = part
+            if offset > end or stop.is_set():
+                return
+            try:
+                with self.session.get(url, headers=dict(headers or {}, Range=f"bytes={offset}-{end}"), stream=True,
+                                      timeout=self.timeout) as response:
+                    if response.status_code != 206:
+                        raise IOError(f"Range request answered with status {response.status_code}")
+                    with open(part_file, 'r+b') as out_file:
+                        out_file.seek(offset)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if stop.is_set():
+                                return
+                            chunk = chunk[:end + 1 - part[2]]
+                            out_file.write(chunk)
+                            part[2] += len(chunk)
+                            report(len(chunk))
+                            if part[2] > end:
+                                break
+                if part[2] > end:
+                    return
+                raise IOError(f"Connection closed at byte {part[2]} of range {start}-{end}")
+            except (requests.RequestException, IOError):
+                if attempt == self.part_retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
@@ -0,0 +1,147 @@
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+import yt_dlp
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+THROTTLED = "throttled"
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+
+THROTTLED_PATTERN = re.compile(r"\b(?:HTTP Error|status) (?:429|403)\b|Too Many Requests|rate.?limit|"
+                               r"confirm you.re not a bot", re.IGNORECASE)
+PERMANENT_PATTERN = re.compile(r"\b(?:HTTP Error|status) (?:400|401|404|410)\b|Video unavailable|Private video|"
+                               r"has been removed|no longer available|does not exist|Unsupported URL|"
+                               r"not available in your country|members.only|account .*terminated", re.IGNORECASE)
+
+
+class RetryPolicy:
+    """
+    Retry limits of a job, attached to its download tasks as retry_policy attribute
+    """
+
+    def __init__(self, retries: int = 5, backoff_factor: float = 1):
+        """
+        :param retries number of attempts before an entry is given up \n
+        :param backoff_factor delay before the first retry in seconds, doubled for every further attempt \n
+        """
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+
+class RetryScheduler:
+    """
+    Decides if and when a failed download is tried again. Errors are classified as throttling (HTTP 429 and 403),
+    permanent (unavailable, private or removed videos, not found) or transient (network errors, timeouts, server
+    errors), permanent errors and anything else are not retried. Delays grow exponentially with jitter, so entries
+    that failed together do not retry together. Throttling also puts the host on a cooldown, growing while it keeps
+    throttling, that holds back every download from it. The scheduler only computes ready times, the pipeline keeps
+    the waiting entries aside, so no worker sleeps through a backoff.
+    """
+
+    max_delay = 300
+    # first cooldown of a throttling host, doubled for every further throttled attempt until one succeeds
+    throttle_cooldown = 30
+    max_cooldown = 900
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # host -> [cooldown end (monotonic), throttled attempts in a row]
+        self._hosts = {}
+        self._random = random.Random()
+
+    @staticmethod
+    def classify(error: BaseException):
+        """
+        :returns THROTTLED, PERMANENT or TRANSIENT, None for errors that are not worth retrying (cancellation, local
+        errors like a full disk)
+        """
+        if isinstance(error, yt_dlp.utils.DownloadCancelled):
+            return None
+        status = RetryScheduler._http_status(error)
+        message = str(error)
+        if status in (429, 403) or THROTTLED_PATTERN.search(message):
+            return THROTTLED
+        if status in (400, 401, 404, 410) or PERMANENT_PATTERN.search(message):
+            return PERMANENT
+        if isinstance(error, yt_dlp.utils.ExtractorError) and error.expected:
+            # errors the extractor expects are reported as they are, retrying does not change them
+            return PERMANENT
+        if isinstance(error, (yt_dlp.utils.DownloadError, ProtocolError, ReadTimeoutError, ConnectionError,
+                              TimeoutError, requests.RequestException)):
+            return TRANSIENT
+        # connection errors of the range downloader carry no errno, local file errors do
+        if isinstance(error, OSError) and error.errno is None:
+            return TRANSIENT
+        return None
+
+    @staticmethod
+    def _http_status(error: BaseException):
+        """
+        :returns the http status of the response behind the error, None if there is none
+        """
+        seen = set()
+        while error is not None and id(error) not in seen:
+            seen.add(id(error))
+            status = getattr(error, 'status', None) or getattr(error, 'code', None)
+            if isinstance(status, int) and 100 <= status < 600:
+                return status
+            response = getattr(error, 'response', None)
+            if isinstance(getattr(response, 'status_code', None), int):
+                return response.status_code
+            exc_info = getattr(error, 'exc_info', None)
+            error = exc_info[1] if exc_info else error.__cause__ or error.__context__
+        return None
+
+    @staticmethod
+    def host_of(entry: dict):
+        """
+        :returns the host an entry is downloaded from, None if its url has none
+        """
+        return urlparse(entry.get('webpage_url') or entry.get('url') or "").hostname
+
+    def retry_delay(self, error: BaseException, attempt: int, policy: RetryPolicy, host: str = None):
+        """
+        :param attempt number of attempts that failed so far, the first failure is 1 \n
+        :param policy retry limits of the job, nothing is retried without one \n
+        :param host the host the entry is downloaded from, throttling puts it on a cooldown \n
+        :returns seconds to wait before the next attempt, None if the error is not retried
+        """
+        kind = self.classify(error)
+        if kind == THROTTLED and host:
+            cooldown = self._throttled(host)
+        else:
+            cooldown = 0
+        if policy is None or kind in (None, PERMANENT) or attempt >= policy.retries:
+            return None
+        # half of the backoff is fixed, the other half random
+        delay = min(self.max_delay, policy.backoff_factor * 2 ** (attempt - 1))
+        return max(cooldown, delay / 2 + self._random.uniform(0, delay / 2))
+
+    def cooldown(self, host: str) -> float:
+        """
+        :returns seconds until downloads from the host may start again, 0 if it is not cooling down
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            return max(0.0, state[0] - time.monotonic()) if state else 0.0
+
+    def succeeded(self, host: str) -> None:
+        """
+        Ends the cooldown of the host and resets its growth after a download from it succeeded
+        """
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def _throttled(self, host: str) -> float:
+        with self._lock:
+            state = self._hosts.setdefault(host, [0.0, 0])
+            cooldown = min(self.max_cooldown, self.throttle_cooldown * 2 ** state[1])
+            cooldown = cooldown / 2 + self._random.uniform(0, cooldown / 2)
+            state[0] = max(state[0], time.monotonic() + cooldown)
+            state[1] += 1
+            return state[0] - time.monotonic()
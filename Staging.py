@@ -0,0 +1,157 @@
+import contextlib
+import errno
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+
+# leftovers of interrupted runs in an output directory: partial ffmpeg outputs, media store links, partial downloads
+STALE_OUTPUT_PATTERN = re.compile(r"\.partial\.[^.]+$|\.link\.tmp$|\.part$|\.part\.ranges$|\.ranges\.json$")
+
+
+def move_into_place(source: str, target: str) -> None:
+    """
+    Moves a finished file to its final path atomically, a reader sees the old file or the complete new one. Across
+    file systems the file is copied next to the target first and then renamed, the only case that copies data.
+    """
+    try:
+        os.replace(source, target)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temp_target = f"{target}.{os.getpid()}.{threading.get_ident()}.partial{os.path.splitext(target)[1]}"
+    try:
+        shutil.copyfile(source, temp_target)
+        os.replace(temp_target, target)
+    finally:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+    os.remove(source)
+
+
+class Staging:
+    """
+    Places the in-progress files of a download (streams, their .part files, the ffmpeg output before it is moved in
+    place) in a staging directory per output directory. By default it is a hidden directory inside the output
+    directory, so finishing a file is a rename on the same file system. A scratch directory on a faster drive (tmpfs,
+    local SSD) can be configured instead, finished files are then copied over once. Files left behind by interrupted
+    runs are removed once they are stale, and a free space check lets a run fail before it starts instead of midway.
+    """
+
+    dir_name = ".staging"
+    # free space that is kept on every drive on top of the estimated size
+    reserve_bytes = 64 * 1024 * 1024
+
+    def __init__(self, scratch_dir: str = None, stale_after: float = 2 * 24 * 3600):
+        """
+        :param scratch_dir directory for the in-progress files of all output directories, by default every output
+        directory stages in a hidden sub directory \n
+        :param stale_after seconds after which an untouched in-progress file is considered abandoned, interrupted
+        downloads resume from their files until then \n
+        """
+        self.scratch_dir = scratch_dir
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._cleaned = set()
+        # bytes promised to running downloads per device, not yet visible in the free space
+        self._reserved = {}
+
+    def dir_for(self, output_dir: str) -> str:
+        """
+        :returns the staging directory of the output directory, stale files are removed on first use
+        """
+        output_dir = os.path.abspath(output_dir)
+        if self.scratch_dir:
+            key = hashlib.sha256(output_dir.encode('utf-8')).hexdigest()[:16]
+            staging_dir = os.path.join(os.path.abspath(self.scratch_dir), key)
+        else:
+            staging_dir = os.path.join(output_dir, self.dir_name)
+        os.makedirs(staging_dir, exist_ok=True)
+        with self._lock:
+            first_use = output_dir not in self._cleaned
+            self._cleaned.add(output_dir)
+        if first_use:
+            removed = self.cleanup(staging_dir, output_dir)
+            if removed:
+                print(f"Removed {removed} stale files of interrupted downloads from {output_dir}")
+        return staging_dir
+
+    def cleanup(self, staging_dir: str, output_dir: str) -> int:
+        """
+        Removes the in-progress files nobody touched for stale_after seconds, in the staging directory all of them,
+        in the output directory the leftovers of older versions writing there directly
+        :returns the number of removed files
+        """
+        deadline = time.time() - self.stale_after
+        removed = 0
+        for directory, stale in ((staging_dir, lambda name: True),
+                                 (output_dir, lambda name: STALE_OUTPUT_PATTERN.search(name) is not None)):
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if stale(name) and os.path.isfile(path) and os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    # removed concurrently or still in use
+                    continue
+        return removed
+
+    def preflight(self, staging_dir: str, output_dir: str, output_bytes: int, staging_bytes: int) -> None:
+        """
+        Checks that the drives of the staging and the output directory have room for the estimated sizes, the space
+        reserved by running downloads counts as used
+        :param output_bytes bytes the finished outputs will take \n
+        :param staging_bytes bytes the in-progress files take at their peak \n
+        :raises OSError (ENOSPC) if a drive is too full
+        """
+        with self._lock:
+            self._check_space(self._required_space(staging_dir, output_dir, output_bytes, staging_bytes))
+
+    @contextlib.contextmanager
+    def reserve(self, staging_dir: str, output_dir: str, output_bytes: int, staging_bytes: int):
+        """
+        Checks the free space like preflight and reserves the estimated sizes until the block ends, so downloads
+        running at the same time can not all pass the check and then fill the drive together
+        :raises OSError (ENOSPC) if a drive is too full
+        """
+        with self._lock:
+            required = self._required_space(staging_dir, output_dir, output_bytes, staging_bytes)
+            self._check_space(required)
+            for device, (_, size) in required.items():
+                self._reserved[device] = self._reserved.get(device, 0) + size
+        try:
+            yield
+        finally:
+            with self._lock:
+                for device, (_, size) in required.items():
+                    self._reserved[device] -= size
+                    if not self._reserved[device]:
+                        del self._reserved[device]
+
+    @staticmethod
+    def _required_space(staging_dir: str, output_dir: str, output_bytes: int, staging_bytes: int) -> dict:
+        """
+        :returns {device: (directory, bytes)} of the space the outputs and the in-progress files need
+        """
+        staging_device = os.stat(staging_dir).st_dev
+        output_device = os.stat(output_dir).st_dev
+        if staging_device == output_device:
+            # the staged output becomes the output, only the source streams come on top
+            return {output_device: (output_dir, output_bytes + staging_bytes // 2)}
+        return {staging_device: (staging_dir, staging_bytes), output_device: (output_dir, output_bytes)}
+
+    def _check_space(self, required: dict) -> None:
+        for device, (directory, size) in required.items():
+            needed = size + self._reserved.get(device, 0) + self.reserve_bytes
+            free = shutil.disk_usage(directory).free
+            if free < needed:
+                raise OSError(errno.ENOSPC, f"Not enough free space in {directory}: {free / 1e6:.0f} MB free, "
+                                            f"about {needed / 1e6:.0f} MB needed")
@@ -0,0 +1,130 @@
+import base64
+import os
+
+try:
+    import mutagen
+    from mutagen.flac import FLAC, Picture
+    from mutagen.id3 import APIC, ID3, ID3NoHeaderError, TALB, TCON, TDRC, TIT2, TPE1, TRCK
+    from mutagen.mp4 import MP4, MP4Cover
+    from mutagen.oggopus import OggOpus
+    from mutagen.oggvorbis import OggVorbis
+except ImportError:
+    FLAC = None
+
+
+class AudioTagger:
+    """
+    Writes ID3 / MP4 / Vorbis tags and embedded covers in place using mutagen, only the tag region of the file is
+    rewritten instead of remuxing the whole file through ffmpeg
+    """
+
+    formats = ['mp3', 'm4a', 'flac', 'ogg', 'opus']
+
+    @staticmethod
+    def available() -> bool:
+        return FLAC is not None
+
+    def supports(self, file_format: str) -> bool:
+        """
+        :param file_format the audio format of the file
+        :returns if tags of the format can be written natively
+        """
+        return self.available() and file_format in self.formats
+
+    def tag(self, file_path: str, meta_data: dict = None, cover_image: str = None) -> None:
+        """
+        Writes the tags and cover into the file
+        :param file_path the audio file to tag
+        :param meta_data the meta data as returned by _extract_meta_from_info_dict, None to leave the tags as is
+        :param cover_image path to a jpeg / png cover, None to leave the cover as is
+        """
+        file_format = os.path.splitext(file_path)[1][1:].lower()
+        if not self.supports(file_format):
+            raise ValueError(f"Can not tag {file_format} files natively")
+
+        cover = None
+        if cover_image:
+            with open(cover_image, 'rb') as image:
+                cover = image.read()
+        mime = 'image/png' if cover_image and cover_image.lower().endswith('.png') else 'image/jpeg'
+        tags = self._tag_values(meta_data) if meta_data else {}
+
+        if file_format == 'mp3':
+            self._tag_id3(file_path, tags, cover, mime)
+        elif file_format == 'm4a':
+            self._tag_mp4(file_path, tags, cover, mime)
+        else:
+            self._tag_vorbis(file_path, file_format, tags, cover, mime)
+
+    @staticmethod
+    def _tag_values(meta_data: dict) -> dict:
+        release_date = str(meta_data.get("release_date") or "")
+        if len(release_date) == 8 and release_date.isdigit():
+            release_date = f"{release_date[:4]}-{release_date[4:6]}-{release_date[6:]}"
+        values = {
+            "title": meta_data.get("title"),
+            "artist": meta_data.get("artist"),
+            "album": meta_data.get("album"),
+            "genre": meta_data.get("genre"),
+            "date": release_date,
+            "track": meta_data.get("track_number"),
+        }
+        return {key: str(value) for key, value in values.items() if value}
+
+    @staticmethod
+    def _tag_id3(file_path, tags, cover, mime):
+        try:
+            id3 = ID3(file_path)
+        except ID3NoHeaderError:
+            id3 = ID3()
+        frames = {"title": TIT2, "artist": TPE1, "album": TALB, "genre": TCON, "date": TDRC, "track": TRCK}
+        for key, value in tags.items():
+            id3.setall(frames[key].__name__, [frames[key](encoding=3, text=value)])
+        if cover:
+            id3.setall('APIC', [APIC(encoding=3, mime=mime, type=3, desc='Cover (front)', data=cover)])
+        id3.save(file_path, v2_version=3)
+
+    @staticmethod
+    def _tag_mp4(file_path, tags, cover, mime):
+        mp4 = MP4(file_path)
+        if mp4.tags is None:
+            mp4.add_tags()
+        atoms = {"title": "\xa9nam", "artist": "\xa9ART", "album": "\xa9alb", "genre": "\xa9gen", "date": "\xa9day"}
+        for key, value in tags.items():
+            if key == "track":
+                if value.isdigit():
+                    mp4.tags['trkn'] = [(int(value), 0)]
+                continue
+            mp4.tags[atoms[key]] = [value]
+        if cover:
+            image_format = MP4Cover.FORMAT_PNG if mime == 'image/png' else MP4Cover.FORMAT_JPEG
+            mp4.tags['covr'] = [MP4Cover(cover, imageformat=image_format)]
+        mp4.save()
+
+    @staticmethod
+    def _tag_vorbis(file_path, file_format, tags, cover, mime):
+        if file_format == 'flac':
+            audio = FLAC(file_path)
+        elif file_format == 'opus':
+            audio = OggOpus(file_path)
+        else:
+            # opus sources are copied into .ogg as is, the codec decides the stream format, not the extension
+            audio = mutagen.File(file_path, options=[OggVorbis, OggOpus])
+            if audio is None:
+                raise ValueError(f"{file_path} is neither an Ogg Vorbis nor an Ogg Opus file")
+        if audio.tags is None:
+            audio.add_tags()
+        for key, value in tags.items():
+            audio.tags["tracknumber" if key == "track" else key] = [value]
+        if cover:
+            picture = Picture()
+            picture.type = 3
+            picture.mime = mime
+            picture.desc = 'Cover (front)'
+            picture.data = cover
+            if file_format == 'flac':
+                audio.clear_pictures()
+                audio.add_picture(picture)
+            else:
+                audio.tags['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+        audio.save()
@@ -1,7 +1,23 @@
+import shlex
+import sys
+
+from BandwidthLimiter import BandwidthLimiter
 from Downloader import YTVideoDownloader
+from Metrics import JsonStatsFile, PrometheusEndpoint
+from QualityPolicy import QualityPolicy
 
 
 class VideoDownloaderCLI:
+    # options a batch file line may override, mapped to their parser
+    batch_overrides = {
+        "directory": str,
+        "file_format": str,
+        "image": str,
+        "file_name_template": str,
+        "single_frame_video": lambda value: value.lower() in ("1", "true", "yes"),
+        "low_hardware_mode": lambda value: value.lower() in ("1", "true", "yes"),
+    }
+
     def __init__(self, url: str,
                  output_dir: str,
                  album_image: str,
@@ -14,13 +30,124 @@ class VideoDownloaderCLI:
                  retries: int,
                  backoff_factor: float,
                  threads: int,
-                 file_name_template: str):
+                 file_name_template: str,
+                 batch_file: str = None,
+                 resume: bool = False,
+                 stats_file: str = None,
+                 metrics_port: int = None,
+                 rate_limit: str = None,
+                 entry_rate_limit: str = None,
+                 quality: QualityPolicy = None,
+                 dry_run: bool = False,
+                 connections: int = 1,
+                 media_store_dir: str = None,
+                 scratch_dir: str = None):
+
+        downloader = YTVideoDownloader(bandwidth_limiter=BandwidthLimiter(rate_limit, entry_rate_limit),
+                                       connections=connections, media_store_dir=media_store_dir,
+                                       scratch_dir=scratch_dir)
+        if stats_file:
+            downloader.metrics.add_sink(JsonStatsFile(stats_file))
+        if metrics_port is not None:
+            downloader.metrics.add_sink(PrometheusEndpoint(metrics_port))
+        try:
+            self._run(downloader, url, output_dir, album_image, file_format, show_album_cover_on_mp3,
+                      low_hardware_mode, with_metadata, subfolder_playlists, single_frame_video, retries,
+                      backoff_factor, threads, file_name_template, batch_file, resume, quality, dry_run)
+        finally:
+            downloader.metrics.close()
+            downloader.close()
 
-        downloader = YTVideoDownloader()
+    def _run(self, downloader: YTVideoDownloader, url: str, output_dir: str, album_image: str, file_format: str,
+             show_album_cover_on_mp3: bool, low_hardware_mode: bool, with_metadata: bool, subfolder_playlists: bool,
+             single_frame_video: bool, retries: int, backoff_factor: float, threads: int, file_name_template: str,
+             batch_file: str, resume: bool, quality: QualityPolicy = None, dry_run: bool = False) -> None:
 
-        if single_frame_video:
-            downloader.download_single_frame_video(url, output_dir, album_image, low_hardware_mode, with_metadata,
-                                                   subfolder_playlists, retries, backoff_factor, file_name_template)
+        defaults = {
+            "directory": output_dir,
+            "file_format": file_format,
+            "image": album_image,
+            "file_name_template": file_name_template,
+            "single_frame_video": single_frame_video,
+            "low_hardware_mode": low_hardware_mode,
+        }
+
+        if batch_file:
+            jobs = [self._to_job(options, with_metadata, show_album_cover_on_mp3, subfolder_playlists, retries,
+                                 backoff_factor, resume, quality) for options in self.read_batch_file(batch_file,
+                                                                                                       defaults)]
+            if dry_run:
+                for job in jobs:
+                    downloader.download(**job, threads=threads, dry_run=True)
+                return
+            self.print_summaries(downloader.download_many(jobs, threads))
+        elif single_frame_video:
+            downloader.download_single_frame_video(url, output_dir, album_image, low_hardware_mode,
+                                                   with_metadata=with_metadata,
+                                                   subfolder_playlists=subfolder_playlists, retries=retries,
+                                                   backoff_factor=backoff_factor,
+                                                   file_name_template=file_name_template, threads=threads,
+                                                   resume=resume, quality=quality, dry_run=dry_run)
         else:
             downloader.download(url, output_dir, file_format, with_metadata, retries, backoff_factor,
-                                show_album_cover_on_mp3, subfolder_playlists, album_image, threads, file_name_template)
+                                show_album_cover_on_mp3, subfolder_playlists, album_cover_image=album_image,
+                                threads=threads, file_name_template=file_name_template, resume=resume,
+                                quality=quality, dry_run=dry_run)
+
+    @classmethod
+    def read_batch_file(cls, batch_file: str, defaults: dict) -> list:
+        """
+        Reads a batch file, one url per line optionally followed by key=value overrides, # starts a comment
+        :param batch_file path of the file or '-' for stdin
+        :param defaults the options of the command line, used where a line does not override them
+        :returns list of option dicts, one per url
+        """
+        if batch_file == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(batch_file, 'r') as file:
+                lines = file.read().splitlines()
+
+        entries = []
+        for line_number, line in enumerate(lines, 1):
+            parts = shlex.split(line, comments=True)
+            if not parts:
+                continue
+            options = dict(defaults, url=parts[0])
+            for override in parts[1:]:
+                key, separator, value = override.partition("=")
+                if not separator or key not in cls.batch_overrides:
+                    raise ValueError(f"{batch_file}:{line_number}: unknown option '{override}'")
+                options[key] = cls.batch_overrides[key](value)
+            entries.append(options)
+        return entries
+
+    @staticmethod
+    def _to_job(options: dict, with_metadata: bool, show_album_cover_on_mp3: bool, subfolder_playlists: bool,
+                retries: int, backoff_factor: float, resume: bool = False, quality: QualityPolicy = None) -> dict:
+        job = {
+            "url": options["url"],
+            "output_dir": options["directory"],
+            "file_format": options["file_format"],
+            "with_meta": with_metadata,
+            "show_album_cover_on_mp3": show_album_cover_on_mp3,
+            "subfolder_playlists": subfolder_playlists,
+            "retries": retries,
+            "backoff_factor": backoff_factor,
+            "file_name_template": options["file_name_template"],
+            "album_cover_image": options["image"],
+            "resume": resume,
+            "quality": quality,
+        }
+        if options["single_frame_video"]:
+            job["file_format"] = "mp4" if options["low_hardware_mode"] else "mp3"
+            job["still_frame_image"] = options["image"]
+            job["album_cover_image"] = None
+        return job
+
+    @staticmethod
+    def print_summaries(summaries: list) -> None:
+        print(f"{'downloaded':>10} {'skipped':>8} {'failed':>7} {'MB':>10} {'seconds':>9}  url")
+        for summary in summaries:
+            print(f"{summary['downloaded']:>10} {summary['skipped']:>8} {summary['failed']:>7} "
+                  f"{summary['bytes'] / 1e6:>10.1f} {summary['seconds']:>9.1f}  {summary['url']}")
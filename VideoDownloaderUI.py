@@ -1,8 +1,12 @@
+import time
 from tkinter import filedialog, messagebox
 
 import customtkinter as ctk
 
+from BandwidthLimiter import parse_rate
+from DownloadQueue import DownloadQueue
 from Downloader import YTVideoDownloader
+from QualityPolicy import QualityPolicy
 
 
 # todo label and correctly hide values if not available in that selection example: single fram evideo
@@ -41,7 +45,10 @@ class ToolTip:
 
 
 class VideoDownloaderUI:
-    downloader = YTVideoDownloader()
+    # the queue is polled every poll_interval_ms, every poll creates at most max_rows_per_poll progress rows so a
+    # large playlist never blocks the event loop for more than a frame
+    poll_interval_ms = 100
+    max_rows_per_poll = 20
 
     def __init__(self,
                  url: str = "",
@@ -57,8 +64,12 @@ class VideoDownloaderUI:
                  backoff_factor: float = 1.0,
                  threads: int = 4,
                  file_name_template: str = "%(name)",
-                 download_meta=False
+                 download_meta=False,
+                 rate_limit: str = "",
+                 quality_preset: str = "1080p"
                  ):
+        self.downloader = YTVideoDownloader()
+        self.download_queue = DownloadQueue(self.downloader)
         self.url = url
         self.output_dir = output_dir
         self.album_image = album_image
@@ -73,6 +84,8 @@ class VideoDownloaderUI:
         self.threads = threads
         self.file_name_template = file_name_template
         self.download_meta = download_meta
+        self.rate_limit = rate_limit or ""
+        self.quality_preset = quality_preset or "1080p"
 
         # Create the main window
         self.root = ctk.CTk()
@@ -179,18 +192,41 @@ class VideoDownloaderUI:
 
         # Quality Preset Dropdown
         ctk.CTkLabel(self.root, text="Quality Preset:").grid(row=9, column=0, padx=10, pady=10)
-        self.quality_preset_var = ctk.StringVar(value="1080p")
+        self.quality_preset_var = ctk.StringVar(value=self.quality_preset)
         quality_presets = ["144p", "240p", "360p", "480p", "720p", "1080p", "1440p", "2160p"]
         self.quality_preset_menu = ctk.CTkOptionMenu(self.root, variable=self.quality_preset_var,
                                                      values=quality_presets)
         self.quality_preset_menu.grid(row=9, column=1, padx=10, pady=10)
         ToolTip(self.quality_preset_menu, "Choose the quality preset for the download.")
 
+        # Rate Limit Entry
+        ctk.CTkLabel(self.root, text="Rate Limit:").grid(row=9, column=2, padx=10, pady=10)
+        self.rate_limit_entry = ctk.CTkEntry(self.root, width=80)
+        self.rate_limit_entry.grid(row=9, column=3, padx=10, pady=10)
+        self.rate_limit_entry.insert(0, self.rate_limit)
+        ToolTip(self.rate_limit_entry, "Total download speed of all threads, e.g. 500K or 4M. Empty for unlimited.")
+
         # Download Button
         self.download_button = ctk.CTkButton(self.root, text="Download", command=self.download_video)
         self.download_button.grid(row=10, column=0, columnspan=2, padx=10, pady=20)
-        ToolTip(self.download_button, "Click to start downloading the video.")
-
+        ToolTip(self.download_button, "Click to queue the download, more urls can be queued while it runs.")
+
+        # Throughput
+        self.throughput_label = ctk.CTkLabel(self.root, text="")
+        self.throughput_label.grid(row=10, column=2, columnspan=2, padx=10, pady=20)
+
+        # Download Queue
+        self.jobs_frame = ctk.CTkScrollableFrame(self.root, height=220)
+        self.jobs_frame.grid(row=11, column=0, columnspan=4, padx=10, pady=10, sticky="nsew")
+        self.jobs_frame.grid_columnconfigure(1, weight=1)
+        self.job_widgets = {}
+        self.entry_widgets = {}
+        self.pending_rows = {}
+        self.queue_version = 0
+        self.throughput_shown = 0.0
+
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.after(self.poll_interval_ms, self.poll_queue)
         self.root.mainloop()
 
     def browse_directory(self):
@@ -221,37 +257,106 @@ class VideoDownloaderUI:
         self.file_name_template = self.template_entry.get()
         self.quality_preset = self.quality_preset_var.get()
         self.download_meta = self.download_meta_var.get()
-
-        if (self.single_frame_video):
-            YTVideoDownloader().download_single_frame_video(
-                url=self.url,
-                output_dir=self.output_dir,
-                album_image=self.album_image,
-                low_hardware_mode=self.low_hardware_mode,
-                with_metadata=self.with_metadata,
-                subfolder_playlists=self.subfolder_playlists,
-                retries=self.retries,
-                backoff_factor=self.backoff_factor,
-                download_meta_seperate=self.download_meta
-                # file_name_template=self.file_name_template,
-            )
+        self.rate_limit = self.rate_limit_entry.get()
+        try:
+            parse_rate(self.rate_limit)
+        except ValueError as e:
+            messagebox.showerror("Invalid Rate Limit", str(e))
+            return
+        # the budget is shared by all downloads, so the latest value applies to the running jobs as well
+        # the UI only sets the total rate, the per entry rate configured on start stays
+        self.downloader.bandwidth.set_rate(self.rate_limit, self.downloader.bandwidth.entry_rate)
+
+        job = {
+            "url": self.url,
+            "output_dir": self.output_dir,
+            "with_meta": self.with_metadata,
+            "subfolder_playlists": self.subfolder_playlists,
+            "retries": self.retries,
+            "backoff_factor": self.backoff_factor,
+            "threads": self.threads,
+            "download_meta_seperate": self.download_meta,
+            "quality": QualityPolicy.from_preset(self.quality_preset),
+            # "file_name_template": self.file_name_template,
+        }
+        if self.single_frame_video:
+            # same as download_single_frame_video
+            job.update(file_format="mp4" if self.low_hardware_mode else "mp3", still_frame_image=self.album_image)
         else:
-
-            YTVideoDownloader().download(
-                url=self.url,
-                output_dir=self.output_dir,
-                album_cover_image=self.album_image,
-                file_format=self.file_format,
-                show_album_cover_on_mp3=self.show_album_cover_on_mp3,
-                with_meta=self.with_metadata,
-                subfolder_playlists=self.subfolder_playlists,
-                retries=self.retries,
-                backoff_factor=self.backoff_factor,
-                threads=self.threads,
-                download_meta_seperate=self.download_meta
-                # file_name_template=self.file_name_template
-            )
-        messagebox.showinfo("Download Complete", "The video has been successfully downloaded.")
+            job.update(file_format=self.file_format, album_cover_image=self.album_image,
+                       show_album_cover_on_mp3=self.show_album_cover_on_mp3)
+        self.download_queue.submit(job)
+
+    def poll_queue(self):
+        """
+        Shows the changes of the download queue since the last poll, runs on the Tk event loop
+        """
+        self.queue_version, jobs = self.download_queue.snapshot(self.queue_version)
+        for job in jobs:
+            self.show_job(job)
+            for entry in job["entries"]:
+                self.pending_rows[(job["id"], entry["key"])] = entry
+
+        for row_key in list(self.pending_rows)[:self.max_rows_per_poll]:
+            self.show_entry(row_key, self.pending_rows.pop(row_key))
+        # updates of rows that already exist are cheap, only new rows are limited per poll
+        for row_key in [row_key for row_key in self.pending_rows if row_key in self.entry_widgets]:
+            self.show_entry(row_key, self.pending_rows.pop(row_key))
+
+        now = time.monotonic()
+        if now - self.throughput_shown >= 1:
+            self.throughput_shown = now
+            gauges = self.downloader.metrics.snapshot()["gauges"]
+            speed = gauges["download_speed_bytes"]
+            self.throughput_label.configure(
+                text=f"{speed / (1024 * 1024):.1f} MiB/s, {gauges['active_downloads']} active" if speed else "")
+        self.root.after(self.poll_interval_ms, self.poll_queue)
+
+    def show_job(self, job):
+        widgets = self.job_widgets.get(job["id"])
+        if widgets is None:
+            frame = ctk.CTkFrame(self.jobs_frame)
+            frame.grid(row=len(self.job_widgets), column=0, columnspan=3, sticky="ew", padx=5, pady=5)
+            frame.grid_columnconfigure(1, weight=1)
+            label = ctk.CTkLabel(frame, text="", anchor="w")
+            label.grid(row=0, column=0, columnspan=2, sticky="w", padx=5)
+            cancel_button = ctk.CTkButton(frame, text="Cancel", width=70,
+                                          command=lambda job_id=job["id"]: self.download_queue.cancel(job_id))
+            cancel_button.grid(row=0, column=2, padx=5, pady=2)
+            widgets = self.job_widgets[job["id"]] = {"frame": frame, "label": label, "cancel": cancel_button,
+                                                     "rows": 0}
+        text = f"{job['url']} - {job['state']}"
+        if job["error"]:
+            text += f": {job['error']}"
+        widgets["label"].configure(text=text)
+        if job["state"] in ("done", "failed", "cancelled"):
+            widgets["cancel"].configure(state="disabled")
+
+    def show_entry(self, row_key, entry):
+        widgets = self.entry_widgets.get(row_key)
+        if widgets is None:
+            job_widgets = self.job_widgets[row_key[0]]
+            job_widgets["rows"] += 1
+            row = job_widgets["rows"]
+            title = ctk.CTkLabel(job_widgets["frame"], text=entry["title"][:60], anchor="w")
+            title.grid(row=row, column=0, sticky="w", padx=5)
+            progress_bar = ctk.CTkProgressBar(job_widgets["frame"])
+            progress_bar.grid(row=row, column=1, sticky="ew", padx=5)
+            progress_bar.set(0)
+            stage = ctk.CTkLabel(job_widgets["frame"], text="", width=140, anchor="w")
+            stage.grid(row=row, column=2, sticky="w", padx=5)
+            widgets = self.entry_widgets[row_key] = {"progress": progress_bar, "stage": stage}
+        if entry["stage"] in ("Done", "Skipped"):
+            widgets["progress"].set(1)
+        elif entry["total"]:
+            widgets["progress"].set(min(1, entry["downloaded"] / entry["total"]))
+        widgets["stage"].configure(text=entry["stage"])
+        if entry["error"]:
+            ToolTip(widgets["stage"], entry["error"])
+
+    def close(self):
+        self.download_queue.close(cancel=True)
+        self.root.destroy()
 
 
 if __name__ == "__main__":
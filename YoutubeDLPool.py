@@ -0,0 +1,84 @@
+import contextlib
+import threading
+from collections import OrderedDict
+
+import yt_dlp
+
+
+class YoutubeDLPool:
+    """
+    Keeps YoutubeDL instances open between entries instead of constructing one per download, so extractors are
+    initialized once and the instance keeps its http connections alive. Instances are pooled per option set and
+    handed to one thread at a time, there are never more instances of an option set than threads using it at once.
+    All instances share one cookie jar.
+    """
+
+    # option sets kept, the least recently used one is closed when another one is added
+    max_option_sets = 8
+
+    def __init__(self):
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._cookiejar = None
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def _freeze(value):
+        if isinstance(value, dict):
+            return tuple(sorted((key, YoutubeDLPool._freeze(item)) for key, item in value.items()))
+        if isinstance(value, (list, tuple)):
+            return tuple(YoutubeDLPool._freeze(item) for item in value)
+        if isinstance(value, set):
+            return frozenset(value)
+        return value
+
+    @contextlib.contextmanager
+    def acquire(self, ydl_opts: dict):
+        """
+        Yields an idle YoutubeDL instance created with these options, a new one if every instance is in use
+        """
+        key = self._freeze(ydl_opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            ydl = idle.pop() if idle else None
+            if ydl is not None:
+                self.reused += 1
+                self._idle.move_to_end(key)
+        if ydl is None:
+            ydl = self._create(ydl_opts)
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                evicted = [ydl] if self._closed else []
+                if not self._closed:
+                    self._idle.setdefault(key, []).append(ydl)
+                    self._idle.move_to_end(key)
+                while len(self._idle) > self.max_option_sets:
+                    evicted += self._idle.popitem(last=False)[1]
+            for old_ydl in evicted:
+                old_ydl.close()
+
+    def _create(self, ydl_opts: dict):
+        ydl = yt_dlp.YoutubeDL(dict(ydl_opts))
+        with self._lock:
+            self.created += 1
+            if self._cookiejar is None:
+                self._cookiejar = ydl.cookiejar
+            else:
+                # cookiejar is a cached property of YoutubeDL, presetting it shares the jar between the instances
+                ydl.__dict__['cookiejar'] = self._cookiejar
+        return ydl
+
+    def close(self) -> None:
+        """
+        Closes all idle instances, instances in use are closed once they are released
+        """
+        with self._lock:
+            self._closed = True
+            idle = [ydl for instances in self._idle.values() for ydl in instances]
+            self._idle.clear()
+        for ydl in idle:
+            ydl.close()
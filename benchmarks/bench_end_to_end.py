@@ -0,0 +1,305 @@
+"""
+Offline end to end benchmark of the downloader. A local http server stands in for the media site: it serves ffmpeg
+generated fixture media and an rss feed per playlist size, which yt_dlp's generic extractor turns into a playlist.
+Every scenario of the matrix (kind x format x threads x connections x playlist size) runs in its own process and
+reports wall time, cpu time (including ffmpeg), peak rss and bytes written. Results can be saved and compared against
+a saved run. The server answers range requests and can throttle every connection like video hosts do, which is what
+multi connection downloads are measured against.
+
+kinds: single (download() of one direct media url), playlist (download() of a feed, runs _download_playlist),
+still_frame (download_single_frame_video of a feed)
+
+usage: python benchmarks/bench_end_to_end.py [-kinds single,playlist,still_frame] [-formats mp3,mp4]
+       [-threads 1,4] [-connections 1] [-sizes 5,20] [-duration 30] [-throttle 2M] [-save results.json]
+       [-compare baseline.json] [-tolerance 0.1]
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from BandwidthLimiter import parse_rate  # noqa: E402
+
+# fixture served for the requested output format, audio formats download the audio only fixture
+FIXTURE_OF_FORMAT = {"mp3": "track.m4a", "m4a": "track.m4a", "flac": "track.m4a", "mp4": "clip.mp4",
+                     "mkv": "clip.mp4", "webm": "clip.mp4"}
+# metrics compared by -compare, lower is better for all of them
+COMPARED = ("wall_seconds", "cpu_seconds", "peak_rss_mb", "bytes_written")
+
+
+def run_ffmpeg(cmd):
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_fixtures(fixture_dir, duration):
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}', '-c:a', 'aac',
+                '-b:a', '128k', os.path.join(fixture_dir, "track.m4a")])
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', f'testsrc=size=1280x720:rate=30:duration={duration}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}', '-c:v', 'libx264',
+                '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', os.path.join(fixture_dir, "clip.mp4")])
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', 'testsrc=size=1280x720:duration=1', '-frames:v', '1',
+                os.path.join(fixture_dir, "album.png")])
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    /media/<name>_<index>.<ext> serves the fixture <name>.<ext> under a distinct url (and so a distinct video id),
+    /feed/<fixture>/<size>.xml serves an rss feed of size entries of that fixture
+    """
+
+    # bytes per second of every single connection, None for unthrottled
+    throttle = None
+
+    def translate_path(self, path):
+        path = path.split('?')[0]
+        if path.startswith('/media/'):
+            name, ext = os.path.splitext(os.path.basename(path))
+            return os.path.join(self.directory, name.rsplit('_', 1)[0] + ext)
+        return super().translate_path(path)
+
+    def do_GET(self):
+        if self.path.startswith('/feed/'):
+            fixture, size = self.path[len('/feed/'):].rsplit('/', 1)
+            self._send_feed(fixture, int(size.split('.')[0]))
+            return
+        if self.path.startswith('/media/'):
+            self._send_media()
+            return
+        super().do_GET()
+
+    def _send_media(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        with open(path, 'rb') as media:
+            media.seek(start)
+            self._copy_throttled(media, end - start + 1)
+
+    def _copy_throttled(self, media, remaining):
+        started = time.monotonic()
+        sent = 0
+        try:
+            while remaining > 0:
+                chunk = media.read(min(64 * 1024, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                remaining -= len(chunk)
+                if self.throttle:
+                    ahead = sent / self.throttle - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            # clients probing the file close the connection early
+            pass
+
+    def _send_feed(self, fixture, size):
+        name, ext = os.path.splitext(fixture)
+        host = f"http://{self.headers.get('Host')}"
+        items = "".join(
+            f"<item><title>{escape(f'{name} {index}')}</title><guid>{name}_{index}</guid>"
+            f"<enclosure url=\"{host}/media/{name}_{index}{ext}\" type=\"{self.guess_type(fixture)}\"/></item>"
+            for index in range(size))
+        body = (f"<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>bench {name} {size}</title>"
+                f"<link>{host}/</link>{items}</channel></rss>").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(fixture_dir, handler=None):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler or FixtureHandler, directory=fixture_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def scenario_url(base_url, scenario):
+    fixture = FIXTURE_OF_FORMAT.get(scenario["format"], "clip.mp4")
+    if scenario["kind"] == "single":
+        name, ext = os.path.splitext(fixture)
+        return f"{base_url}/media/{name}_0{ext}"
+    if scenario["kind"] == "still_frame":
+        fixture = "track.m4a"
+    return f"{base_url}/feed/{fixture}/{scenario['size']}.xml"
+
+
+def run_scenario(scenario):
+    """
+    Runs one scenario in this process, meant to be called in a fresh child so peak rss is not shared
+    """
+    from Downloader import YTVideoDownloader
+
+    downloader = YTVideoDownloader(connections=scenario.get("connections", 1))
+    with tempfile.TemporaryDirectory() as output_dir:
+        start_cpu = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        if scenario["kind"] == "still_frame":
+            downloader.download_single_frame_video(scenario["url"], output_dir, scenario["image"],
+                                                   threads=scenario["threads"])
+        else:
+            downloader.download(scenario["url"], output_dir, scenario["format"], threads=scenario["threads"],
+                                use_archive=False, album_cover_image=None)
+        wall = time.perf_counter() - start
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        bytes_written = sum(os.path.getsize(os.path.join(root, name))
+                            for root, _, names in os.walk(output_dir) for name in names)
+    snapshot = downloader.metrics.snapshot()
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": (own.ru_utime - start_cpu.ru_utime + own.ru_stime - start_cpu.ru_stime
+                        + children.ru_utime + children.ru_stime),
+        # ru_maxrss is in KiB on linux and bytes on macos
+        "peak_rss_mb": own.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10),
+        "peak_child_rss_mb": children.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10),
+        "bytes_written": bytes_written,
+        "bytes_downloaded": snapshot["counters"].get("downloaded_bytes_total", 0),
+        "audio_copied": snapshot["counters"].get("audio_copied_total", 0),
+        "audio_transcoded": snapshot["counters"].get("audio_transcoded_total", 0),
+    }
+
+
+def run_in_child(scenario):
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '-scenario', json.dumps(scenario)],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {"error": f"exit code {completed.returncode}"}
+    return json.loads(lines[-1])
+
+
+def scenario_name(scenario):
+    size = "" if scenario["kind"] == "single" else f" size={scenario['size']}"
+    connections = f" connections={scenario['connections']}" if scenario.get("connections", 1) > 1 else ""
+    return f"{scenario['kind']} {scenario['format']} threads={scenario['threads']}{connections}{size}"
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, 'r') as baseline_file:
+        baseline = {scenario_name(run["scenario"]): run["result"] for run in json.load(baseline_file)["runs"]}
+    regressions = 0
+    print(f"\ncompared to {baseline_path} (tolerance {tolerance:.0%})")
+    for run in results:
+        name = scenario_name(run["scenario"])
+        before = baseline.get(name)
+        if before is None or "error" in before or "error" in run["result"]:
+            continue
+        changes = []
+        for metric in COMPARED:
+            if not before[metric]:
+                continue
+            change = run["result"][metric] / before[metric] - 1
+            flag = " REGRESSION" if change > tolerance else ""
+            regressions += bool(flag)
+            changes.append(f"{metric} {change:+.1%}{flag}")
+        print(f"{name:<40} " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end to end downloader benchmark against a local server")
+    parser.add_argument('-kinds', type=str, default="single,playlist,still_frame")
+    parser.add_argument('-formats', type=str, default="mp3,mp4", help="Output formats (still_frame ignores it)")
+    parser.add_argument('-threads', type=str, default="1,4", help="Download thread counts")
+    parser.add_argument('-connections', type=str, default="1", help="Connections per file")
+    parser.add_argument('-sizes', type=str, default="5,20", help="Playlist sizes")
+    parser.add_argument('-throttle', type=str,
+                        help="Bytes per second the server sends over every single connection, e.g. 2M")
+    parser.add_argument('-duration', type=int, default=30, help="Length of the fixture media in seconds")
+    parser.add_argument('-save', type=str, help="Write the results to this json file")
+    parser.add_argument('-compare', type=str, help="Json file of a previous run to compare against")
+    parser.add_argument('-tolerance', type=float, default=0.1,
+                        help="Relative increase reported as regression (default: 0.1)")
+    parser.add_argument('-scenario', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return 0
+
+    kinds = args.kinds.split(",")
+    formats = args.formats.split(",")
+    threads = [int(value) for value in args.threads.split(",")]
+    sizes = [int(value) for value in args.sizes.split(",")]
+    connection_counts = [int(value) for value in args.connections.split(",")]
+    FixtureHandler.throttle = parse_rate(args.throttle)
+
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        make_fixtures(fixture_dir, args.duration)
+        server, base_url = start_server(fixture_dir)
+        scenarios = []
+        for kind in kinds:
+            for file_format in (["mp3"] if kind == "still_frame" else formats):
+                for thread_count in threads:
+                    for connections in connection_counts:
+                        for size in ([1] if kind == "single" else sizes):
+                            scenarios.append({"kind": kind, "format": file_format, "threads": thread_count,
+                                              "connections": connections, "size": size,
+                                              "image": os.path.join(fixture_dir, "album.png")})
+
+        results = []
+        print(f"{'scenario':<40} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'MB written':>11}")
+        try:
+            for scenario in scenarios:
+                scenario["url"] = scenario_url(base_url, scenario)
+                result = run_in_child(scenario)
+                results.append({"scenario": {k: v for k, v in scenario.items() if k not in ("url", "image")},
+                                "result": result})
+                if "error" in result:
+                    print(f"{scenario_name(scenario):<40} failed: {result['error']}")
+                    continue
+                print(f"{scenario_name(scenario):<40} {result['wall_seconds']:>8.2f} {result['cpu_seconds']:>8.2f} "
+                      f"{result['peak_rss_mb']:>8.1f} {result['bytes_written'] / 1e6:>11.1f}")
+        finally:
+            server.shutdown()
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump({"time": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+                       "duration": args.duration, "runs": results}, save_file, indent=4)
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Startup cost of the command line entry point, measured with python -X importtime. Every command runs several times in
+a fresh interpreter and the fastest run is reported with the total import time, the slowest top level imports and
+whether any of the heavy modules (yt_dlp, requests, customtkinter) was loaded. Results can be saved and compared
+against a saved run like bench_end_to_end.
+
+usage: python benchmarks/bench_import_time.py [-runs 5] [-top 5] [-save results.json] [-compare baseline.json]
+       [-tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+MAIN = os.path.join(ROOT, "Main.py")
+HEAVY_MODULES = ("yt_dlp", "requests", "customtkinter", "tkinter")
+COMMANDS = {
+    "help": [MAIN, "--help"],
+    "invalid_arguments": [MAIN, "-directory", "out"],
+    "client_help": [MAIN, "client", "--help"],
+    "import_downloader": ["-c", "import Downloader"],
+}
+# commands that must return without loading any of the heavy modules
+LIGHT_COMMANDS = ("help", "invalid_arguments", "client_help")
+
+
+def import_times(command):
+    """
+    :returns {module: cumulative microseconds} of the top level imports of one run and the total
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=ROOT, capture_output=True, text=True)
+    top_level = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        # nesting is shown by indentation, a single space marks an import of the command itself
+        if not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative)
+    return top_level, sum(top_level.values()), modules
+
+
+def run_command(name, command, runs, top):
+    best = None
+    for _ in range(runs):
+        top_level, total, modules = import_times(command)
+        if best is None or total < best[1]:
+            best = (top_level, total, modules)
+    top_level, total, modules = best
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "import_ms": round(total / 1000, 1),
+        "heavy_modules": sorted(module for module in HEAVY_MODULES if module in modules),
+        "slowest": {module: round(micros / 1000, 1) for module, micros in slowest},
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = (result["import_ms"] - before["import_ms"]) / max(before["import_ms"], 1e-9)
+        print(f"{name}: {before['import_ms']} ms -> {result['import_ms']} ms ({change:+.0%})")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark of the command line entry point")
+    parser.add_argument('-runs', type=int, default=5, help="Runs per command, the fastest is reported")
+    parser.add_argument('-top', type=int, default=5, help="Number of slowest top level imports shown")
+    parser.add_argument('-save', type=str, help="Save the results to this json file")
+    parser.add_argument('-compare', type=str, help="Compare against results saved with -save")
+    parser.add_argument('-tolerance', type=float, default=0.2,
+                        help="Relative import time increase reported as regression")
+    args = parser.parse_args()
+
+    results = {name: run_command(name, command, args.runs, args.top) for name, command in COMMANDS.items()}
+    for name, result in results.items():
+        slowest = ", ".join(f"{module} {millis} ms" for module, millis in result["slowest"].items())
+        print(f"{name:<20} {result['import_ms']:>8} ms  heavy: {','.join(result['heavy_modules']) or '-'}  "
+              f"slowest: {slowest}")
+
+    failed = [name for name in LIGHT_COMMANDS if results[name]["heavy_modules"]]
+    for name in failed:
+        print(f"{name} loads {', '.join(results[name]['heavy_modules'])}")
+
+    if args.save:
+        with open(args.save, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            failed += compare(results, json.load(baseline_file), args.tolerance)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Compares the bytes written per entry by the old per step ffmpeg passes (metadata remux, cover remux, still frame
+encode, each into a temp file that is copied back) against a single PostProcessPlan pass.
+
+usage: python benchmarks/bench_postprocess.py [-duration 600] [-entries 3]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from PostProcessor import PostProcessPlan  # noqa: E402
+
+META_DATA = {"title": "Benchmark", "artist": "Bench", "album": "Fixtures", "genre": "Test",
+             "release_date": "20240101", "track_number": "1"}
+
+
+def run_ffmpeg(cmd):
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_fixtures(work_dir, duration):
+    source = os.path.join(work_dir, "source.mp4")
+    cover = os.path.join(work_dir, "cover.jpg")
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', f'testsrc=size=1280x720:rate=30:duration={duration}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', source])
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', 'testsrc=size=600x600:duration=1', '-frames:v', '1', cover])
+    return source, cover
+
+
+def legacy_passes(entry, cover):
+    """
+    The pre planner pipeline: every step remuxes the whole file into a temp file and copies it back
+    """
+    written = 0
+    steps = [
+        ['-i', entry] + sum((['-metadata', f'{k}={v}'] for k, v in META_DATA.items()), []) + ['-c', 'copy'],
+        ['-i', entry, '-i', cover, '-map', '0', '-map', '1', '-c', 'copy'],
+        ['-i', entry, '-loop', '1', '-framerate', '1', '-i', cover, '-map', '0:a', '-map', '1:v', '-c:v', 'libx264',
+         '-tune', 'stillimage', '-pix_fmt', 'yuv420p', '-r', '1', '-c:a', 'copy', '-shortest'],
+    ]
+    for step in steps:
+        temp_file = tempfile.mktemp(suffix=".mp4")
+        run_ffmpeg(['ffmpeg', '-y'] + step + [temp_file])
+        written += os.path.getsize(temp_file)
+        shutil.copy(temp_file, entry)
+        written += os.path.getsize(entry)
+        os.remove(temp_file)
+    return written
+
+
+def planned_pass(entry, output, cover):
+    plan = PostProcessPlan(entry, output).add_still_frame(cover).add_metadata(META_DATA)
+    cmd = plan.build_command(output)
+    run_ffmpeg(cmd)
+    return os.path.getsize(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes written per entry, per step passes vs single plan")
+    parser.add_argument('-duration', type=int, default=600, help="Length of the synthetic entry in seconds")
+    parser.add_argument('-entries', type=int, default=3, help="Number of entries to post-process")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source, cover = make_fixtures(work_dir, args.duration)
+        print(f"source entry: {os.path.getsize(source) / 1e6:.1f} MB, {args.duration}s")
+
+        for name in ("legacy", "planned"):
+            written = 0
+            start = time.perf_counter()
+            for index in range(args.entries):
+                entry = os.path.join(work_dir, f"{name}_{index}.mp4")
+                shutil.copy(source, entry)
+                if name == "legacy":
+                    written += legacy_passes(entry, cover)
+                else:
+                    written += planned_pass(entry, os.path.join(work_dir, f"{name}_{index}_out.mp4"), cover)
+            elapsed = time.perf_counter() - start
+            print(f"{name:8} {written / args.entries / 1e6:10.1f} MB written per entry "
+                  f"{elapsed / args.entries:8.2f}s per entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Peak memory of the results of a large playlist. Every entry of a synthetic playlist runs through the download
+pipeline with a fake download that builds an info dict the size of a real extraction (dozens of formats with signed
+urls and http headers, thumbnails, subtitles, description). The entry is finished either with the info dict kept in
+the results (the old behaviour), with a compact DownloadResult collected in the results, or with the DownloadResult
+streamed to a callback and dropped. Every mode runs in a fresh process and reports its peak rss.
+
+usage: python benchmarks/bench_result_memory.py [-entries 5000] [-formats 40] [-threads 4]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from DownloadResult import DownloadResult  # noqa: E402
+from Downloader import YTVideoDownloader  # noqa: E402
+
+MODES = ("info_dicts", "records", "streamed")
+
+
+def synthetic_info_dict(index, formats):
+    video_id = f"video{index:08d}"
+    query = "&".join(f"param{key}={'x' * 24}{index}" for key in range(10))
+    headers = {"User-Agent": "Mozilla/5.0 " + "x" * 100, "Accept": "*/*", "Accept-Language": "en-us,en;q=0.5",
+               "Sec-Fetch-Mode": "navigate"}
+    return {
+        "id": video_id,
+        "title": f"Synthetic entry {index}",
+        "webpage_url": f"https://example.com/watch?v={video_id}",
+        "duration": 180 + index % 600,
+        "description": f"Description of entry {index} " * 40,
+        "tags": [f"tag{tag}" for tag in range(30)],
+        "formats": [{
+            "format_id": str(format_id),
+            "url": f"https://cdn{format_id}.example.com/videoplayback/{video_id}?{query}",
+            "ext": "mp4" if format_id % 2 else "webm",
+            "vcodec": "avc1.64001F" if format_id % 3 else "none",
+            "acodec": "mp4a.40.2",
+            "tbr": 128.0 + format_id, "filesize": 1_000_000 + format_id, "width": 1280, "height": 720,
+            "http_headers": dict(headers),
+            "fragments": [{"url": f"sq/{fragment}", "duration": 5.0} for fragment in range(8)],
+        } for format_id in range(formats)],
+        "thumbnails": [{"url": f"https://img.example.com/{video_id}/{size}.jpg", "width": size, "height": size}
+                       for size in range(120, 1320, 60)],
+        "subtitles": {language: [{"url": f"https://example.com/sub/{video_id}.{language}.vtt", "ext": "vtt"}]
+                      for language in ("en", "de", "fr", "es", "ja")},
+        "http_headers": headers,
+    }
+
+
+def run_mode(mode, entries, formats, threads):
+    downloader = YTVideoDownloader()
+    results = {}
+    streamed = []
+
+    def fake_download(index):
+        info_dict = synthetic_info_dict(index, formats)
+        path = f"/tmp/playlist/Synthetic entry {index}.mp4"
+
+        def post_process():
+            if mode == "info_dicts":
+                return {path: info_dict}
+            return {path: DownloadResult.from_info(info_dict, path, timings={"download": 0.0, "post_process": 0.0})}
+
+        return post_process
+
+    def on_result(entry, result, error, stage):
+        if error is not None:
+            raise error
+        if mode == "streamed":
+            streamed.append(len(result))
+        else:
+            results.update(result)
+
+    def tasks():
+        for index in range(entries):
+            # flat playlist entry, the full info dict only exists while the entry is downloaded
+            yield {"id": f"video{index:08d}", "title": f"Synthetic entry {index}"}, \
+                lambda index=index: fake_download(index), on_result
+
+    sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+    try:
+        downloader._run_pipeline(tasks(), threads, threads)
+    finally:
+        sys.stdout = stdout
+        downloader.close()
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"mode": mode, "entries": len(results) or len(streamed), "peak_rss_mb": round(peak_kib / 1024, 1)}
+
+
+def run_in_child(mode, args):
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '-mode', mode, '-entries',
+                                str(args.entries), '-formats', str(args.formats), '-threads', str(args.threads)],
+                               stdout=subprocess.PIPE, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return {"mode": mode, "error": f"exit code {completed.returncode}"}
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of collected and streamed playlist results")
+    parser.add_argument('-entries', type=int, default=5000, help="Number of playlist entries")
+    parser.add_argument('-formats', type=int, default=40, help="Number of formats of every synthetic info dict")
+    parser.add_argument('-threads', type=int, default=4, help="Number of download and encode threads")
+    parser.add_argument('-mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.entries, args.formats, args.threads)))
+        return 0
+
+    info_dict_kib = len(json.dumps(synthetic_info_dict(0, args.formats))) / 1024
+    print(f"{args.entries} entries, info dict of {info_dict_kib:.0f} KiB as json")
+    for mode in MODES:
+        result = run_in_child(mode, args)
+        if "error" in result:
+            print(f"{mode:<12} {result['error']}")
+            return 1
+        print(f"{mode:<12} peak rss {result['peak_rss_mb']:>8} MB  ({result['entries']} results)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Still frame rendering over a synthetic local playlist: encoding the image for every track against looping a
+segment encoded once by the StillFrameCache.
+
+usage: python benchmarks/bench_still_frame.py [-tracks 20] [-duration 240]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from PostProcessor import PostProcessPlan, StillFrameCache  # noqa: E402
+
+
+def run_ffmpeg(cmd):
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_playlist(work_dir, duration):
+    image = os.path.join(work_dir, "album.png")
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', 'testsrc=size=1920x1080:duration=1', '-frames:v', '1', image])
+    template = os.path.join(work_dir, "track.m4a")
+    run_ffmpeg(['ffmpeg', '-y', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}', '-c:a', 'aac',
+                template])
+    return image, template
+
+
+def render(work_dir, image, template, tracks, duration, still_frame_cache):
+    start = time.perf_counter()
+    for index in range(tracks):
+        plan = PostProcessPlan(template, os.path.join(work_dir, f"out_{index}.mp4"))
+        plan.add_still_frame(image, still_frame_cache, duration)
+        if still_frame_cache:
+            plan.still_segment = still_frame_cache.segment(image)
+        run_ffmpeg(plan.build_command(plan.output_file))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per track still frame encode vs cached segment loop")
+    parser.add_argument('-tracks', type=int, default=20, help="Number of tracks in the synthetic playlist")
+    parser.add_argument('-duration', type=int, default=240, help="Length of every track in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        image, template = make_playlist(work_dir, args.duration)
+        encoded = render(work_dir, image, template, args.tracks, args.duration, None)
+        cache = StillFrameCache(os.path.join(work_dir, "cache"))
+        cached = render(work_dir, image, template, args.tracks, args.duration, cache)
+        print(f"{args.tracks} tracks of {args.duration}s")
+        print(f"encode per track {encoded / args.tracks:8.2f}s per track, {encoded:8.2f}s total")
+        print(f"cached segment   {cached / args.tracks:8.2f}s per track, {cached:8.2f}s total (includes the one encode)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Per entry setup overhead of yt_dlp: a fresh YoutubeDL instance per extraction and per download (extractor
+initialization, cookie jar, a new connection per request) against the instances of a YoutubeDLPool that are kept
+open between entries. Every entry of a playlist served by the local benchmark server is extracted and its format
+selected, no media is downloaded. The server can delay every new connection to stand in for tcp and tls handshakes.
+
+usage: python benchmarks/bench_ydl_setup.py [-size 500] [-threads 4] [-handshake_delay 0.02]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yt_dlp  # noqa: E402
+
+from YoutubeDLPool import YoutubeDLPool  # noqa: E402
+import bench_end_to_end  # noqa: E402
+
+EXTRACT_OPTS = {'no_warnings': True, 'quiet': True}
+SELECT_OPTS = {'format': 'bestvideo+bestaudio/best', 'noplaylist': True, 'no_warnings': True, 'quiet': True}
+
+
+class KeepAliveHandler(bench_end_to_end.FixtureHandler):
+    protocol_version = "HTTP/1.1"
+    handshake_delay = 0
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.handshake_delay)
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # closed YoutubeDL instances reset their idle keep alive connections
+            pass
+
+
+def fresh_entry(url):
+    with yt_dlp.YoutubeDL(dict(EXTRACT_OPTS)) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    with yt_dlp.YoutubeDL(dict(SELECT_OPTS)) as ydl:
+        ydl.process_ie_result(info, download=False)
+
+
+def pooled_entry(pool, url):
+    with pool.acquire(EXTRACT_OPTS) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    with pool.acquire(SELECT_OPTS) as ydl:
+        ydl.process_ie_result(info, download=False)
+
+
+def measure(entry, urls, threads):
+    def timed(url):
+        started = time.perf_counter()
+        entry(url)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        durations = sorted(executor.map(timed, urls))
+    return {
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "mean_ms": round(statistics.mean(durations) * 1000, 2),
+        "p50_ms": round(durations[len(durations) // 2] * 1000, 2),
+        "p95_ms": round(durations[int(len(durations) * 0.95)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YoutubeDL setup overhead per entry, fresh against pooled")
+    parser.add_argument('-size', type=int, default=500, help="Playlist size")
+    parser.add_argument('-threads', type=int, default=4, help="Worker threads")
+    parser.add_argument('-handshake_delay', type=float, default=0.02,
+                        help="Seconds the server waits on every new connection")
+    args = parser.parse_args()
+
+    KeepAliveHandler.handshake_delay = args.handshake_delay
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        with open(os.path.join(fixture_dir, "clip.mp4"), 'wb') as clip:
+            clip.write(os.urandom(64 * 1024))
+        server, base_url = bench_end_to_end.start_server(fixture_dir, KeepAliveHandler)
+        try:
+            with yt_dlp.YoutubeDL(dict(EXTRACT_OPTS, extract_flat='in_playlist')) as ydl:
+                playlist = ydl.extract_info(f"{base_url}/feed/clip.mp4/{args.size}.xml", download=False)
+            urls = [entry['url'] for entry in playlist['entries']]
+
+            results = {"fresh": measure(fresh_entry, urls, args.threads)}
+            pool = YoutubeDLPool()
+            try:
+                results["pooled"] = measure(lambda url: pooled_entry(pool, url), urls, args.threads)
+            finally:
+                pool.close()
+            results["pooled"]["instances"] = pool.created
+        finally:
+            server.shutdown()
+
+    print(f"{len(urls)} entries, {args.threads} threads, handshake delay {args.handshake_delay}s")
+    for mode, result in results.items():
+        print(f"{mode:<8} " + " ".join(f"{key}={value}" for key, value in result.items()))
+    saved = results["fresh"]["mean_ms"] - results["pooled"]["mean_ms"]
+    print(f"setup overhead saved per entry: {saved:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules live in the repository root, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from AsyncDownloader import AsyncVideoDownloader
+from DownloadResult import DownloadResult
+from Downloader import YTVideoDownloader
+
+
+class FakeDownloader(YTVideoDownloader):
+    """
+    Yields entries per job that take a moment to download, or block until cancelled if the job url says so, and
+    tracks how many of them run at the same time
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._count_lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+        self.started = threading.Event()
+        self.cancelled = []
+
+    def _job_tasks(self, job, summary, listener=None):
+        url = job["url"]
+        for index in range(job.get("entries", 4)):
+            entry = {'id': f"{url}-{index}", 'title': f"{url} {index}"}
+            yield entry, self._fake_download(url, entry), listener
+
+    def _fake_download(self, url, entry):
+        def download():
+            with self._count_lock:
+                self.running[url] = self.running.get(url, 0) + 1
+                self.peak[url] = max(self.peak.get(url, 0), self.running[url])
+            self.started.set()
+            try:
+                if url.endswith("/block"):
+                    cancel_event = self._context.cancel_event
+                    self.cancelled.append(cancel_event.wait(10))
+                else:
+                    time.sleep(0.05)
+            finally:
+                with self._count_lock:
+                    self.running[url] -= 1
+            return lambda: {f"{entry['id']}.mp3": DownloadResult.from_info(entry, f"{entry['id']}.mp3")}
+        return download
+
+
+@pytest.fixture
+def async_downloader():
+    async_downloader = AsyncVideoDownloader(FakeDownloader(), threads=4, encode_threads=2)
+    yield async_downloader
+    async_downloader.close()
+    async_downloader.downloader.close()
+
+
+async def collect(async_downloader, jobs):
+    return [result async for result in async_downloader.download_many_async(jobs)]
+
+
+def test_job_threads_cap_its_downloads(async_downloader):
+    results = asyncio.run(collect(async_downloader, [
+        {"url": "https://example.com/one", "output_dir": "out", "threads": 1},
+        {"url": "https://example.com/shared", "output_dir": "out"}]))
+    assert len(results) == 8 and all(result["error"] is None for result in results)
+    peak = async_downloader.downloader.peak
+    assert peak["https://example.com/one"] == 1
+    assert peak["https://example.com/shared"] > 1
+
+
+def test_cancelling_the_consumer_aborts_running_downloads(async_downloader):
+    downloader = async_downloader.downloader
+
+    async def cancel_midway():
+        consumer = asyncio.ensure_future(collect(async_downloader, [
+            {"url": "https://example.com/block", "output_dir": "out"}]))
+        await asyncio.get_running_loop().run_in_executor(None, downloader.started.wait, 10)
+        consumer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await consumer
+
+    started = time.monotonic()
+    asyncio.run(cancel_midway())
+    # the executor threads return once they see the cancel event, instead of waiting for their timeout
+    while sum(downloader.running.values()):
+        assert time.monotonic() - started < 5
+        time.sleep(0.01)
+    assert downloader.cancelled and all(downloader.cancelled)
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import BandwidthLimiter as limiter_module
+from BandwidthLimiter import BandwidthLimiter, parse_rate
+
+KB = 1024
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(limiter_module.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(limiter_module.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.mark.parametrize("value, rate", [
+    ("500K", 500 * KB), ("2.5M", int(2.5 * KB * KB)), ("1G", KB ** 3), ("1t", KB ** 4), ("100", 100),
+    ("2MiB/s", 2 * KB * KB), (" 64 kb ", 64 * KB), (1500, 1500), (None, None), ("", None), ("0", None), (0, None),
+])
+def test_parse_rate(value, rate):
+    assert parse_rate(value) == rate
+
+
+@pytest.mark.parametrize("value", ["fast", "1X", "-5M", "1.2.3M", "M"])
+def test_parse_rate_rejects_invalid_input(value):
+    with pytest.raises(ValueError, match="Invalid rate"):
+        parse_rate(value)
+
+
+def test_unlimited_never_waits(clock):
+    limiter = BandwidthLimiter()
+    for _ in range(100):
+        limiter.consume(10 * KB * KB)
+    assert clock.slept == []
+
+
+def test_consume_holds_throughput_at_the_rate(clock):
+    limiter = BandwidthLimiter("100K")
+    started = clock.now
+    for _ in range(50):
+        limiter.consume(20 * KB)
+    # 1000 KB at 100 KB/s, the bucket starts empty
+    assert clock.now - started == pytest.approx(10)
+
+
+def test_idle_bucket_saves_up_one_burst(clock):
+    limiter = BandwidthLimiter("100K", burst_seconds=2)
+    clock.now += 60
+    limiter.consume(200 * KB)
+    assert clock.slept == []
+    limiter.consume(100 * KB)
+    assert clock.slept == [pytest.approx(1)]
+
+
+def test_set_rate_applies_to_running_downloads(clock):
+    limiter = BandwidthLimiter("100K")
+    started = clock.now
+    limiter.consume(100 * KB)
+    assert clock.now - started == pytest.approx(1)
+    limiter.set_rate("400K", "50K")
+    assert limiter.entry_rate == 50 * KB
+    started = clock.now
+    limiter.consume(100 * KB)
+    assert clock.now - started == pytest.approx(0.25)
+    limiter.set_rate(None)
+    started = clock.now
+    limiter.consume(100 * KB * KB)
+    assert clock.now == started
+
+
+def test_cancel_event_stops_waiting(clock):
+    limiter = BandwidthLimiter("1K")
+    cancel_event = threading.Event()
+    cancel_event.set()
+    limiter.consume(100 * KB * KB, cancel_event)
+    assert clock.slept == []
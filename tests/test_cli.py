@@ -0,0 +1,54 @@
+import io
+import sys
+
+import pytest
+
+import Main
+from VideoDownloaderCLI import VideoDownloaderCLI
+
+DEFAULTS = {"directory": "out", "file_format": "mp4", "image": None, "file_name_template": "{title}",
+            "single_frame_video": False, "low_hardware_mode": False}
+
+
+def test_batch_file_lines_override_the_defaults(tmp_path):
+    batch_file = tmp_path / "batch.txt"
+    batch_file.write_text(
+        "# playlists to sync\n"
+        "https://example.com/a\n"
+        "\n"
+        "https://example.com/b file_format=mp3 directory='My Music/Rock' # the rest is a comment\n"
+        "\"https://example.com/c?list=1&index=2\" single_frame_video=yes low_hardware_mode=false "
+        "file_name_template=\"{artist} - {title}\"\n")
+    jobs = VideoDownloaderCLI.read_batch_file(str(batch_file), DEFAULTS)
+    assert jobs == [
+        dict(DEFAULTS, url="https://example.com/a"),
+        dict(DEFAULTS, url="https://example.com/b", file_format="mp3", directory="My Music/Rock"),
+        dict(DEFAULTS, url="https://example.com/c?list=1&index=2", single_frame_video=True,
+             file_name_template="{artist} - {title}"),
+    ]
+
+
+@pytest.mark.parametrize("line", ["https://example.com/a quality=720p", "https://example.com/a file_format"])
+def test_batch_file_rejects_unknown_options_with_their_line(tmp_path, line):
+    batch_file = tmp_path / "batch.txt"
+    batch_file.write_text(f"https://example.com/ok\n{line}\n")
+    with pytest.raises(ValueError, match=r"batch.txt:2: unknown option"):
+        VideoDownloaderCLI.read_batch_file(str(batch_file), DEFAULTS)
+
+
+def test_batch_file_from_stdin(monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO("https://example.com/a image=cover.png\n"))
+    assert VideoDownloaderCLI.read_batch_file("-", DEFAULTS) == [
+        dict(DEFAULTS, url="https://example.com/a", image="cover.png")]
+
+
+@pytest.mark.parametrize("arguments, message", [
+    (["-url", "https://example.com/a", "-batch", "batch.txt"], "not allowed with argument"),
+    ([], "one of -url or -batch is required"),
+])
+def test_url_and_batch_are_exclusive(monkeypatch, capsys, arguments, message):
+    monkeypatch.setattr(sys, "argv", ["Main.py", "-directory", "out"] + arguments)
+    with pytest.raises(SystemExit) as exit_info:
+        Main.main()
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
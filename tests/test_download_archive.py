@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import pytest
+
+from DownloadArchive import DownloadArchive
+from Downloader import YTVideoDownloader
+
+
+@pytest.fixture
+def output(tmp_path):
+    path = tmp_path / "Song.mp3"
+    path.write_bytes(b"audio data")
+    return str(path)
+
+
+def test_key_of_prefers_extractor_key():
+    assert DownloadArchive.key_of({'extractor_key': 'Youtube', 'extractor': 'youtube:tab', 'id': 'a'}) == (
+        "youtube", "a")
+    assert DownloadArchive.key_of({'ie_key': 'Generic', 'id': 'b'}) == ("generic", "b")
+    assert DownloadArchive.key_of({'id': 'c'}) == (None, "c")
+
+
+def test_record_survives_a_new_archive(tmp_path, output):
+    DownloadArchive(str(tmp_path)).record("youtube", "a", "mp3", output, ["tagged"])
+    archive = DownloadArchive(str(tmp_path))
+    assert archive.contains("youtube", "a", "mp3")
+    assert not archive.contains("youtube", "a", "flac")
+    record = archive.get("youtube", "a", "mp3")
+    assert record["size"] == len(b"audio data")
+    assert record["postprocess_state"] == "tagged"
+
+
+def test_missing_output_is_not_contained(tmp_path, output):
+    archive = DownloadArchive(str(tmp_path))
+    archive.record("youtube", "a", "mp3", output)
+    os.remove(output)
+    assert not archive.contains("youtube", "a", "mp3")
+
+
+def test_playlist_rerun_skips_archived_entries(tmp_path, output):
+    DownloadArchive(str(tmp_path)).record("youtube", "a", "mp3", output)
+    downloader = YTVideoDownloader()
+    downloader._preflight_playlist = lambda *args, **kwargs: None
+    downloader._entry_download = lambda entry, *args: entry['id']
+    results = []
+    try:
+        info_dict = {'_type': 'playlist', 'title': 'list', 'entries': [
+            {'id': 'a', 'ie_key': 'Youtube', 'title': 'Song'}, {'id': 'b', 'ie_key': 'Youtube', 'title': 'Other'}]}
+        tasks = list(downloader._playlist_tasks(str(tmp_path), info_dict, "mp3", False,
+                                                lambda *result: results.append(result)))
+    finally:
+        downloader.close()
+    assert [download for _, download, _ in tasks] == ["b"]
+    (entry, result, error, stage), = results
+    assert entry['id'] == "a" and error is None and stage == "Skipped"
+    assert result[output].status == "skipped"
+
+
+def test_prune_missing_only(tmp_path, output):
+    archive = DownloadArchive(str(tmp_path))
+    archive.record("youtube", "a", "mp3", output)
+    archive.record("youtube", "b", "mp3", str(tmp_path / "Gone.mp3"))
+    assert archive.prune() == 1
+    assert [record["video_id"] for record in archive.query()] == ["a"]
+
+
+def test_prune_older_than(tmp_path, output, monkeypatch):
+    archive = DownloadArchive(str(tmp_path))
+    archive.record("youtube", "old", "mp3", output)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+    archive.record("youtube", "new", "mp3", output)
+    assert archive.prune(missing_only=False, older_than=1800) == 1
+    assert [record["video_id"] for record in archive.query()] == ["new"]
+
+
+def test_query_filters(tmp_path, output):
+    archive = DownloadArchive(str(tmp_path))
+    archive.record("youtube", "a", "mp3", output)
+    archive.record("youtube", "a", "flac", output)
+    archive.record("vimeo", "b", "mp3", output)
+    assert len(archive.query()) == 3
+    assert {record["video_id"] for record in archive.query(extractor="youtube")} == {"a"}
+    assert {record["extractor"] for record in archive.query(file_format="mp3")} == {"youtube", "vimeo"}
+
+
+def test_concurrent_writers(tmp_path, output):
+    # two archives of the same directory, as two runs syncing it would hold, written to from several threads each
+    archives = [DownloadArchive(str(tmp_path)), DownloadArchive(str(tmp_path))]
+    errors = []
+
+    def write(index):
+        try:
+            for number in range(25):
+                archives[index % 2].record("youtube", f"{index}-{number}", "mp3", output)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(DownloadArchive(str(tmp_path)).query()) == 8 * 25
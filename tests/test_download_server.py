@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+import pytest
+
+from DownloadClient import DownloadClient
+from DownloadServer import DownloadServer, JobStore
+from Downloader import YTVideoDownloader
+
+
+class FakeDownloader(YTVideoDownloader):
+    """
+    Runs no downloads, records the jobs it got and, if block is set, keeps jobs of block urls running until they
+    are cancelled
+    """
+
+    def __init__(self, block: bool):
+        super().__init__()
+        self.block = block
+        self.jobs = []
+
+    def _job_tasks(self, job, summary, on_result):
+        self.jobs.append(job)
+        if self.block and job["url"].endswith("/block"):
+            # on_result is bound to the queued job
+            on_result.args[0].cancel_event.wait(10)
+        return
+        yield
+
+
+def wait_for_state(client, job_id, state):
+    deadline = time.monotonic() + 10
+    while client.status(job_id)["state"] != state:
+        assert time.monotonic() < deadline, f"job {job_id} did not reach {state}"
+        time.sleep(0.02)
+
+
+def stored_records(state_dir):
+    with open(os.path.join(state_dir, JobStore.file_name), encoding='utf-8') as store:
+        return [json.loads(line) for line in store]
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    return str(tmp_path / "state")
+
+
+def start(state_dir, block=True):
+    downloader = FakeDownloader(block)
+    server = DownloadServer(state_dir, port=0, workers=1, downloader=downloader)
+    server.start()
+    return server, downloader, DownloadClient(f"http://127.0.0.1:{server.port}", timeout=10)
+
+
+def test_jobs_resume_after_restart(state_dir, tmp_path):
+    server, downloader, client = start(state_dir)
+    try:
+        done = client.submit({"url": "https://example.com/done", "output_dir": str(tmp_path)})
+        assert client.wait(done, interval=0.02)["state"] == "done"
+        with pytest.raises(RuntimeError, match="status 400"):
+            client.submit({"url": "https://example.com/video"})
+        running = client.submit({"url": "https://example.com/block", "output_dir": str(tmp_path)})
+        wait_for_state(client, running, "running")
+        queued = client.submit({"url": "https://example.com/queued", "output_dir": str(tmp_path)})
+        assert client.status(queued)["state"] == "queued"
+        assert [job["id"] for job in client.jobs()] == [done, running, queued]
+    finally:
+        server.stop()
+    # the finished job was compacted away, the interrupted ones stay
+    assert {record.get("id") for record in stored_records(state_dir)} == {None, running, queued}
+
+    server, downloader, client = start(state_dir, block=False)
+    try:
+        assert client.wait(queued, interval=0.02)["state"] == "done"
+        assert [(job["url"], job["resume"]) for job in downloader.jobs] == [
+            ("https://example.com/block", True), ("https://example.com/queued", True)]
+        # ids of the old jobs are not reused
+        assert client.submit({"url": "https://example.com/new", "output_dir": str(tmp_path)}) == queued + 1
+    finally:
+        server.stop()
+
+
+def test_cancel_over_the_api(state_dir, tmp_path):
+    server, downloader, client = start(state_dir)
+    try:
+        job_id = client.submit({"url": "https://example.com/block", "output_dir": str(tmp_path)})
+        wait_for_state(client, job_id, "running")
+        assert client.cancel(job_id)
+        assert client.wait(job_id, interval=0.02)["state"] == "cancelled"
+        assert not client.cancel(job_id)
+        with pytest.raises(RuntimeError, match="status 404"):
+            client.status(job_id + 1)
+    finally:
+        server.stop()
+    assert JobStore(state_dir).unfinished() == {}
+
+
+def test_store_is_compacted_after_many_appends(state_dir, monkeypatch):
+    monkeypatch.setattr(JobStore, "compact_after", 5)
+    store = JobStore(state_dir)
+    job_ids = [store.add({"url": f"https://example.com/{index}", "output_dir": "out"}) for index in range(3)]
+    for _ in range(10):
+        for job_id in job_ids:
+            store.record(job_id, "running")
+        assert len(stored_records(state_dir)) <= 1 + len(job_ids) + store.compact_after
+    store.record(job_ids[0], "done")
+    assert JobStore(state_dir).unfinished() == {job_id: {"url": f"https://example.com/{index}", "output_dir": "out"}
+                                                for index, job_id in enumerate(job_ids) if index}
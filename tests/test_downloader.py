@@ -0,0 +1,141 @@
+import contextlib
+
+import pytest
+import yt_dlp
+
+from Downloader import YTVideoDownloader
+from PostProcessor import PostProcessPlan
+from QualityPolicy import QualityPolicy
+
+
+class FakeYoutubeDL:
+    def __init__(self, success: bool):
+        self.success = success
+        self.downloaded = []
+
+    @staticmethod
+    def process_ie_result(info_dict, download=False):
+        info_dict['requested_formats'] = [
+            {'format_id': '140', 'ext': 'm4a', 'url': 'https://example.com/audio', 'protocol': 'https'}]
+        return info_dict
+
+    def dl(self, name, info):
+        self.downloaded.append(name)
+        return self.success, True
+
+
+@pytest.fixture
+def downloader():
+    downloader = YTVideoDownloader()
+    yield downloader
+    downloader.close()
+
+
+def use_ydl(downloader, ydl):
+    downloader.ydl_pool.acquire = lambda ydl_opts: contextlib.nullcontext(ydl)
+
+
+def test_failed_stream_download_raises(downloader, tmp_path):
+    use_ydl(downloader, FakeYoutubeDL(success=False))
+    with pytest.raises(yt_dlp.utils.DownloadError, match="Could not download stream 140"):
+        downloader._download_selected_streams({'id': 'video', 'webpage_url': 'https://example.com/watch'},
+                                              str(tmp_path), "video", "bestaudio")
+
+
+def test_downloaded_streams_are_returned(downloader, tmp_path):
+    ydl = FakeYoutubeDL(success=True)
+    use_ydl(downloader, ydl)
+    source_files = downloader._download_selected_streams({'id': 'video'}, str(tmp_path), "video", "bestaudio")
+    assert source_files == ydl.downloaded
+    assert source_files[0].endswith("video.f140.m4a")
+
+
+@pytest.mark.parametrize("file_format, fetched", [("wav", False), ("mp3", True)])
+def test_cover_is_only_prepared_for_formats_embedding_one(downloader, monkeypatch, tmp_path, file_format, fetched):
+    covers = []
+    downloader._download_streams = lambda url, info_dict, output_dir, file_name, format_selector: []
+    downloader._tag_audio = lambda output_file_path, meta_data=None, cover_image=None: None
+    downloader.cover_cache.get = lambda source, max_dimension=None: covers.append(source) or source
+    monkeypatch.setattr(PostProcessPlan, "run", lambda plan: plan.output_file)
+    downloader._download_audio("https://example.com/watch", str(tmp_path),
+                               {"id": "video", "title": "Song", "thumbnail": "https://example.com/thumb.jpg"},
+                               file_format, with_meta=False)
+    assert bool(covers) == fetched
+
+
+def test_format_selection_drops_streams_selected_before():
+    formats = [{'format_id': 'audio', 'url': 'https://example.com/a', 'ext': 'm4a', 'acodec': 'mp4a', 'vcodec': 'none',
+                'tbr': 128, 'protocol': 'https'},
+               {'format_id': 'video', 'url': 'https://example.com/v', 'ext': 'mp4', 'acodec': 'none', 'vcodec': 'avc1',
+                'height': 1080, 'tbr': 4000, 'protocol': 'https'}]
+    info_dict = {'id': 'video', 'title': 'Video', 'extractor': 'generic', 'extractor_key': 'Generic',
+                 'webpage_url': 'https://example.com/watch', 'formats': formats}
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        # playlist entries come processed with the default selection, video and audio
+        info_dict = ydl.process_ie_result(info_dict, download=False)
+    with yt_dlp.YoutubeDL({'quiet': True, 'format': 'bestaudio'}) as ydl:
+        selected = YTVideoDownloader._select_formats(ydl, info_dict)
+    assert selected['format_id'] == 'audio'
+    assert selected.get('requested_formats') is None
+
+
+def test_playlist_preflight_sizes_entries_with_the_job_quality(downloader, tmp_path):
+    formats = [{'format_id': 'audio', 'url': 'https://example.com/a', 'ext': 'm4a', 'acodec': 'mp4a', 'vcodec': 'none',
+                'filesize': 3_000_000, 'protocol': 'https'},
+               {'format_id': '1080', 'url': 'https://example.com/1080', 'ext': 'mp4', 'acodec': 'none',
+                'vcodec': 'avc1', 'height': 1080, 'filesize': 900_000_000, 'protocol': 'https'},
+               {'format_id': '360', 'url': 'https://example.com/360', 'ext': 'mp4', 'acodec': 'none',
+                'vcodec': 'avc1', 'height': 360, 'filesize': 50_000_000, 'protocol': 'https'}]
+    entries = [{'id': f'video{index}', 'title': f'Video {index}', 'extractor': 'generic', 'extractor_key': 'Generic',
+                'webpage_url': f'https://example.com/watch?v={index}', 'formats': formats} for index in range(4)]
+    checked = []
+    downloader.staging.preflight = lambda staging_dir, output_dir, output_bytes, staging_bytes: checked.append(
+        output_bytes)
+
+    downloader._preflight_playlist(str(tmp_path), entries, None, "mp3")
+    downloader._preflight_playlist(str(tmp_path), entries, None, "mp4", quality=QualityPolicy(max_height=360))
+    downloader._preflight_playlist(str(tmp_path), entries, None, "mp4")
+    assert checked == [4 * 3_000_000, 4 * 53_000_000, 4 * 903_000_000]
+
+
+@pytest.mark.parametrize("streams, label", [
+    ([{'vcodec': 'none', 'acodec': 'opus'}], "audio only"),
+    ([{'vcodec': 'avc1', 'width': 1920, 'height': 1080}, {'vcodec': 'none', 'acodec': 'mp4a'}], "1920x1080"),
+    ([{'vcodec': 'none', 'acodec': 'mp4a'}, {'vcodec': 'vp9', 'resolution': '1280x720'}], "1280x720"),
+    # a video without reported dimensions is not audio
+    ([{'vcodec': 'avc1'}], "unknown"),
+    ([{'url': 'https://example.com/video.mp4'}], "unknown"),
+])
+def test_dry_run_labels_resolution_from_selected_streams(streams, label):
+    assert YTVideoDownloader._resolution_label(streams) == label
+
+
+def fail_single_video(downloader, error):
+    info_dict = {'id': 'video', 'title': 'Video', 'webpage_url': 'https://example.com/watch'}
+    downloader._playlist_extractor = lambda lazy_playlist: contextlib.nullcontext(None)
+    downloader._resolve_url = lambda url, ydl: dict(info_dict)
+
+    def download_video(*args, **kwargs):
+        raise error
+    downloader._download_video = download_video
+
+
+def test_failed_single_video_is_reported_to_on_result(downloader, tmp_path):
+    fail_single_video(downloader, yt_dlp.utils.DownloadError("ERROR: Video unavailable"))
+    results = []
+    assert downloader.download("https://example.com/watch", str(tmp_path), retries=1, on_result=results.append) == {}
+    (result,) = results
+    assert (result.id, result.status, result.stage) == ("video", "failed", "Download")
+    assert "Video unavailable" in result.error
+
+
+def test_failed_single_video_is_yielded_by_iter_download(downloader, tmp_path):
+    fail_single_video(downloader, yt_dlp.utils.DownloadError("ERROR: Video unavailable"))
+    (result,) = list(downloader.iter_download("https://example.com/watch", str(tmp_path), retries=1))
+    assert result.status == "failed"
+
+
+def test_failed_single_video_raises_without_on_result(downloader, tmp_path):
+    fail_single_video(downloader, yt_dlp.utils.DownloadError("ERROR: Video unavailable"))
+    with pytest.raises(yt_dlp.utils.DownloadError):
+        downloader.download("https://example.com/watch", str(tmp_path), retries=1)
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import PostProcessor
+from Downloader import YTVideoDownloader
+from JobJournal import JobJournal
+
+INFO_DICT = {"id": "video1", "extractor_key": "Youtube", "title": "Song", "uploader": "Artist",
+             "webpage_url": "https://www.youtube.com/watch?v=video1", "acodec": "opus"}
+
+
+class Killed(BaseException):
+    """
+    Stands in for the worker dying between two stages
+    """
+
+
+class Run:
+    """
+    One run of the entry stages with the download, ffmpeg and tagging replaced by recording fakes
+    """
+
+    def __init__(self, monkeypatch, output_dir, kill_stage=None):
+        self.calls = []
+        self.kill_stage = kill_stage
+        self.output_dir = output_dir
+        self.downloader = YTVideoDownloader()
+        self.tagged = []
+        self.downloader._download_streams = self._download_streams
+        self.downloader._tag_audio = self._tag_audio
+        self.downloader._archive_output = lambda *args: self._stage("finish")
+        monkeypatch.setattr(PostProcessor.subprocess, "run", self._ffmpeg)
+
+    def _stage(self, stage):
+        self.calls.append(stage)
+        if stage == self.kill_stage:
+            raise Killed(stage)
+
+    def _download_streams(self, url, info_dict, output_dir, file_name, format_selector):
+        source_file = os.path.join(output_dir, f"{file_name}.f251.webm")
+        with open(source_file, 'wb') as source:
+            source.write(b"stream")
+        self._stage("download")
+        return [source_file]
+
+    def _ffmpeg(self, cmd, check=False):
+        self._stage("post_process")
+        with open(cmd[-1], 'wb') as output:
+            output.write(b"output")
+
+    def _tag_audio(self, output_file_path, meta_data=None, cover_image=None):
+        self.tagged.append(output_file_path)
+        self._stage("tag")
+
+    def __call__(self, resume):
+        journal = JobJournal(str(self.output_dir), resume)
+        try:
+            return self.downloader._download_audio(INFO_DICT["webpage_url"], str(self.output_dir), dict(INFO_DICT),
+                                                   "mp3", show_album_cover=False, journal=journal)
+        finally:
+            self.downloader.close()
+
+
+@pytest.mark.parametrize("kill_stage, resumed_calls", [
+    # killed while post-processing or tagging the staged file, the downloaded streams are reused
+    ("post_process", ["post_process", "tag", "finish"]),
+    ("tag", ["post_process", "tag", "finish"]),
+    # killed after the output was moved in place, only the remaining bookkeeping runs again
+    ("finish", ["finish"]),
+])
+def test_resume_continues_at_the_interrupted_stage(monkeypatch, tmp_path, kill_stage, resumed_calls):
+    interrupted = Run(monkeypatch, tmp_path, kill_stage)
+    with pytest.raises(Killed):
+        interrupted(resume=False)
+    journal_key = interrupted.downloader._journal_key(INFO_DICT, "mp3")
+    assert "done" not in JobJournal(str(tmp_path), resume=True).state(journal_key)["stages"]
+
+    resumed = Run(monkeypatch, tmp_path)
+    results = resumed(resume=True)
+    assert resumed.calls == resumed_calls
+    assert [result.status for result in results.values()] == ["downloaded"]
+    # finished entries are dropped from the journal once it is loaded again
+    assert JobJournal(str(tmp_path), resume=True).state(journal_key) is None
+
+
+def test_without_resume_every_stage_runs_again(monkeypatch, tmp_path):
+    with pytest.raises(Killed):
+        Run(monkeypatch, tmp_path, "tag")(resume=False)
+
+    rerun = Run(monkeypatch, tmp_path)
+    rerun(resume=False)
+    assert rerun.calls == ["download", "post_process", "tag", "finish"]
+
+
+def test_output_is_tagged_before_it_is_moved_in_place(monkeypatch, tmp_path):
+    run = Run(monkeypatch, tmp_path, "tag")
+    with pytest.raises(Killed):
+        run(resume=False)
+    assert os.path.dirname(run.tagged[0]) == str(tmp_path / ".staging")
+    assert not os.path.exists(tmp_path / "Song.mp3")
+
+
+def test_overlapping_runs_do_not_truncate_an_open_journal(tmp_path):
+    downloader = YTVideoDownloader()
+    try:
+        with downloader._report_stats():
+            journal = downloader._journal_for(str(tmp_path))
+            journal.record("youtube:video1:mp3", "downloaded", source_files=[])
+            # a second job starts and finishes while the first one is still running
+            with downloader._report_stats():
+                assert downloader._journal_for(str(tmp_path)) is journal
+            assert downloader._journal_for(str(tmp_path)) is journal
+            assert JobJournal(str(tmp_path), resume=True).reached("youtube:video1:mp3", "downloaded")
+        # once no run is left, the next run starts a new journal
+        assert downloader._journal_for(str(tmp_path)) is not journal
+    finally:
+        downloader.close()
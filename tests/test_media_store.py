@@ -0,0 +1,122 @@
+import errno
+import os
+
+import pytest
+
+import MediaStore as media_store_module
+from MediaStore import MediaStore
+
+SETTINGS = {"kind": "audio", "file_format": "mp3", "quality": "bestaudio", "meta": {"title": "Song"}}
+
+
+def failing(error_number):
+    def fail(*args, **kwargs):
+        raise OSError(error_number, os.strerror(error_number))
+    return fail
+
+
+@pytest.fixture
+def output(tmp_path):
+    path = tmp_path / "playlist a" / "Song.mp3"
+    path.parent.mkdir()
+    path.write_bytes(b"audio data")
+    return str(path)
+
+
+def leftovers(directory):
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith(".link.tmp")]
+
+
+def test_key_depends_on_video_and_settings():
+    key = MediaStore.key("youtube", "abc", SETTINGS)
+    assert key == MediaStore.key("youtube", "abc", dict(SETTINGS))
+    assert key != MediaStore.key("youtube", "abd", SETTINGS)
+    assert key != MediaStore.key("vimeo", "abc", SETTINGS)
+    assert key != MediaStore.key("youtube", "abc", dict(SETTINGS, file_format="m4a"))
+    assert key != MediaStore.key("youtube", "abc", dict(SETTINGS, meta={"title": "Other"}))
+    assert MediaStore.key(None, "abc", SETTINGS) is None
+    assert MediaStore.key("youtube", None, SETTINGS) is None
+
+
+def test_other_settings_never_reuse_a_stored_file(tmp_path, output):
+    store = MediaStore(str(tmp_path / "store"))
+    store.add(MediaStore.key("youtube", "abc", SETTINGS), output)
+    other_key = MediaStore.key("youtube", "abc", dict(SETTINGS, quality="bestaudio[acodec^=opus]"))
+    target = str(tmp_path / "playlist b" / "Song.mp3")
+    assert store.get(other_key, "mp3") is None
+    assert store.link(other_key, "mp3", target) is None
+    assert not os.path.exists(target)
+
+
+def test_hardlinks_when_possible(tmp_path, output):
+    store = MediaStore(str(tmp_path / "store"))
+    key = MediaStore.key("youtube", "abc", SETTINGS)
+    store.add(key, output)
+    target = str(tmp_path / "playlist b" / "Song.mp3")
+    assert store.link(key, "mp3", target) == "hardlink"
+    assert os.path.samefile(target, output)
+
+
+def test_cross_device_falls_back_to_reflink_symlink_and_copy(monkeypatch, tmp_path, output):
+    store = MediaStore(str(tmp_path / "store"))
+    key = MediaStore.key("youtube", "abc", SETTINGS)
+    monkeypatch.setattr(media_store_module.os, "link", failing(errno.EXDEV))
+    monkeypatch.setattr(MediaStore, "_reflink", staticmethod(failing(errno.EXDEV)))
+
+    # the store has to own its data, it copies instead of symlinking
+    store.add(key, output)
+    stored = store.get(key, "mp3")
+    assert not os.path.islink(stored)
+    assert not os.path.samefile(stored, output)
+
+    target = str(tmp_path / "playlist b" / "Song.mp3")
+    assert store.link(key, "mp3", target) == "symlink"
+    assert os.readlink(target) == os.path.abspath(stored)
+
+    monkeypatch.setattr(media_store_module.os, "symlink", failing(errno.EPERM))
+    target = str(tmp_path / "playlist c" / "Song.mp3")
+    assert store.link(key, "mp3", target) == "copy"
+    with open(target, 'rb') as linked:
+        assert linked.read() == b"audio data"
+    assert leftovers(str(tmp_path)) == []
+
+
+def test_reflink_is_used_when_hardlinks_are_not_permitted(monkeypatch, tmp_path, output):
+    store = MediaStore(str(tmp_path / "store"))
+    key = MediaStore.key("youtube", "abc", SETTINGS)
+    store.add(key, output)
+    reflinked = []
+    monkeypatch.setattr(media_store_module.os, "link", failing(errno.EPERM))
+    monkeypatch.setattr(MediaStore, "_reflink", staticmethod(
+        lambda source, target: reflinked.append(target) or MediaStore._copy(source, target)))
+    target = str(tmp_path / "playlist b" / "Song.mp3")
+    assert store.link(key, "mp3", target) == "reflink"
+    assert reflinked
+
+
+def test_link_replaces_an_existing_file(tmp_path, output):
+    store = MediaStore(str(tmp_path / "store"))
+    key = MediaStore.key("youtube", "abc", SETTINGS)
+    store.add(key, output)
+    target = tmp_path / "playlist b" / "Song.mp3"
+    target.parent.mkdir()
+    target.write_bytes(b"half written")
+    store.link(key, "mp3", str(target))
+    assert target.read_bytes() == b"audio data"
+
+
+def test_every_method_failing_raises(monkeypatch, tmp_path, output):
+    store = MediaStore(str(tmp_path / "store"))
+    key = MediaStore.key("youtube", "abc", SETTINGS)
+    store.add(key, output)
+    def partial_copy(source, target):
+        with open(target, 'wb') as partial:
+            partial.write(b"audio")
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    for method in ("_hardlink", "_reflink", "_symlink"):
+        monkeypatch.setattr(MediaStore, method, staticmethod(failing(errno.EXDEV)))
+    monkeypatch.setattr(MediaStore, "_copy", staticmethod(partial_copy))
+    with pytest.raises(OSError):
+        store.link(key, "mp3", str(tmp_path / "playlist b" / "Song.mp3"))
+    assert leftovers(str(tmp_path)) == []
@@ -0,0 +1,26 @@
+from Metrics import Metrics
+
+
+def test_resumed_bytes_are_not_counted_as_received():
+    metrics = Metrics()
+    resumed = 50 * 1024 * 1024
+    received = [metrics.on_progress({"status": "downloading", "filename": "a.part", "downloaded_bytes": resumed}),
+                metrics.on_progress({"status": "downloading", "filename": "a.part",
+                                     "downloaded_bytes": resumed + 4096}),
+                metrics.on_progress({"status": "finished", "filename": "a.part", "downloaded_bytes": resumed + 4096})]
+    assert received == [0, 4096, 0]
+    assert metrics.snapshot()["counters"]["downloaded_bytes_total"] == 4096
+
+
+def test_reported_resumed_bytes_are_the_baseline():
+    metrics = Metrics()
+    assert metrics.on_progress({"status": "downloading", "filename": "b", "downloaded_bytes": 30,
+                                "resumed_bytes": 10}) == 20
+
+
+def test_out_of_order_reports_are_counted_once():
+    metrics = Metrics()
+    for downloaded in (100, 300, 200, 400):
+        metrics.on_progress({"status": "downloading", "filename": "c", "downloaded_bytes": downloaded,
+                             "resumed_bytes": 0})
+    assert metrics.snapshot()["counters"]["downloaded_bytes_total"] == 400
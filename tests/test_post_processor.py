@@ -0,0 +1,80 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import PostProcessor
+from PostProcessor import PostProcessPlan, StillFrameCache
+
+
+def disposition(cmd: list):
+    return [cmd[index + 1] for index, arg in enumerate(cmd) if arg.startswith('-disposition')]
+
+
+def test_cover_of_audio_output_is_attached_picture():
+    plan = PostProcessPlan(["audio.webm"], "out/song.mp3").extract_audio("mp3").add_cover_image("cover.jpg")
+    cmd = plan.build_command("song.partial.mp3")
+    assert ['-map', '0:a?'] == cmd[cmd.index('-map'):cmd.index('-map') + 2]
+    assert disposition(cmd) == ['attached_pic']
+
+
+def test_cover_of_video_output_keeps_the_video_stream():
+    plan = PostProcessPlan(["video.mp4", "audio.m4a"], "out/clip.mp4").add_cover_image("cover.jpg")
+    cmd = plan.build_command("clip.partial.mp4")
+    assert disposition(cmd) == []
+
+
+def test_cover_of_retagged_audio_file_is_attached_picture():
+    # the ffmpeg fallback of native tagging remuxes the audio file into itself
+    plan = PostProcessPlan("song.partial.flac", "song.partial.flac").add_cover_image("cover.jpg")
+    assert disposition(plan.build_command("song.partial.partial.flac")) == ['attached_pic']
+
+
+@pytest.mark.parametrize("file_format", ["opus", "mka"])
+def test_opus_transcode_uses_a_sample_rate_libopus_accepts(file_format):
+    plan = PostProcessPlan(["audio.m4a"], f"out/song.{file_format}").extract_audio(file_format)
+    cmd = plan.build_command(f"song.partial.{file_format}")
+    assert cmd[cmd.index('-c:a') + 1] == 'libopus'
+    assert cmd[cmd.index('-ar') + 1] == '48000'
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+@pytest.mark.parametrize("file_format", ["opus", "mka", "mp3"])
+def test_transcode_runs(tmp_path, file_format):
+    source = str(tmp_path / "source.wav")
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration=1',
+                    '-ar', '44100', source], check=True)
+    output = str(tmp_path / f"song.{file_format}")
+    plan = PostProcessPlan([source], output, str(tmp_path)).extract_audio(file_format, source_codec="pcm_s16le")
+    assert plan.run() == output
+    assert os.path.getsize(output) > 0
+    assert not os.path.exists(source)
+
+
+def test_still_frame_cache_evicts_least_recently_used_segments(tmp_path, monkeypatch):
+    encoded = []
+
+    def fake_ffmpeg(cmd, check):
+        encoded.append(cmd[cmd.index('-i') + 1])
+        with open(cmd[-1], 'wb') as segment:
+            segment.write(b"\0" * 1000)
+    monkeypatch.setattr(PostProcessor.subprocess, "run", fake_ffmpeg)
+    cache = StillFrameCache(str(tmp_path / "cache"), max_bytes=2500)
+    images = []
+    for index in range(4):
+        image = tmp_path / f"image{index}.png"
+        image.write_bytes(f"image {index}".encode())
+        images.append(str(image))
+
+    first = cache.segment(images[0])
+    second = cache.segment(images[1])
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    # a hit makes the first segment the most recently used one
+    assert cache.segment(images[0]) == first
+    cache.segment(images[2])
+    assert os.path.exists(first) and not os.path.exists(second)
+    cache.segment(images[3])
+    assert len(os.listdir(cache.cache_dir)) == 2
+    assert encoded == [images[0], images[1], images[2], images[3]]
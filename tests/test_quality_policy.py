@@ -0,0 +1,13 @@
+import pytest
+
+from QualityPolicy import QualityPolicy
+
+
+def test_preset_caps_the_height():
+    assert QualityPolicy.from_preset("720p").max_height == 720
+    assert QualityPolicy.from_preset(None).max_height is None
+
+
+def test_invalid_preset_is_rejected():
+    with pytest.raises(ValueError, match="expected a height like 720p"):
+        QualityPolicy.from_preset("best")
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from benchmarks.bench_end_to_end import start_server
+from RangeDownloader import RangeDownloader
+
+PART_SIZE = 64 * 1024
+
+
+class Aborted(Exception):
+    pass
+
+
+@pytest.fixture
+def media(tmp_path):
+    fixture_dir = tmp_path / "fixtures"
+    fixture_dir.mkdir()
+    (fixture_dir / "clip.mp4").write_bytes(os.urandom(8 * PART_SIZE + 123))
+    server, base_url = start_server(str(fixture_dir))
+    yield f"{base_url}/media/clip_0.mp4", (fixture_dir / "clip.mp4").read_bytes()
+    server.shutdown()
+    server.server_close()
+
+
+def range_downloader(progress_hook=None):
+    downloader = RangeDownloader(connections=4, progress_hook=progress_hook)
+    downloader.min_part_size = PART_SIZE
+    downloader.chunk_size = 16 * 1024
+    return downloader
+
+
+def test_downloads_in_ranges(media, tmp_path):
+    url, content = media
+    target = tmp_path / "clip.mp4"
+    assert range_downloader().download(url, str(target))
+    assert target.read_bytes() == content
+    assert sorted(os.listdir(tmp_path)) == ["clip.mp4", "fixtures"]
+
+
+def test_small_files_are_left_to_the_caller(media, tmp_path):
+    url, _ = media
+    downloader = range_downloader()
+    downloader.min_part_size = 8 * PART_SIZE
+    assert not downloader.download(url, str(tmp_path / "clip.mp4"))
+    assert sorted(os.listdir(tmp_path)) == ["fixtures"]
+
+
+def test_interrupted_download_resumes_from_saved_offsets(media, tmp_path):
+    url, content = media
+    target = tmp_path / "clip.mp4"
+
+    def abort_midway(progress):
+        if progress["downloaded_bytes"] > len(content) // 2:
+            raise Aborted()
+    with pytest.raises(Aborted):
+        range_downloader(abort_midway).download(url, str(target))
+    # the preallocated file does not use yt_dlp's .part name, a fallback to yt_dlp must not resume its zeros
+    assert not os.path.exists(f"{target}.part")
+    assert os.path.getsize(f"{target}.ranges.part") == len(content)
+
+    reports = []
+    assert range_downloader(reports.append).download(url, str(target))
+    assert target.read_bytes() == content
+    resumed = reports[0]["resumed_bytes"]
+    assert len(content) // 2 < resumed < len(content)
+    assert reports[-1]["status"] == "finished"
+    assert not os.path.exists(f"{target}.ranges.part") and not os.path.exists(f"{target}.ranges.json")
@@ -0,0 +1,90 @@
+import errno
+
+import pytest
+import requests
+import yt_dlp
+
+from RetryScheduler import PERMANENT, THROTTLED, TRANSIENT, RetryPolicy, RetryScheduler
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@pytest.mark.parametrize("error, kind", [
+    (yt_dlp.utils.DownloadError("ERROR: unable to download video data: HTTP Error 429: Too Many Requests"),
+     THROTTLED),
+    (yt_dlp.utils.DownloadError("ERROR: unable to download video data: HTTP Error 403: Forbidden"), THROTTLED),
+    (http_error(429), THROTTLED),
+    (http_error(403), THROTTLED),
+    (yt_dlp.utils.DownloadError("ERROR: [youtube] abc: Video unavailable"), PERMANENT),
+    (yt_dlp.utils.DownloadError("ERROR: Private video"), PERMANENT),
+    (http_error(404), PERMANENT),
+    (yt_dlp.utils.ExtractorError("Sign in to confirm your age", expected=True), PERMANENT),
+    (yt_dlp.utils.DownloadError("ERROR: Connection reset by peer"), TRANSIENT),
+    (http_error(503), TRANSIENT),
+    (requests.ConnectionError("connection refused"), TRANSIENT),
+    (TimeoutError(), TRANSIENT),
+    (OSError("Connection closed at byte 100 of range 0-200"), TRANSIENT),
+    # local errors carry an errno, retrying a full disk does not free it
+    (OSError(errno.ENOSPC, "No space left on device"), None),
+    (PermissionError(errno.EACCES, "Permission denied"), None),
+    (yt_dlp.utils.DownloadCancelled("Download cancelled"), None),
+    (ValueError("bad template"), None),
+])
+def test_classify(error, kind):
+    assert RetryScheduler.classify(error) == kind
+
+
+def test_http_status_is_found_on_the_cause():
+    try:
+        try:
+            raise http_error(429)
+        except requests.HTTPError as e:
+            raise yt_dlp.utils.DownloadError("ERROR: unable to download") from e
+    except yt_dlp.utils.DownloadError as e:
+        assert RetryScheduler.classify(e) == THROTTLED
+
+
+@pytest.mark.parametrize("attempt", range(1, 8))
+def test_retry_delay_stays_within_its_bounds(attempt):
+    scheduler = RetryScheduler()
+    policy = RetryPolicy(retries=10, backoff_factor=2)
+    backoff = min(scheduler.max_delay, 2 * 2 ** (attempt - 1))
+    for _ in range(50):
+        delay = scheduler.retry_delay(TimeoutError(), attempt, policy)
+        assert backoff / 2 <= delay <= backoff
+
+
+def test_retry_delay_gives_up():
+    scheduler = RetryScheduler()
+    policy = RetryPolicy(retries=3)
+    assert scheduler.retry_delay(TimeoutError(), 3, policy) is None
+    assert scheduler.retry_delay(TimeoutError(), 1, None) is None
+    assert scheduler.retry_delay(http_error(404), 1, policy) is None
+    assert scheduler.retry_delay(OSError(errno.ENOSPC, "No space left on device"), 1, policy) is None
+
+
+def test_throttling_cools_down_only_its_host():
+    scheduler = RetryScheduler()
+    policy = RetryPolicy(retries=5, backoff_factor=1)
+    delay = scheduler.retry_delay(http_error(429), 1, policy, "a.example.com")
+    assert scheduler.throttle_cooldown / 2 <= delay <= scheduler.throttle_cooldown
+    assert 0 < scheduler.cooldown("a.example.com") <= scheduler.throttle_cooldown
+    assert scheduler.cooldown("b.example.com") == 0
+
+    # the cooldown grows while the host keeps throttling
+    second = scheduler.retry_delay(http_error(429), 2, policy, "a.example.com")
+    assert second >= scheduler.throttle_cooldown
+
+    scheduler.succeeded("a.example.com")
+    assert scheduler.cooldown("a.example.com") == 0
+    delay = scheduler.retry_delay(http_error(429), 1, policy, "a.example.com")
+    assert delay <= scheduler.throttle_cooldown
+
+
+def test_host_of():
+    assert RetryScheduler.host_of({"webpage_url": "https://www.youtube.com/watch?v=abc"}) == "www.youtube.com"
+    assert RetryScheduler.host_of({"title": "no url"}) is None
@@ -0,0 +1,150 @@
+import errno
+import os
+import time
+from collections import namedtuple
+
+import pytest
+
+import Staging as staging_module
+from Staging import Staging, move_into_place
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+MB = 1024 * 1024
+
+
+def free_space(monkeypatch, free):
+    monkeypatch.setattr(staging_module.shutil, "disk_usage", lambda path: DiskUsage(10 * free, 9 * free, free))
+
+
+def test_move_into_place_renames(tmp_path):
+    source, target = tmp_path / "a.mp3", tmp_path / "b.mp3"
+    source.write_bytes(b"new")
+    target.write_bytes(b"old")
+    move_into_place(str(source), str(target))
+    assert target.read_bytes() == b"new"
+    assert not source.exists()
+
+
+def test_move_into_place_copies_across_file_systems(tmp_path, monkeypatch):
+    source, target = tmp_path / "staging" / "a.mp3", tmp_path / "b.mp3"
+    source.parent.mkdir()
+    source.write_bytes(b"new")
+    real_replace = os.replace
+    calls = []
+
+    def replace(src, dst):
+        calls.append((src, dst))
+        if len(calls) == 1:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        real_replace(src, dst)
+    monkeypatch.setattr(staging_module.os, "replace", replace)
+
+    move_into_place(str(source), str(target))
+    assert target.read_bytes() == b"new"
+    assert not source.exists()
+    # the copy went to a temporary name next to the target first
+    assert os.path.dirname(calls[1][0]) == str(tmp_path) and ".partial" in calls[1][0]
+    assert sorted(os.listdir(tmp_path)) == ["b.mp3", "staging"]
+
+
+def test_move_into_place_removes_the_copy_when_it_fails(tmp_path, monkeypatch):
+    source, target = tmp_path / "staging" / "a.mp3", tmp_path / "b.mp3"
+    source.parent.mkdir()
+    source.write_bytes(b"new")
+    def replace(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(staging_module.os, "replace", replace)
+    with pytest.raises(OSError):
+        move_into_place(str(source), str(target))
+    # the source stays for the next attempt, no partial copy is left
+    assert source.exists()
+    assert os.listdir(tmp_path) == ["staging"]
+
+
+def test_cleanup_removes_only_stale_files(tmp_path):
+    staging = Staging()
+    output_dir = tmp_path
+    staging_dir = tmp_path / ".staging"
+    staging_dir.mkdir()
+    old = time.time() - 3 * 24 * 3600
+    stale = [staging_dir / "Song.f251.webm", output_dir / "Song.mp3.part", output_dir / "Song.partial.mp3"]
+    fresh = [staging_dir / "Other.f251.webm.part", output_dir / "Other.mp3.part"]
+    kept = [output_dir / "Song.mp3"]
+    for path in stale + fresh + kept:
+        path.write_bytes(b"data")
+    for path in stale + kept:
+        os.utime(path, (old, old))
+
+    assert staging.cleanup(str(staging_dir), str(output_dir)) == len(stale)
+    assert not any(path.exists() for path in stale)
+    assert all(path.exists() for path in fresh + kept)
+
+
+def test_dir_for_cleans_up_on_first_use(tmp_path):
+    staging = Staging()
+    staging_dir = os.path.join(tmp_path, ".staging")
+    os.makedirs(staging_dir)
+    leftover = os.path.join(staging_dir, "Song.f251.webm")
+    open(leftover, "wb").close()
+    old = time.time() - 3 * 24 * 3600
+    os.utime(leftover, (old, old))
+    assert staging.dir_for(str(tmp_path)) == staging_dir
+    assert not os.path.exists(leftover)
+
+
+def test_scratch_dir_is_separate_per_output_dir(tmp_path):
+    staging = Staging(scratch_dir=str(tmp_path / "scratch"))
+    first = staging.dir_for(str(tmp_path / "a"))
+    second = staging.dir_for(str(tmp_path / "b"))
+    assert first != second
+    assert os.path.dirname(first) == str(tmp_path / "scratch")
+
+
+def test_preflight_on_one_drive_counts_the_streams_on_top(tmp_path, monkeypatch):
+    staging = Staging()
+    staging_dir = staging.dir_for(str(tmp_path))
+    free_space(monkeypatch, staging.reserve_bytes + 150 * MB)
+    staging.preflight(staging_dir, str(tmp_path), 100 * MB, 100 * MB)
+    with pytest.raises(OSError) as error:
+        staging.preflight(staging_dir, str(tmp_path), 100 * MB, 200 * MB)
+    assert error.value.errno == errno.ENOSPC
+
+
+def test_preflight_checks_both_drives(tmp_path, monkeypatch):
+    staging = Staging(scratch_dir=str(tmp_path / "scratch"))
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    staging_dir = staging.dir_for(str(output_dir))
+    real_stat = os.stat
+    devices = {staging_dir: 1, str(output_dir): 2}
+
+    def stat(path, *args, **kwargs):
+        result = real_stat(path, *args, **kwargs)
+        if path not in devices:
+            return result
+        return os.stat_result(result[:2] + (devices[path],) + result[3:])
+    monkeypatch.setattr(staging_module.os, "stat", stat)
+    monkeypatch.setattr(staging_module.shutil, "disk_usage", lambda path: DiskUsage(
+        0, 0, staging.reserve_bytes + (300 if path == staging_dir else 50) * MB))
+
+    staging.preflight(staging_dir, str(output_dir), 50 * MB, 300 * MB)
+    with pytest.raises(OSError, match="out"):
+        staging.preflight(staging_dir, str(output_dir), 60 * MB, 300 * MB)
+    with pytest.raises(OSError, match="scratch"):
+        staging.preflight(staging_dir, str(output_dir), 50 * MB, 310 * MB)
+
+
+def test_reservations_count_as_used_until_released(tmp_path, monkeypatch):
+    staging = Staging()
+    staging_dir = staging.dir_for(str(tmp_path))
+    free_space(monkeypatch, staging.reserve_bytes + 250 * MB)
+    with staging.reserve(staging_dir, str(tmp_path), 100 * MB, 100 * MB):
+        # a second entry fits on its own but not next to the first one
+        staging.preflight(staging_dir, str(tmp_path), 100 * MB, 0)
+        with pytest.raises(OSError) as error:
+            with staging.reserve(staging_dir, str(tmp_path), 100 * MB, 100 * MB):
+                pass
+        assert error.value.errno == errno.ENOSPC
+    with staging.reserve(staging_dir, str(tmp_path), 100 * MB, 100 * MB):
+        pass
+    assert staging._reserved == {}
@@ -0,0 +1,38 @@
+import struct
+
+import pytest
+
+from Tagger import AudioTagger
+
+mutagen = pytest.importorskip("mutagen")
+from mutagen.ogg import OggPage  # noqa: E402
+
+
+def write_ogg_opus(path):
+    """
+    Writes the smallest Ogg Opus stream mutagen accepts, an opus stream copied into an .ogg output looks like this
+    """
+    pages = []
+    for sequence, packet in enumerate([b"OpusHead" + bytes([1, 2]) + struct.pack("<HIhB", 312, 48000, 0, 0),
+                                       b"OpusTags" + struct.pack("<I", 3) + b"abc" + struct.pack("<I", 0),
+                                       b"\xfc" + bytes(20)]):
+        page = OggPage()
+        page.packets = [packet]
+        page.serial = 1
+        page.sequence = sequence
+        page.position = 960 if sequence == 2 else 0
+        page.first = sequence == 0
+        page.last = sequence == 2
+        pages.append(page.write())
+    with open(path, 'wb') as file:
+        file.write(b"".join(pages))
+
+
+def test_opus_in_ogg_is_tagged_natively(tmp_path):
+    path = str(tmp_path / "song.ogg")
+    write_ogg_opus(path)
+    AudioTagger().tag(path, {"title": "Song", "artist": "Artist", "track_number": 3})
+    audio = mutagen.File(path)
+    assert type(audio).__name__ == "OggOpus"
+    assert audio.tags["title"] == ["Song"]
+    assert audio.tags["tracknumber"] == ["3"]